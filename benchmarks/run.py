@@ -0,0 +1,468 @@
+"""
+Benchmarks for the app's hot paths, against a local backend.
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json
+    python benchmarks/run.py --compare before.json after.json
+
+The UI cases drive the real App, so they need a display; on a server run
+them under Xvfb (xvfb-run python benchmarks/run.py).  Without one they are
+skipped and only the database cases run.  The window stays mapped because
+AddItemDialog grabs input, which a withdrawn root refuses.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep benchmark saves out of the real journal.
+os.environ.setdefault(
+    "TRACKING_JOURNAL",
+    os.path.join(tempfile.mkdtemp(prefix="tracking-bench-"), "journal.jsonl")
+)
+
+# Start from nothing, as a fresh install would.
+os.environ.setdefault("TRACKING_CACHE", "0")
+
+import db  # noqa: E402
+from storage import MemoryStorage, SqliteStorage  # noqa: E402
+
+TYPE_COUNTS = (10, 1000, 100000)
+UI_HABITS = 30
+UI_DAYS = 365
+REGRESSION_THRESHOLD = 0.10
+# Process start to first paint, interpreter start-up included.
+FIRST_WINDOW_TARGET_MS = 300
+DASHBOARD_HABITS = 300
+DASHBOARD_DAYS = 365
+MEMORY_HABITS = 100
+MEMORY_DAYS = 1000
+MEMORY_TYPES = 100000
+NOISE_FLOOR_MS = 0.05
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3)
+    }
+
+
+def timed(func, runs):
+    timings = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def seed(storage, habits, days):
+    """Fill a backend with habits and a record per habit per day."""
+    options = ['Great', 'Fine', 'Missed']
+    for number in range(habits):
+        storage.add_tracking_type(f"Habit {number:06d}", options, True)
+    today = datetime.date.today()
+    rows = [
+        (
+            today - datetime.timedelta(days=day),
+            f"Habit {number:06d}",
+            options[(number + day) % len(options)],
+            ""
+        )
+        for number in range(min(habits, UI_HABITS))
+        for day in range(days)
+    ]
+    if rows:
+        storage.upsert_records(rows)
+    return storage
+
+
+# Database cases
+
+def bench_tracking_types(runs):
+    results = dict()
+    for count in TYPE_COUNTS:
+        db.set_storage(seed(MemoryStorage(), count, 0))
+        cold = list()
+        for _ in range(max(1, runs // 4) if count >= 100000 else runs):
+            db.invalidate_tracking_types()
+            cold += timed(db.get_tracking_types, 1)
+        results[f"get_tracking_types[{count}]:cold"] = summarize(cold)
+        results[f"get_tracking_types[{count}]:cached"] = summarize(
+            timed(db.get_tracking_types, runs)
+        )
+    return results
+
+
+def bench_outcome_matrix(runs):
+    """The dashboard's single pivot query, every habit over a year."""
+    path = os.path.join(tempfile.mkdtemp(prefix="tracking-bench-"), "dashboard.sqlite3")
+    storage = SqliteStorage(path)
+    options = ['Great', 'Fine', 'Missed']
+    today = datetime.date.today()
+    for number in range(DASHBOARD_HABITS):
+        storage.add_tracking_type(f"Habit {number:06d}", options, True)
+    storage.upsert_records([
+        (
+            today - datetime.timedelta(days=day),
+            f"Habit {number:06d}",
+            options[(number + day) % len(options)],
+            ""
+        )
+        for number in range(DASHBOARD_HABITS)
+        for day in range(DASHBOARD_DAYS)
+    ])
+    db.set_storage(storage)
+    start_date = today - datetime.timedelta(days=DASHBOARD_DAYS - 1)
+    try:
+        return {
+            f"get_outcome_matrix[{DASHBOARD_HABITS}x{DASHBOARD_DAYS}]": summarize(
+                timed(lambda: db.get_outcome_matrix(start_date, today), runs)
+            )
+        }
+    finally:
+        db.close_storage()
+
+
+# Memory cases
+
+def retained(build):
+    """
+    Bytes still allocated after build() returns, for what it returns.
+
+    :return: (result, bytes)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_memory():
+    """What history pages and tracking types hold, per entry, at 100k."""
+    from history import HistoryCache
+    from main import PAGE_SIZE
+
+    entries = MEMORY_HABITS * MEMORY_DAYS
+    storage = seed(MemoryStorage(), MEMORY_HABITS, 0)
+    today = datetime.date.today()
+    options = ['Great', 'Fine', 'Missed']
+    storage.upsert_records([
+        (
+            today - datetime.timedelta(days=day),
+            f"Habit {number:06d}",
+            options[(number + day) % len(options)],
+            "note" if day % 7 == 0 else ""
+        )
+        for number in range(MEMORY_HABITS)
+        for day in range(MEMORY_DAYS)
+    ])
+    db.set_storage(storage)
+
+    def load_history():
+        history = HistoryCache(max_pages=entries)
+        for number in range(MEMORY_HABITS):
+            title = f"Habit {number:06d}"
+            cursor = today
+            while True:
+                page = db.get_records_page(title, cursor, PAGE_SIZE)
+                history.add_page(title, cursor, page, exhausted=len(page) < PAGE_SIZE)
+                if len(page) < PAGE_SIZE:
+                    break
+                cursor = page[-1].entry_date - datetime.timedelta(days=1)
+        return history
+
+    history, history_bytes = retained(load_history)
+    db.set_storage(seed(MemoryStorage(), MEMORY_TYPES, 0))
+    db.invalidate_tracking_types()
+    _, types_bytes = retained(db.get_tracking_types)
+    del history
+    return {
+        f"history[{entries}]": {
+            'kib': round(history_bytes / 1024),
+            'bytes_each': round(history_bytes / entries, 1)
+        },
+        f"tracking_types[{MEMORY_TYPES}]": {
+            'kib': round(types_bytes / 1024),
+            'bytes_each': round(types_bytes / MEMORY_TYPES, 1)
+        }
+    }
+
+
+# UI cases
+
+def wait_for(app, condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Gave up waiting for the app")
+        app.update()
+        time.sleep(0.001)
+
+
+def _ready(view, title):
+    return view.panel_ready and view.panel_title['text'] == title
+
+
+def bench_ui(runs):
+    import main
+
+    db.set_storage(seed(MemoryStorage(), UI_HABITS, UI_DAYS))
+    # Modal message boxes would block the run.
+    main.display_message = lambda *args, **kwargs: None
+
+    app = main.App()
+    view = app.view
+    wait_for(app, lambda: view.track_tasks and view.panel_ready)
+    titles = list(view.track_tasks)
+    results = dict()
+
+    def select(index):
+        view.listbox.selection_clear(0, "end")
+        view.listbox.selection_set(index)
+        view.listbox.event_generate("<<ListboxSelect>>")
+        wait_for(app, lambda: _ready(view, titles[index]))
+
+    cold = list()
+    for index in range(len(titles)):
+        start = time.perf_counter()
+        select(index)
+        cold.append((time.perf_counter() - start) * 1000)
+    results['on_select:cold'] = summarize(cold)
+
+    warm = list()
+    for _ in range(runs):
+        for index in range(len(titles)):
+            start = time.perf_counter()
+            select(index)
+            warm.append((time.perf_counter() - start) * 1000)
+    results['on_select:cached'] = summarize(warm)
+
+    # The UI work of a switch alone: every habit's window is cached by now,
+    # so this is rebinding the panel with no query and no event dispatch.
+    switches = list()
+    for _ in range(runs):
+        for title in titles:
+            view.selection = title
+            start = time.perf_counter()
+            view._request_panel()
+            app.update_idletasks()
+            switches.append((time.perf_counter() - start) * 1000)
+    results['panel_switch:cached'] = summarize(switches)
+
+    select(0)
+    edits = iter(range(2 * runs))
+
+    def edit_and_save(save):
+        # Save only writes changed cells, so change them all every time.
+        def run():
+            notes = f"benchmark {next(edits)}"
+            for row in view.work_rows:
+                row['drop-down'].set('Great')
+                row['notes'].delete(0, "end")
+                row['notes'].insert(0, notes)
+            start = time.perf_counter()
+            save()
+            return (time.perf_counter() - start) * 1000
+        return [run() for _ in range(runs)]
+
+    results['save_records'] = summarize(edit_and_save(view._save_records))
+
+    def save_and_flush():
+        view._save_records()
+        app.journal.flush()
+
+    results['save_records:to_backend'] = summarize(edit_and_save(save_and_flush))
+
+    added = list()
+    for number in range(runs):
+        title = f"Added {number:04d}"
+        start = time.perf_counter()
+        dialog = main.AddItemDialog(app)
+        dialog.title_value.set(title)
+        dialog.drop_down_str_values[0].set('Done')
+        dialog._on_add()
+        if dialog.result:
+            view.add_tracking_type(dialog.tracking_type)
+        wait_for(app, lambda: title in view.track_tasks)
+        added.append((time.perf_counter() - start) * 1000)
+    results['add_item_to_refresh'] = summarize(added)
+
+    app.destroy()
+    return results
+
+
+def bench_cold_start(runs):
+    """Process start to first paint, and to the first habit on screen."""
+    path = os.path.join(tempfile.mkdtemp(prefix="tracking-bench-"), "cold.sqlite3")
+    storage = seed(SqliteStorage(path), UI_HABITS, UI_DAYS)
+    storage.close()
+    env = dict(os.environ, TRACKING_BACKEND="sqlite", TRACKING_SQLITE_PATH=path)
+    first_paint = list()
+    usable = list()
+    for _ in range(runs):
+        started = time.time()
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--cold-start-child", str(started)],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        first_paint.append(timings['first_paint_ms'])
+        usable.append(timings['usable_ms'])
+    return {
+        'cold_start:first_paint': summarize(first_paint),
+        'cold_start:usable': summarize(usable)
+    }
+
+
+def cold_start_child(started):
+    import main
+
+    app = main.App()
+    app.update()
+    first_paint = (time.time() - started) * 1000
+    wait_for(app, lambda: app.view.panel_ready)
+    usable = (time.time() - started) * 1000
+    app.destroy()
+    print(json.dumps({'first_paint_ms': first_paint, 'usable_ms': usable}))
+
+
+def has_display():
+    import tkinter
+    try:
+        tkinter.Tk().destroy()
+        return True
+    except tkinter.TclError:
+        return False
+
+
+# Reporting
+
+def compare(base_path, new_path, threshold, noise_floor=NOISE_FLOOR_MS):
+    """
+    Print the change in medians; True if nothing regressed.
+
+    A regression is a median more than threshold slower, and by more than
+    noise_floor ms, so microsecond jitter on tiny cases isn't flagged.
+    """
+    with open(base_path, encoding="utf-8") as base_file:
+        base = json.load(base_file)['results']
+    with open(new_path, encoding="utf-8") as new_file:
+        new = json.load(new_file)['results']
+    regressions = list()
+    print(f"{'benchmark':40} {'base ms':>10} {'new ms':>10} {'change':>8}")
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            print(f"{name:40} {'only in ' + ('new' if name in new else 'base'):>30}")
+            continue
+        before = base[name]['median_ms']
+        after = new[name]['median_ms']
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > noise_floor:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:40} {before:10.3f} {after:10.3f} {change:+8.1%}{flag}")
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument(
+        "--only",
+        choices=("db", "memory", "ui", "cold-start"),
+        action="append",
+        help="run only these groups (repeatable)"
+    )
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--noise-floor-ms", type=float, default=NOISE_FLOOR_MS)
+    parser.add_argument("--cold-start-child", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start_child is not None:
+        cold_start_child(args.cold_start_child)
+        return
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.threshold, args.noise_floor_ms) else 1)
+
+    groups = args.only or ["db", "memory", "ui", "cold-start"]
+    results = dict()
+    memory = dict()
+    skipped = list()
+    if "db" in groups:
+        results.update(bench_tracking_types(args.runs))
+        results.update(bench_outcome_matrix(args.runs))
+    if "memory" in groups:
+        memory = bench_memory()
+    if {"ui", "cold-start"} & set(groups) and not has_display():
+        skipped = [group for group in ("ui", "cold-start") if group in groups]
+        print(f"No display, skipping: {', '.join(skipped)}", file=sys.stderr)
+    else:
+        if "ui" in groups:
+            results.update(bench_ui(args.runs))
+        if "cold-start" in groups:
+            results.update(bench_cold_start(max(1, args.runs // 4)))
+
+    targets = dict()
+    if 'cold_start:first_paint' in results:
+        first_paint = results['cold_start:first_paint']['median_ms']
+        targets['cold_start:first_paint'] = {
+            'target_ms': FIRST_WINDOW_TARGET_MS,
+            'met': first_paint <= FIRST_WINDOW_TARGET_MS
+        }
+        print(
+            f"time to first window: {first_paint:.1f} ms "
+            f"(target {FIRST_WINDOW_TARGET_MS} ms, "
+            f"{'met' if first_paint <= FIRST_WINDOW_TARGET_MS else 'MISSED'})"
+        )
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+            'skipped': skipped,
+            'targets': targets
+        },
+        'results': results,
+        'memory': memory
+    }
+    for name, summary in sorted(results.items()):
+        print(f"{name:40} median {summary['median_ms']:10.3f} ms  p95 {summary['p95_ms']:10.3f} ms")
+    for name, size in sorted(memory.items()):
+        print(f"{name:40} {size['kib']:10d} KiB  {size['bytes_each']:10.1f} bytes each")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
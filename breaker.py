@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+
+from instrumentation import stats
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend the breaker has marked down."""
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend that keeps failing, so they fail at once
+    instead of each waiting out its own timeout.
+
+    After threshold failures in a row the breaker opens: check() raises
+    CircuitOpenError and a background thread runs probe every
+    probe_seconds (with jitter) until one succeeds, which closes it.
+    """
+    def __init__(self, probe, threshold: int = 3, probe_seconds: float = 5.0):
+        self.probe = probe
+        self.threshold = threshold
+        self.probe_seconds = probe_seconds
+        self._failures = 0
+        self._open = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def check(self):
+        """
+        :raises CircuitOpenError: while the breaker is open
+        """
+        if self._open:
+            stats.count("db.breaker_rejected")
+            raise CircuitOpenError("Database unreachable, waiting for it to come back")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        """Count a failure, opening the breaker at threshold."""
+        with self._lock:
+            self._failures += 1
+            if self._open or self._failures < self.threshold:
+                return
+            self._open = True
+            stats.count("db.breaker_opened")
+            self._thread = threading.Thread(
+                target=self._probe_until_up,
+                name="db-probe",
+                daemon=True
+            )
+            self._thread.start()
+
+    def _probe_until_up(self):
+        while not self._stop.wait(jittered(self.probe_seconds)):
+            try:
+                self.probe()
+            except Exception:
+                continue
+            with self._lock:
+                self._failures = 0
+                self._open = False
+                self._thread = None
+            stats.count("db.breaker_closed")
+            return
+
+    def stop(self):
+        """Stop probing, e.g. on shutdown."""
+        self._stop.set()
+
+
+def jittered(seconds):
+    """seconds, give or take a quarter, so clients don't retry in step."""
+    return seconds * random.uniform(0.75, 1.25)
+
+
+def call_with_retry(func, *args, attempts: int = 3, base_seconds: float = 0.1,
+                    max_seconds: float = 2.0, is_transient=None, breaker=None,
+                    **kwargs):
+    """
+    Call func, retrying transient failures with jittered exponential backoff.
+
+    Each wait is random between nothing and base_seconds * 2 ** attempt
+    (at most max_seconds).  Failures that aren't transient, and any once
+    the breaker has opened, are raised straight away.
+
+    :param is_transient: exception -> bool, worth retrying
+    :param breaker: CircuitBreaker checked before every attempt
+    :return: what func returns
+    """
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.check()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            last_attempt = attempt == attempts - 1
+            if last_attempt or is_transient is None or not is_transient(e):
+                raise
+            stats.count("db.retries")
+        time.sleep(random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt)))
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from db import get_changes_since, wait_for_changes
+
+POLL_MS = int(os.getenv("TRACKING_CHANGE_POLL_MS", "15000"))
+LISTEN = os.getenv("TRACKING_CHANGE_LISTEN", "0") == "1"
+CHECK_MS = 250
+LISTEN_TIMEOUT = 1.0
+
+
+class ChangeFeed:
+    """
+    Keeps the app in step with writes from other clients.
+
+    Every poll_ms it asks the db worker for the changes since the last
+    watermark and hands them to on_changes on the Tk thread.  With listen,
+    a background thread also waits on Postgres LISTEN/NOTIFY and brings
+    the next poll forward as soon as another client commits.
+    """
+    def __init__(self, root, worker, on_changes, poll_ms: int = POLL_MS,
+                 listen: bool = LISTEN):
+        self.root = root
+        self.worker = worker
+        self.on_changes = on_changes
+        self.poll_ms = poll_ms
+        self.listen = listen
+        self.watermark = None
+        self._next_poll = None
+        self._notified = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._after_id = None
+
+    def start(self):
+        """
+        Take the starting watermark and begin polling.
+
+        Call before the first load is queued on the worker, so anything
+        written in between is picked up by the first poll.
+        """
+        self.poll()
+        if self.listen and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._listen,
+                name="change-listener",
+                daemon=True
+            )
+            self._thread.start()
+        self._after_id = self.root.after(CHECK_MS, self._check)
+
+    def poll(self):
+        """Fetch changes now."""
+        self._notified.clear()
+        self._next_poll = time.monotonic() + self.poll_ms / 1000
+        self.worker.submit(
+            get_changes_since,
+            self.watermark,
+            key='changes',
+            callback=self._on_changes
+        )
+
+    def _check(self):
+        self._after_id = None
+        if self._notified.is_set() or time.monotonic() >= self._next_poll:
+            self.poll()
+        self._after_id = self.root.after(CHECK_MS, self._check)
+
+    def _on_changes(self, changes):
+        if changes is None:
+            return
+        first = self.watermark is None
+        self.watermark = changes['watermark']
+        if first:
+            return
+        if changes['tracking_types'] or changes['records'] != list():
+            self.on_changes(changes)
+
+    def _listen(self):
+        while not self._stop.is_set():
+            if wait_for_changes(LISTEN_TIMEOUT):
+                self._notified.set()
+
+    def stop(self):
+        """Stop polling and listening."""
+        self._stop.set()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        if self._thread is not None:
+            self._thread.join(timeout=LISTEN_TIMEOUT + 1)
+            self._thread = None
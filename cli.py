@@ -0,0 +1,185 @@
+"""
+Log and look up entries without the window.
+
+    python cli.py log "Study X" Great [--date 2024-05-01] [--notes "..."]
+    python cli.py log - < entries.tsv
+    python cli.py list-types
+    python cli.py show [--days 30] ["Study X" ...]
+
+With - as the title, log reads one entry per line from stdin, either tab
+separated (title, outcome, then optionally date and notes) or a JSON object
+with the keys importer.py accepts.  A missing date is --date, or today.
+Every entry is checked against habit_tracking_types first; if any fails
+nothing is written and the exit status is 2.  Otherwise all of them are
+written in one transaction.
+
+Exit status is 0 on success, 1 if the database can't be read or written
+and 2 for entries that don't validate.  Output is tab separated.
+
+db (with dotenv, and psycopg2 on Postgres) is only imported once a command
+needs the database, so usage errors come back at interpreter speed.
+"""
+import argparse
+import datetime
+import sys
+
+EXIT_FAILED = 1
+EXIT_INVALID = 2
+STDIN = "-"
+
+
+def parse_line(line, default_date):
+    """
+    One stdin line as an importer style row.
+
+    :rtype: dict
+    """
+    from importer import parse_json_row
+
+    if line.lstrip().startswith("{"):
+        row = parse_json_row(line)
+    else:
+        fields = line.rstrip("\r\n").split("\t")
+        row = dict(zip(
+            ['entry_title', 'outcome_option', 'entry_date', 'notes'],
+            fields
+        ))
+    row.setdefault('entry_date', '')
+    if not row['entry_date']:
+        row['entry_date'] = default_date.isoformat()
+    return row
+
+
+def iter_entries(args):
+    """
+    The entries to log, from the command line or stdin.
+
+    :return: (source, row) pairs
+    """
+    if args.title != STDIN:
+        yield "argv", {
+            'entry_date': args.date.isoformat(),
+            'entry_title': args.title,
+            'outcome_option': args.outcome,
+            'notes': args.notes
+        }
+        return
+    for line_number, line in enumerate(sys.stdin, start=1):
+        if line.strip():
+            try:
+                yield f"<stdin>:{line_number}", parse_line(line, args.date)
+            except ValueError as e:
+                yield f"<stdin>:{line_number}", e
+
+
+def load_tracking_types():
+    from db import get_tracking_types
+
+    tracking_types = get_tracking_types()
+    if not tracking_types:
+        print("No habits found, or the database couldn't be read", file=sys.stderr)
+    return tracking_types
+
+
+def log(args):
+    if args.title != STDIN and args.outcome is None:
+        print("log: an outcome is needed unless the title is -", file=sys.stderr)
+        return EXIT_INVALID
+    from db import import_rows
+    from importer import validate
+
+    tracking_types = load_tracking_types()
+    if not tracking_types:
+        return EXIT_FAILED
+
+    rows = list()
+    rejected = 0
+    for source, row in iter_entries(args):
+        try:
+            if isinstance(row, Exception):
+                raise ValueError(f"unreadable line: {row}")
+            rows.append(validate(row, tracking_types))
+        except ValueError as e:
+            rejected += 1
+            print(f"{source}: {e}", file=sys.stderr)
+    if rejected:
+        print(f"{rejected} invalid, nothing written", file=sys.stderr)
+        return EXIT_INVALID
+    if rows and not import_rows(rows):
+        return EXIT_FAILED
+    return 0
+
+
+def list_types(args):
+    tracking_types = load_tracking_types()
+    if not tracking_types:
+        return EXIT_FAILED
+    for title, tracking_type in sorted(tracking_types.items()):
+        notes = "notes" if tracking_type.include_notes else ""
+        print(f"{title}\t{', '.join(tracking_type.drop_down_fields)}\t{notes}")
+    return 0
+
+
+def show(args):
+    if args.days < 1:
+        print("show: --days must be at least 1", file=sys.stderr)
+        return EXIT_INVALID
+    from db import get_records_for_titles
+
+    titles = args.titles
+    if not titles:
+        tracking_types = load_tracking_types()
+        if not tracking_types:
+            return EXIT_FAILED
+        titles = sorted(tracking_types)
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=args.days - 1)
+    records = get_records_for_titles(titles, start_date, end_date)
+    if not records:
+        return EXIT_FAILED
+    for title in titles:
+        for record in records[title]:
+            print(
+                f"{record.entry_date.isoformat()}\t{record.entry_title}\t"
+                f"{record.outcome_option or ''}\t{record.notes or ''}"
+            )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Log and look up entries without the window."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    log_parser = commands.add_parser("log", help="log an entry, or many from stdin")
+    log_parser.add_argument("title", help='the habit, or - to read entries from stdin')
+    log_parser.add_argument("outcome", nargs="?")
+    log_parser.add_argument(
+        "--date", type=datetime.date.fromisoformat, default=datetime.date.today(),
+        help="YYYY-MM-DD, default today"
+    )
+    log_parser.add_argument("--notes", default="")
+    log_parser.set_defaults(run=log)
+
+    list_parser = commands.add_parser("list-types", help="list the habits and their options")
+    list_parser.set_defaults(run=list_types)
+
+    show_parser = commands.add_parser("show", help="print recent entries, newest first")
+    show_parser.add_argument("titles", nargs="*", metavar="TITLE", help="default all habits")
+    show_parser.add_argument("--days", type=int, default=30)
+    show_parser.set_defaults(run=show)
+
+    args = parser.parse_args()
+    try:
+        status = args.run(args)
+    finally:
+        # Only if a command got as far as the database.
+        db = sys.modules.get("db")
+        if db is not None:
+            db.close_storage()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,180 +1,580 @@
-import json
 import os
-from contextlib import closing
+import threading
 import datetime
+import time
+from array import array
 
-import psycopg2
 from dotenv import load_dotenv
 
+from instrumentation import stats, timed
+from storage import make_storage, month_start, week_start, Record, TrackingType
+
 load_dotenv()
 
-POSTGRES_USER = os.getenv("POSTGRES_USER")
-POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
-POSTGRES_DB = os.getenv("POSTGRES_DB")
-POSTGRES_PORT = os.getenv("POSTGRES_PORT")
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
+TRACKING_BACKEND = os.getenv("TRACKING_BACKEND", "postgres")
+SUMMARY_WEEKS = 8
+SUMMARY_MONTHS = 6
+SEARCH_PAGE_SIZE = 20
+NO_OUTCOME = -1
+UNLISTED_OUTCOME = -2
+
+_storage = None
+_storage_lock = threading.Lock()
+
+_tracking_types_cache = {'version': None, 'types': None}
+_tracking_types_lock = threading.Lock()
 
 
-def make_connection():
+def get_storage():
     """
-    Make a database connection.
+    The storage backend picked by TRACKING_BACKEND, built on first use.
 
-    :return: connection
-    :rtype: psycopg2.extensions.connection
+    :rtype: storage.Storage
     """
-    try:
-        connection = psycopg2.connect(
-            host=POSTGRES_HOST,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            port=POSTGRES_PORT
-        )
-        return connection
-    except Exception as e:
-        print(str(e))
-        return False
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = make_storage(TRACKING_BACKEND)
+        return _storage
+
+
+def set_storage(storage):
+    """Swap in a backend, e.g. a MemoryStorage for tests or benchmarks."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+    invalidate_tracking_types()
+
 
+def close_storage():
+    """Close the backend's connections, called on app shutdown."""
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
 
-def write_new_tracking_type(data: dict):
+
+def _storage_failed(e):
+    """Report an exception raised by the storage backend."""
+    stats.count("db.errors")
+    print(str(e))
+
+
+def tracking_type_row(tracking_type: TrackingType):
+    """
+    Check a TrackingType's fields and turn it into an insert row.
+
+    :return: (title, drop_down_values, include_notes)
+    :rtype: tuple
+    :raises TypeError: if a field has the wrong type
+    """
+    title, drop_down_values, include_notes = tracking_type
+    if not isinstance(title, str):
+        raise TypeError(f"title must be a str, not {title!r}")
+    if not all(isinstance(value, str) for value in drop_down_values):
+        raise TypeError(f"drop-down values must be str: {drop_down_values!r}")
+    if not isinstance(include_notes, bool):
+        raise TypeError(f"include_notes must be a bool, not {include_notes!r}")
+    return title, list(drop_down_values), include_notes
+
+
+@timed("db.write_new_tracking_type")
+def write_new_tracking_type(tracking_type: TrackingType):
     """
     Write a new habit metadata to db.
 
-    sql:
-        CREATE TABLE IF NOT EXISTS habit_tracking_types
-        (
-            id SERIAL PRIMARY KEY,
-            title text,
-            drop_down_fields jsonb,
-            include_notes boolean
-        );
-    :param data:
-    :return:
-    """
-    conn = make_connection()
-    if not conn:
-        return False
+    A title that already exists is left alone, so replaying the same
+    write is harmless.
 
+    :return: Success status
+    :rtype: bool
+    """
     try:
-        title = data.get('title')
-        drop_down_values = data.get('drop-down')
-        include_notes = data.get('note')
-        assert isinstance(title, str)
-        assert isinstance(drop_down_values, list)
-        assert isinstance(include_notes, bool)
+        row = tracking_type_row(tracking_type)
     except Exception as e:
         print(str(e))
         return False
+
     try:
-        with closing(conn):
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO habit_tracking_types (
-                        title,
-                        drop_down_fields,
-                        include_notes
-                        )
-                    VALUES (%s, %s, %s);
-                    """,
-                    (title, json.dumps(drop_down_values), include_notes)
-                )
-                conn.commit()
-                return True
+        get_storage().add_tracking_type(*row)
+        invalidate_tracking_types()
+        return True
     except Exception as e:
-        print(str(e))
+        _storage_failed(e)
         return False
 
 
-def get_tracking_types():
+@timed("db.replay_tracking_type")
+def replay_tracking_type(tracking_type: TrackingType):
+    """
+    write_new_tracking_type for the journal.  Failures are raised so the
+    caller can tell a rejected habit (see rejects) from one worth retrying.
+    """
+    row = tracking_type_row(tracking_type)
+    try:
+        get_storage().add_tracking_type(*row)
+    except Exception:
+        stats.count("db.errors")
+        raise
+    invalidate_tracking_types()
+
+
+def rejects(e):
+    """
+    True if e means the write itself is bad: a field of the wrong type, or
+    data the backend refuses.  Sending it again won't help, unlike after a
+    lost connection or a timeout.
+    """
+    return isinstance(e, (TypeError, ValueError)) or get_storage().rejects(e)
+
+
+def invalidate_tracking_types():
+    """Drop the cached tracking types so the next read goes to the db."""
+    with _tracking_types_lock:
+        _tracking_types_cache['version'] = None
+        _tracking_types_cache['types'] = None
+
+
+@timed("db.get_tracking_types")
+def get_tracking_types(revalidate=False):
     """
     Get data for all fields being tracked.
 
-    :return: fields or empty dict on failure
+    Served from memory once loaded.  With revalidate the cached copy is
+    checked against the backend's watermark (count, max(id) and, on
+    Postgres, max(change_seq)) and only reloaded if the table changed.
+
+    :param revalidate: check the cache against the db first
+    :return: {title: TrackingType}, or empty dict on failure
     :rtype: dict
     """
+    with _tracking_types_lock:
+        cached = _tracking_types_cache['types']
+        cached_version = _tracking_types_cache['version']
+    if cached is not None and not revalidate:
+        return dict(cached)
+
     tracking_fields = dict()
-    conn = make_connection()
-    if not conn:
-        return tracking_fields
-
-    try:
-        with closing(conn):
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT
-                        title, drop_down_fields, include_notes
-                    FROM habit_tracking_types;
-                    """
-                )
-                data = cursor.fetchall()
-                for field in data:
-                    title = field[0]
-                    drop_down_fields = field[1]
-                    include_notes = field[2]
-                    tracking_fields[title] = {
-                        'drop-down-fields': drop_down_fields,
-                        'include_notes': include_notes
-                    }
-        return tracking_fields
+    try:
+        storage = get_storage()
+        version = storage.tracking_types_version()
+        if cached is not None and version == cached_version:
+            return dict(cached)
+        tracking_fields = tracking_types_from_rows(storage.tracking_types())
     except Exception as e:
-        print(str(e))
-        return tracking_fields
+        _storage_failed(e)
+        return dict(cached) if cached is not None else tracking_fields
+
+    with _tracking_types_lock:
+        _tracking_types_cache['version'] = version
+        _tracking_types_cache['types'] = tracking_fields
+    return dict(tracking_fields)
+
+
+def read_tracking_types():
+    """
+    All habits, read from the backend every time.
+
+    Unlike get_tracking_types, failures are raised, so an empty dict
+    really means there are no habits.
+
+    :rtype: dict[str, TrackingType]
+    """
+    try:
+        return tracking_types_from_rows(get_storage().tracking_types())
+    except Exception:
+        stats.count("db.errors")
+        raise
+
+
+def tracking_types_from_rows(rows):
+    """
+    TrackingTypes by title from (title, drop_down_fields, include_notes)
+    rows.  Habits with the same options share one tuple of them.
+
+    :rtype: dict[str, TrackingType]
+    """
+    options = dict()
+    tracking_types = dict()
+    for title, drop_down_fields, include_notes in rows:
+        drop_down_fields = tuple(drop_down_fields or ())
+        tracking_types[title] = TrackingType(
+            title=title,
+            drop_down_fields=options.setdefault(drop_down_fields, drop_down_fields),
+            include_notes=bool(include_notes)
+        )
+    return tracking_types
 
 
-def add_record(data: dict):
+def record_row(record: Record):
+    """
+    Check a Record's fields and turn it into an upsert row.
+
+    :return: Record, with a datetime narrowed to its date
+    :rtype: Record
+    :raises TypeError: if a field has the wrong type
+    """
+    date, entry_title, outcome_option, notes = record
+    if not isinstance(date, datetime.date):
+        raise TypeError(f"entry_date must be a date, not {date!r}")
+    for name, value in (('entry_title', entry_title),
+                        ('outcome_option', outcome_option),
+                        ('notes', notes)):
+        if not isinstance(value, str):
+            raise TypeError(f"{name} must be a str, not {value!r}")
+    return Record(
+        datetime.date(date.year, date.month, date.day),
+        entry_title,
+        outcome_option,
+        notes
+    )
+
+
+def add_record(record: Record):
     """
     Add or update a record
 
-    sql:
-        CREATE TABLE IF NOT EXISTS habit_tracking_fields (
-            id SERIAL PRIMARY KEY,
-            entry_date DATE NOT NULL,
-            entry_title TEXT NOT NULL,
-            outcome_option TEXT,
-            notes TEXT,
-            UNIQUE (entry_date, entry_title)
-        );
     :return: Success status
     :rtype: bool
     """
-    conn = make_connection()
-    if not conn:
+    return add_records([record])[0]
+
+
+@timed("db.add_records")
+def add_records(records: list):
+    """
+    Add or update many records in one statement and one commit.
+
+    Rows that fail validation are skipped, the rest are upserted together.
+    If the same (date, title) shows up twice the last one wins.
+
+    :param records: Records
+    :return: success status per record, in the order given
+    :rtype: list
+    """
+    results = [False] * len(records)
+    valid = list()
+    rows = dict()
+    for index, record in enumerate(records):
+        try:
+            row = record_row(record)
+        except Exception as e:
+            print(str(e))
+            continue
+        valid.append(index)
+        rows[row[:2]] = row
+    if not rows:
+        return results
+
+    try:
+        get_storage().upsert_records(list(rows.values()))
+    except Exception as e:
+        _storage_failed(e)
+        return results
+
+    for index in valid:
+        results[index] = True
+    return results
+
+
+@timed("db.replay_records")
+def replay_records(records: list):
+    """
+    add_records for the journal: all or nothing, and failures are raised
+    so the caller can tell rejected records (see rejects) from a batch
+    worth retrying.
+    """
+    rows = dict()
+    for record in records:
+        row = record_row(record)
+        rows[row[:2]] = row
+    try:
+        get_storage().upsert_records(list(rows.values()))
+    except Exception:
+        stats.count("db.errors")
+        raise
+
+
+@timed("db.import_rows")
+def import_rows(rows: list):
+    """
+    Bulk upsert rows that are already validated, e.g. by importer.py.
+
+    :param rows: (entry_date, entry_title, outcome_option, notes) tuples
+    :return: Success status
+    :rtype: bool
+    """
+    try:
+        get_storage().bulk_upsert(rows)
+        return True
+    except Exception as e:
+        _storage_failed(e)
         return False
+
+
+def iter_records(entry_titles=None, start_date=None, end_date=None,
+                 fetch_size=None):
+    """
+    Stream records, by title then date, for exports.
+
+    Unlike the rest of this module, failures are raised: a stream that
+    stops half way has to be noticed by the caller.
+
+    :return: iterator of Record
+    """
+    kwargs = dict()
+    if fetch_size is not None:
+        kwargs['fetch_size'] = fetch_size
+    return get_storage().iter_records(entry_titles, start_date, end_date, **kwargs)
+
+
+def get_records(entry_title: str, start_date, end_date):
+    """
+    Get the records for one habit between two dates, inclusive.
+
+    On Postgres this is a range scan of the habit_entries primary key,
+    (habit_id, entry_date).
+
+    :return: records, newest first, or empty list on failure
+    :rtype: list[Record]
+    """
+    return get_records_for_titles([entry_title], start_date, end_date).get(
+        entry_title, list()
+    )
+
+
+@timed("db.get_records_for_titles")
+def get_records_for_titles(entry_titles: list, start_date, end_date):
+    """
+    Get the records for several habits between two dates in one query.
+
+    :return: records per title, newest first, or empty dict on failure
+    :rtype: dict[str, list[Record]]
+    """
+    records = {title: list() for title in entry_titles}
+    if not entry_titles:
+        return records
     try:
-        date = data.get('date')
-        entry_date = datetime.date(date.year, date.month, date.day)
-        entry_title = data.get('entry_title')
-        outcome_option = data.get('drop-down')
-        notes = data.get('notes', None)
-        assert isinstance(entry_title, str)
-        assert isinstance(outcome_option, str)
-        assert isinstance(notes, str)
+        rows = get_storage().records_for_titles(entry_titles, start_date, end_date)
     except Exception as e:
-        print(str(e))
+        _storage_failed(e)
+        return dict()
+    for record in rows:
+        records[record.entry_title].append(record)
+    return records
+
+
+@timed("db.get_records_page")
+def get_records_page(entry_title: str, cursor_date, limit: int):
+    """
+    Keyset page of one habit's records: up to limit records dated on or
+    before cursor_date, newest first.
+
+    For the next page back, pass the day before the oldest date returned.
+
+    :return: records, or None on failure
+    :rtype: list[Record]
+    """
+    try:
+        return get_storage().records_page(entry_title, cursor_date, limit)
+    except Exception as e:
+        _storage_failed(e)
+        return None
+
+
+@timed("db.get_history_start")
+def get_history_start(entry_title: str):
+    """
+    Date of the oldest record for a habit.
+
+    :return: date, or None if there are no records or on failure
+    :rtype: datetime.date
+    """
+    try:
+        return get_storage().history_start(entry_title)
+    except Exception as e:
+        _storage_failed(e)
+        return None
+
+
+def _months_back(date, months):
+    month = date.year * 12 + date.month - 1 - months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+@timed("db.get_habit_summary")
+def get_habit_summary(entry_title: str, today=None):
+    """
+    Streaks, outcome counts and completion rates for one habit.
+
+    Read from summary tables that are updated with every write, so the
+    cost doesn't grow with the habit's history.  A day is done when it has
+    an outcome; a streak is still current if it ran until yesterday.
+
+    :return: {'current_streak': int, 'longest_streak': int,
+        'outcomes': [(outcome, entries)], 'weeks': [(week_start, done, days)],
+        'months': [(month_start, done, days)]}, periods newest first and
+        days counting only up to today; or None on failure
+    :rtype: dict
+    """
+    today = today or datetime.date.today()
+    weeks = [
+        week_start(today) - datetime.timedelta(weeks=offset)
+        for offset in range(SUMMARY_WEEKS)
+    ]
+    months = [_months_back(month_start(today), offset) for offset in range(SUMMARY_MONTHS)]
+    try:
+        outcome_counts, latest_run, longest_run, periods = get_storage().habit_summary(
+            entry_title, weeks[-1], months[-1]
+        )
+    except Exception as e:
+        _storage_failed(e)
+        return None
+
+    current_streak = 0
+    if latest_run is not None:
+        run_start, run_end = latest_run
+        if run_end >= today - datetime.timedelta(days=1):
+            current_streak = (min(run_end, today) - run_start).days + 1
+    done = {(period, start): count for period, start, count in periods}
+    tomorrow = today + datetime.timedelta(days=1)
+    next_months = [_months_back(months[0], -1)] + months[:-1]
+    return {
+        'current_streak': current_streak,
+        'longest_streak': longest_run,
+        'outcomes': list(outcome_counts),
+        'weeks': [
+            (start, done.get(('week', start), 0), min((tomorrow - start).days, 7))
+            for start in weeks
+        ],
+        'months': [
+            (start, done.get(('month', start), 0), (min(end, tomorrow) - start).days)
+            for start, end in zip(months, next_months)
+        ]
+    }
+
+
+@timed("db.get_outcome_matrix")
+def get_outcome_matrix(start_date, end_date):
+    """
+    Every habit's outcomes from start_date to end_date, in one query.
+
+    Each habit gets an array with a cell per day, start_date first: the
+    index of the day's outcome in its drop_down_fields, NO_OUTCOME for a
+    day without one, or UNLISTED_OUTCOME for an outcome that isn't one of
+    its options.
+
+    :return: {title: (drop_down_fields, cells)} in the order the habits
+        were added, or None on failure
+    :rtype: dict[str, tuple[tuple, array]]
+    """
+    days = (end_date - start_date).days + 1
+    try:
+        rows = get_storage().outcome_matrix(start_date, end_date)
+    except Exception as e:
+        _storage_failed(e)
+        return None
+    empty = array('h', [NO_OUTCOME]) * days
+    matrix = dict()
+    for title, drop_down_fields, offsets, outcomes in rows:
+        drop_down_fields = tuple(drop_down_fields or ())
+        positions = {option: index for index, option in enumerate(drop_down_fields)}
+        cells = array('h', empty)
+        for offset, outcome in zip(offsets, outcomes):
+            cells[offset] = positions.get(outcome, UNLISTED_OUTCOME)
+        matrix[title] = (drop_down_fields, cells)
+    return matrix
+
+
+@timed("db.search_notes")
+def search_notes(query: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE):
+    """
+    Entries whose notes match query, best match first.  On Postgres this
+    is a full-text search (see migrations/0005_entry_search.sql); the
+    other backends look for notes containing every word.
+
+    :param offset: matches to skip, for the pages after the first
+    :return: (records, True if there are more after them), or None on
+        failure
+    :rtype: tuple[list[Record], bool]
+    """
+    query = query.strip()
+    if not query:
+        return list(), False
+    try:
+        records = get_storage().search_notes(query, limit + 1, offset)
+    except Exception as e:
+        _storage_failed(e)
+        return None
+    return records[:limit], len(records) > limit
+
+
+@timed("db.get_changes_since")
+def get_changes_since(watermark):
+    """
+    What was written, by this or any other client, since watermark.
+
+    Pass None first to get a starting watermark, then the one returned
+    each time.  Changes can come back more than once; applying them again
+    does no harm.
+
+    :return: {'watermark': next watermark, 'tracking_types': TrackingTypes
+        by title, 'records': list of Record, or None if too many
+        changed to list}; or None on failure
+    :rtype: dict
+    """
+    try:
+        type_rows, records, next_watermark = get_storage().changes_since(watermark)
+    except Exception as e:
+        _storage_failed(e)
+        return None
+    tracking_types = tracking_types_from_rows(type_rows)
+    if tracking_types:
+        invalidate_tracking_types()
+    return {
+        'watermark': next_watermark,
+        'tracking_types': tracking_types,
+        'records': records
+    }
+
+
+def database_online():
+    """
+    False while the backend is marked unreachable and calls fail at once;
+    it comes back by itself once a background probe gets through.
+
+    Polled from the UI thread, so it only reads the state of a backend
+    that is already built, without waiting for _storage_lock or building
+    one itself.
+
+    :return: None until the backend has been built
+    :rtype: bool
+    """
+    storage = _storage
+    if storage is None:
+        return None
+    try:
+        return storage.online()
+    except Exception as e:
+        _storage_failed(e)
+        return False
+
+
+def wait_for_changes(timeout: float):
+    """
+    Block until another client commits a change, or timeout seconds pass.
+    Only Postgres can tell (LISTEN/NOTIFY); elsewhere this just waits.
+
+    :return: True if notified, False on timeout or failure
+    :rtype: bool
+    """
+    storage = get_storage()
+    if not storage.notifies:
+        time.sleep(timeout)
         return False
     try:
-        with closing(conn):
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO habit_tracking_fields (
-                        entry_date,
-                        entry_title,
-                        outcome_option,
-                        notes
-                        )
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (entry_date, entry_title)
-                    DO UPDATE SET
-                        outcome_option = EXCLUDED.outcome_option,
-                        notes = EXCLUDED.notes;
-                    """,
-                    (entry_date, entry_title, outcome_option, notes)
-                )
-                conn.commit()
-                return True
+        return storage.wait_for_changes(timeout)
     except Exception as e:
-        print(str(e))
+        _storage_failed(e)
+        time.sleep(timeout)
         return False
+
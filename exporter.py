@@ -0,0 +1,117 @@
+"""
+Export entries to CSV or JSONL.
+
+    python exporter.py out.csv [--title "Study X" ...] [--start 2024-01-01]
+                               [--end 2024-12-31] [--fetch-size 2000]
+
+The format follows the file extension (.jsonl or .ndjson for JSONL,
+anything else is CSV).  Columns are entry_date, entry_title,
+outcome_option and notes, the same ones importer.py reads, so an export
+can be imported again.
+
+Records are streamed from the database fetch-size rows at a time (a
+server-side cursor on Postgres) and written as they arrive, so memory use
+doesn't grow with the table.  The file is written next to the target and
+only moved into place once the export has finished.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+from db import iter_records
+
+FIELDS = ['entry_date', 'entry_title', 'outcome_option', 'notes']
+PROGRESS_EVERY = 10000
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def is_jsonl(path):
+    return os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson")
+
+
+def print_progress(progress):
+    print(
+        f"{progress['path']}: exported {progress['exported']}",
+        file=sys.stderr,
+        flush=True
+    )
+
+
+def export_file(path, entry_titles=None, start_date=None, end_date=None,
+                fetch_size=None, progress=print_progress, cancel=None):
+    """
+    Stream the matching records into path.
+
+    :param entry_titles: only these habits, or None for all
+    :param progress: called with the running totals every PROGRESS_EVERY rows
+    :param cancel: threading.Event; once set the export stops, leaving
+        path as it was
+    :return: totals: path, exported; or None on failure
+    :rtype: dict
+    """
+    totals = {'path': path, 'exported': 0}
+    partial = path + ".part"
+    try:
+        with open(partial, "w", newline="", encoding="utf-8") as target:
+            if is_jsonl(path):
+                def write(record):
+                    row = record._asdict()
+                    row['entry_date'] = record.entry_date.isoformat()
+                    target.write(json.dumps(row) + "\n")
+            else:
+                writer = csv.writer(target)
+                writer.writerow(FIELDS)
+
+                def write(record):
+                    writer.writerow((record.entry_date.isoformat(), *record[1:]))
+
+            for record in iter_records(entry_titles, start_date, end_date, fetch_size):
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled(f"Export to {path} cancelled")
+                write(record)
+                totals['exported'] += 1
+                if progress and totals['exported'] % PROGRESS_EVERY == 0:
+                    progress(totals)
+        os.replace(partial, path)
+    except Exception as e:
+        print(str(e))
+        if os.path.exists(partial):
+            os.remove(partial)
+        return None
+    if progress:
+        progress(totals)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export entries to CSV or JSONL."
+    )
+    parser.add_argument("path", metavar="FILE")
+    parser.add_argument(
+        "--title", action="append", dest="titles", metavar="TITLE",
+        help="only this habit; repeat for more"
+    )
+    parser.add_argument("--start", type=datetime.date.fromisoformat)
+    parser.add_argument("--end", type=datetime.date.fromisoformat)
+    parser.add_argument("--fetch-size", type=int)
+    args = parser.parse_args()
+
+    totals = export_file(
+        args.path,
+        entry_titles=args.titles,
+        start_date=args.start,
+        end_date=args.end,
+        fetch_size=args.fetch_size
+    )
+    sys.exit(0 if totals is not None else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import datetime
+from array import array
+from collections import OrderedDict
+
+from storage import Record
+
+MAX_PAGES = 64
+NO_RECORD = -1
+
+
+class EntryColumn:
+    """
+    One habit's records for a run of days, in parallel arrays indexed by
+    the number of days before newest, so a date's record is found with
+    one subtraction.
+
+    Outcomes are stored as indexes into options, the distinct outcomes
+    seen, with NO_RECORD for days without a record; notes are a list.
+    That is a few bytes a day instead of a Record and a date per day.
+    It covers oldest to newest; days past the arrays have no record.
+    """
+    __slots__ = ('entry_title', 'newest', 'oldest', 'options', 'outcomes', 'notes')
+
+    def __init__(self, entry_title, newest, oldest):
+        self.entry_title = entry_title
+        self.newest = newest
+        self.oldest = oldest
+        self.options = list()
+        self.outcomes = array('h')
+        self.notes = list()
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    def covers(self, date):
+        return self.oldest <= date <= self.newest
+
+    def set(self, record):
+        """Store a record dated within the column."""
+        offset = (self.newest - record.entry_date).days
+        missing = offset + 1 - len(self.outcomes)
+        if missing > 0:
+            self.outcomes.extend(array('h', [NO_RECORD]) * missing)
+            self.notes.extend([None] * missing)
+        try:
+            option = self.options.index(record.outcome_option)
+        except ValueError:
+            option = len(self.options)
+            self.options.append(record.outcome_option)
+        self.outcomes[offset] = option
+        self.notes[offset] = record.notes
+
+    def get(self, date):
+        """Record for date, or None if there isn't one."""
+        offset = (self.newest - date).days
+        if not 0 <= offset < len(self.outcomes):
+            return None
+        option = self.outcomes[offset]
+        if option == NO_RECORD:
+            return None
+        return Record(date, self.entry_title, self.options[option], self.notes[offset])
+
+
+class HistoryCache:
+    """
+    Bounded LRU of keyset pages of a habit's records, each an EntryColumn.
+
+    A page is what db.get_records_page returned for one habit and cursor:
+    every record dated on or before the cursor, newest first, up to the
+    page size.  It covers each day from its oldest record up to the cursor,
+    or right back to the start of history if the page came back short.
+
+    Stale pages, e.g. from the local cache, can be shown but don't count
+    as loaded: a fresh page covering the same day takes over from them.
+    """
+    def __init__(self, max_pages: int = MAX_PAGES):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def add_page(self, entry_title, cursor, records, exhausted, stale=False):
+        """
+        Store a page of records for entry_title.
+
+        :param cursor: newest date the page covers
+        :param records: records dated on or before cursor, newest first
+        :param exhausted: True if there is nothing older than the page
+        :param stale: shown until a fresh page is loaded, never trusted
+        """
+        if exhausted or not records:
+            oldest = datetime.date.min
+        else:
+            oldest = records[-1].entry_date
+        column = EntryColumn(entry_title, cursor, oldest)
+        for record in records:
+            column.set(record)
+        key = (entry_title, cursor, stale)
+        self._pages[key] = column
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def _page_for(self, entry_title, date, stale=False):
+        for key, page in reversed(self._pages.items()):
+            title, _, page_stale = key
+            if title == entry_title and page_stale == stale and page.covers(date):
+                self._pages.move_to_end(key)
+                return page
+        return None
+
+    def covers(self, entry_title, date):
+        """True if a loaded page says what is (or isn't) stored for date."""
+        return self._page_for(entry_title, date) is not None
+
+    def shows(self, entry_title, dates):
+        """True if every one of dates can be shown, if only from a stale page."""
+        return all(
+            self.covers(entry_title, date)
+            or self._page_for(entry_title, date, stale=True) is not None
+            for date in dates
+        )
+
+    def get(self, entry_title, date):
+        """
+        Record for date, or None if there isn't one or it isn't loaded.
+        Falls back to a stale page.
+        """
+        page = self._page_for(entry_title, date)
+        if page is None:
+            page = self._page_for(entry_title, date, stale=True)
+        if page is None:
+            return None
+        return page.get(date)
+
+    def first_missing(self, entry_title, dates):
+        """Newest of dates not covered by any loaded page, or None."""
+        for date in sorted(dates, reverse=True):
+            if not self.covers(entry_title, date):
+                return date
+        return None
+
+    def remember(self, record):
+        """Keep loaded pages in step with a record saved here or elsewhere."""
+        for (title, _, _), page in self._pages.items():
+            if title == record.entry_title and page.covers(record.entry_date):
+                page.set(record)
+
+    def forget(self, entry_title=None):
+        """Drop the pages for one habit, or for all of them."""
+        for key in list(self._pages):
+            if entry_title is None or key[0] == entry_title:
+                del self._pages[key]
@@ -0,0 +1,171 @@
+"""
+Import historical entries from CSV or JSONL.
+
+    python importer.py history.csv [more.jsonl ...] [--chunk-size 5000]
+
+CSV files need a header row.  Columns (or JSON keys) are entry_date,
+entry_title, outcome_option and notes; date, title, outcome and
+drop-down are accepted as aliases.  Dates are YYYY-MM-DD.
+
+Rows are read and written a chunk at a time, so memory use doesn't grow
+with the file.  Each chunk is committed on its own with the usual
+(entry_date, entry_title) upsert, so re-running an interrupted import is
+safe.  Rows for unknown habits or with an outcome the habit doesn't offer
+are reported and skipped.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+from db import import_rows, read_tracking_types, Record
+
+CHUNK_SIZE = 5000
+
+ALIASES = {
+    'date': 'entry_date',
+    'title': 'entry_title',
+    'outcome': 'outcome_option',
+    'drop-down': 'outcome_option'
+}
+
+
+def normalise(row):
+    return {ALIASES.get(key, key): value for key, value in row.items()}
+
+
+def parse_json_row(line):
+    """
+    One JSONL line as a row.
+
+    :rtype: dict
+    :raises ValueError: if the line isn't a JSON object
+    """
+    row = json.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError(f"expected a JSON object, got {type(row).__name__}")
+    return normalise(row)
+
+
+def iter_rows(path):
+    """
+    Stream the rows of a CSV or JSONL file as dicts.
+
+    :return: (line number, row) pairs; row is the ValueError instead for
+        a line that can't be read
+    """
+    with open(path, newline="", encoding="utf-8") as source:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(source, start=1):
+                if line.strip():
+                    try:
+                        yield line_number, parse_json_row(line)
+                    except ValueError as e:
+                        yield line_number, e
+        else:
+            # Line 1 is the header.
+            for line_number, row in enumerate(csv.DictReader(source), start=2):
+                yield line_number, normalise(row)
+
+
+def validate(row, tracking_types):
+    """
+    Check a row against habit_tracking_types.
+
+    :rtype: Record
+    :raises ValueError: with the reason the row can't be imported
+    """
+    for key in ('entry_title', 'entry_date', 'outcome_option', 'notes'):
+        value = row.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{key} should be text, not {type(value).__name__}")
+    entry_title = row.get('entry_title')
+    tracking_type = tracking_types.get(entry_title)
+    if tracking_type is None:
+        raise ValueError(f"unknown habit {entry_title!r}")
+    try:
+        entry_date = datetime.date.fromisoformat(str(row.get('entry_date')))
+    except ValueError:
+        raise ValueError(f"bad date {row.get('entry_date')!r}") from None
+    outcome_option = row.get('outcome_option') or ''
+    options = tracking_type.drop_down_fields
+    if outcome_option and outcome_option not in options:
+        raise ValueError(f"{outcome_option!r} is not an option for {entry_title!r}")
+    notes = row.get('notes') or ''
+    return Record(entry_date, entry_title, outcome_option, notes)
+
+
+def print_progress(progress):
+    print(
+        f"{progress['path']}: read {progress['read']}, "
+        f"imported {progress['imported']}, rejected {progress['rejected']}",
+        file=sys.stderr,
+        flush=True
+    )
+
+
+def import_file(path, chunk_size=CHUNK_SIZE, progress=print_progress):
+    """
+    Stream one file into the entries table.
+
+    If the habits can't be read nothing is imported and failed is 1: every
+    row would look like one for an unknown habit.
+
+    :param progress: called with the running totals after every chunk
+    :return: totals: path, read, imported, rejected, failed (chunks)
+    :rtype: dict
+    """
+    totals = {'path': path, 'read': 0, 'imported': 0, 'rejected': 0, 'failed': 0}
+    try:
+        tracking_types = read_tracking_types()
+    except Exception as e:
+        print(f"{path}: habits could not be read, nothing imported: {e}", file=sys.stderr)
+        totals['failed'] += 1
+        return totals
+    chunk = list()
+
+    def flush():
+        if import_rows(chunk):
+            totals['imported'] += len(chunk)
+        else:
+            totals['failed'] += 1
+        chunk.clear()
+        if progress:
+            progress(totals)
+
+    for line_number, row in iter_rows(path):
+        totals['read'] += 1
+        try:
+            if isinstance(row, Exception):
+                raise ValueError(f"unreadable line: {row}")
+            chunk.append(validate(row, tracking_types))
+        except ValueError as e:
+            totals['rejected'] += 1
+            print(f"{path}:{line_number}: {e}", file=sys.stderr)
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import historical entries from CSV or JSONL."
+    )
+    parser.add_argument("paths", nargs="+", metavar="FILE")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    ok = True
+    for path in args.paths:
+        totals = import_file(path, chunk_size=args.chunk_size)
+        ok = ok and not totals['failed'] and not totals['rejected']
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
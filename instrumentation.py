@@ -0,0 +1,98 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+WINDOW = 1000
+
+
+class Stats:
+    """
+    Rolling timings and counters, safe to update from any thread.
+
+    Each timing keeps its last WINDOW samples, so percentiles follow
+    recent behaviour rather than the whole session.
+    """
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._timings = dict()
+        self._totals = dict()
+        self._counters = dict()
+
+    def record(self, name, ms):
+        """Add one timing sample, in milliseconds."""
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = deque(maxlen=self.window)
+            samples.append(ms)
+            self._totals[name] = self._totals.get(name, 0) + 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def snapshot(self):
+        """
+        :return: {'timings': {name: {count, p50_ms, p95_ms, max_ms}},
+                  'counters': {name: int}}
+        :rtype: dict
+        """
+        with self._lock:
+            timings = {name: sorted(samples) for name, samples in self._timings.items()}
+            totals = dict(self._totals)
+            counters = dict(self._counters)
+        return {
+            'timings': {
+                name: {
+                    'count': totals[name],
+                    'p50_ms': round(self._percentile(ordered, 0.5), 3),
+                    'p95_ms': round(self._percentile(ordered, 0.95), 3),
+                    'max_ms': round(ordered[-1], 3)
+                }
+                for name, ordered in sorted(timings.items())
+            },
+            'counters': dict(sorted(counters.items()))
+        }
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def dump(self, path):
+        """Write a snapshot as JSON."""
+        with open(path, "w", encoding="utf-8") as stats_file:
+            json.dump(self.snapshot(), stats_file, indent=2)
+
+
+stats = Stats()
+
+
+@contextmanager
+def timer(name):
+    """Time the block into stats under name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.record(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name):
+    """Decorator version of timer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
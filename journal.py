@@ -0,0 +1,455 @@
+import datetime
+import json
+import os
+import threading
+from collections import deque
+
+from db import (
+    record_row,
+    rejects,
+    replay_records,
+    replay_tracking_type,
+    tracking_type_row,
+    Record,
+    TrackingType
+)
+
+JOURNAL_PATH = os.getenv(
+    "TRACKING_JOURNAL",
+    os.path.join(os.path.expanduser("~"), ".tracking_entry", "journal.jsonl")
+)
+BATCH_SIZE = 500
+RETRY_MIN_SECONDS = 1
+RETRY_MAX_SECONDS = 60
+
+RECORD = 'record'
+TRACKING_TYPE = 'tracking-type'
+
+
+def _record(data):
+    return Record(
+        entry_date=datetime.date.fromisoformat(data['date']),
+        entry_title=data['entry_title'],
+        outcome_option=data['drop-down'],
+        notes=data['notes']
+    )
+
+
+def _tracking_type(data):
+    return TrackingType(
+        title=data['title'],
+        drop_down_fields=tuple(data['drop-down']),
+        include_notes=data['note']
+    )
+
+
+class Journal:
+    """
+    Append-only local journal that every write lands in first.
+
+    Each write is one JSON line, fsync'd before the call returns, so a save
+    survives the network or Postgres being down.  A background flusher
+    replays the journal to Postgres in batches and then moves a
+    checkpoint (the byte offset replayed so far) forward.
+
+    Replay is idempotent: records are upserted on (entry_date,
+    entry_title) and tracking types skip titles that already exist, so
+    replaying a batch again after a crash between commit and checkpoint
+    changes nothing.
+
+    Lines keep the keys of the dicts the app used to pass around, so
+    journals written by older versions replay unchanged.
+
+    An entry the database refuses outright (see db.rejects) would fail on
+    every retry and hold up everything behind it, so it is moved to
+    path + ".rejected", one JSON line with the error, and the flusher
+    carries on.  take_rejected tells the app how many were moved.
+    """
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self.checkpoint_path = path + ".offset"
+        self.rejected_path = path + ".rejected"
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Flusher rounds started, and the last one that replayed everything.
+        self._rounds = threading.Condition()
+        self._rounds_started = 0
+        self._round_flushed = 0
+        self._rejected = 0
+        # Bumped whenever the checkpoint moves, so readers can tell that
+        # entries they saw pending may have been written since.
+        self.replayed = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(self.path, "a"):
+            pass
+        # What is past the checkpoint, kept in memory so the UI can ask on
+        # every paint without reading the file: (offset after it, parsed).
+        self._index_lock = threading.Lock()
+        self._pending_records = deque()
+        self._pending_by_title = dict()
+        self._pending_types = deque()
+        self._recover()
+        for entry, offset in self._unflushed():
+            self._index(entry, offset)
+
+    def _recover(self):
+        """
+        Cut off a line left half written by a crash, so the next append
+        starts on a line of its own.  That write was never acknowledged.
+        """
+        with open(self.path, "rb+") as journal:
+            data = journal.read()
+            if data and not data.endswith(b"\n"):
+                journal.truncate(data.rfind(b"\n") + 1)
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    # Writing
+
+    def _append(self, entries):
+        lines = [json.dumps(entry) + "\n" for entry in entries]
+        with self._lock:
+            offset = os.path.getsize(self.path)
+            with open(self.path, "a", encoding="utf-8") as journal:
+                journal.write("".join(lines))
+                journal.flush()
+                os.fsync(journal.fileno())
+            for entry, line in zip(entries, lines):
+                offset += len(line.encode("utf-8"))
+                self._index(entry, offset)
+        self._wake.set()
+
+    def add_records(self, records: list):
+        """
+        Journal records for upserting, as db.add_records.
+
+        :return: success status per record, False if it failed validation
+        :rtype: list
+        """
+        results = list()
+        entries = list()
+        for record in records:
+            try:
+                entry_date, entry_title, outcome_option, notes = record_row(record)
+            except Exception as e:
+                print(str(e))
+                results.append(False)
+                continue
+            entries.append({
+                'kind': RECORD,
+                'data': {
+                    'date': entry_date.isoformat(),
+                    'entry_title': entry_title,
+                    'drop-down': outcome_option,
+                    'notes': notes
+                }
+            })
+            results.append(True)
+        if entries:
+            try:
+                self._append(entries)
+            except Exception as e:
+                print(str(e))
+                return [False] * len(records)
+        return results
+
+    def write_new_tracking_type(self, tracking_type: TrackingType):
+        """
+        Journal a new habit, as db.write_new_tracking_type.
+
+        :return: Success status
+        :rtype: bool
+        """
+        try:
+            title, drop_down_values, include_notes = tracking_type_row(tracking_type)
+            self._append([{
+                'kind': TRACKING_TYPE,
+                'data': {
+                    'title': title,
+                    'drop-down': drop_down_values,
+                    'note': include_notes
+                }
+            }])
+            return True
+        except Exception as e:
+            print(str(e))
+            return False
+
+    # Reading
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self, offset):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint:
+            checkpoint.write(str(offset))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self._unindex(offset)
+        self.replayed += 1
+
+    def _unflushed(self, limit=None):
+        """
+        Entries past the checkpoint, each with the offset just after it.
+
+        A line without its newline is a write cut short by a crash; it was
+        never acknowledged, so it is left out.
+        """
+        entries = list()
+        with self._lock:
+            offset = self._read_checkpoint()
+            if offset > os.path.getsize(self.path):
+                offset = 0
+            with open(self.path, "rb") as journal:
+                journal.seek(offset)
+                for line in journal:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        entries.append((json.loads(line), offset))
+                    except ValueError as e:
+                        print(str(e))
+                        continue
+                    if limit is not None and len(entries) >= limit:
+                        break
+        return entries
+
+    def _index(self, entry, offset):
+        """
+        Add a journalled entry to the pending index.  Malformed ones are
+        left out; the flusher moves them to the rejected file.
+        """
+        try:
+            if entry['kind'] == RECORD:
+                parsed = _record(entry['data'])
+            elif entry['kind'] == TRACKING_TYPE:
+                parsed = _tracking_type(entry['data'])
+            else:
+                return
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._index_lock:
+            if entry['kind'] == TRACKING_TYPE:
+                self._pending_types.append((offset, parsed))
+                return
+            self._pending_records.append((offset, parsed))
+            self._pending_by_title.setdefault(
+                parsed.entry_title, deque()
+            ).append((offset, parsed))
+
+    def _unindex(self, checkpoint):
+        """Drop what the checkpoint has moved past from the pending index."""
+        with self._index_lock:
+            for pending in (self._pending_records, self._pending_types):
+                while pending and pending[0][0] <= checkpoint:
+                    pending.popleft()
+            for entry_title in list(self._pending_by_title):
+                pending = self._pending_by_title[entry_title]
+                while pending and pending[0][0] <= checkpoint:
+                    pending.popleft()
+                if not pending:
+                    del self._pending_by_title[entry_title]
+
+    def pending_records(self, entry_title=None):
+        """
+        Journalled records not yet in Postgres, optionally for one habit,
+        oldest first.  Read from memory, not the journal.
+        """
+        with self._index_lock:
+            if entry_title is None:
+                pending = self._pending_records
+            else:
+                pending = self._pending_by_title.get(entry_title, ())
+            return [record for _, record in pending]
+
+    def pending_tracking_types(self):
+        """Journalled habits not yet in Postgres, shaped as get_tracking_types."""
+        with self._index_lock:
+            return {
+                tracking_type.title: tracking_type
+                for _, tracking_type in self._pending_types
+            }
+
+    # Replay
+
+    @staticmethod
+    def _replay(entries):
+        """:raises Exception: as db.replay_records or db.replay_tracking_type"""
+        try:
+            if entries[0][0]['kind'] == TRACKING_TYPE:
+                items = _tracking_type(entries[0][0]['data'])
+            else:
+                items = [_record(entry['data']) for entry, _ in entries]
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Malformed journal entry: {e!r}") from e
+        if entries[0][0]['kind'] == TRACKING_TYPE:
+            replay_tracking_type(items)
+        else:
+            replay_records(items)
+
+    def _reject(self, entry, error):
+        """Move an entry the database refused to the rejected file."""
+        line = json.dumps({
+            'rejected_at': datetime.datetime.now().isoformat(timespec="seconds"),
+            'error': str(error),
+            'entry': entry
+        })
+        with self._lock:
+            with open(self.rejected_path, "a", encoding="utf-8") as rejected:
+                rejected.write(line + "\n")
+                rejected.flush()
+                os.fsync(rejected.fileno())
+            self._rejected += 1
+
+    def take_rejected(self):
+        """
+        How many entries were moved to the rejected file since last asked.
+
+        :rtype: int
+        """
+        with self._lock:
+            rejected, self._rejected = self._rejected, 0
+        return rejected
+
+    @staticmethod
+    def _next_batch(entries):
+        """Leading run of records, or a single tracking type."""
+        if entries[0][0]['kind'] == TRACKING_TYPE:
+            return entries[:1]
+        batch = list()
+        for entry in entries:
+            if entry[0]['kind'] != RECORD:
+                break
+            batch.append(entry)
+        return batch
+
+    def flush(self):
+        """
+        Replay everything past the checkpoint, in order, in batches.
+
+        :return: True if the journal is fully replayed
+        :rtype: bool
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        while True:
+            entries = self._unflushed(limit=BATCH_SIZE)
+            if not entries:
+                self._compact()
+                return True
+            batch = self._next_batch(entries)
+            try:
+                self._replay(batch)
+            except Exception as e:
+                print(str(e))
+                if not rejects(e):
+                    return False
+                # Find the entries to blame, one at a time.
+                if not self._replay_each(batch):
+                    return False
+                continue
+            with self._lock:
+                self._write_checkpoint(batch[-1][1])
+
+    def _replay_each(self, batch):
+        """
+        Replay a batch that was rejected entry by entry, moving aside the
+        ones rejected on their own.
+
+        :return: False if an entry failed for any other reason
+        :rtype: bool
+        """
+        for entry, offset in batch:
+            try:
+                self._replay([(entry, offset)])
+            except Exception as e:
+                if not rejects(e):
+                    print(str(e))
+                    return False
+                self._reject(entry, e)
+            with self._lock:
+                self._write_checkpoint(offset)
+        return True
+
+    def _compact(self):
+        """Empty a fully replayed journal so it doesn't grow forever."""
+        with self._lock:
+            if self._read_checkpoint() < os.path.getsize(self.path):
+                return
+            # Checkpoint first: a crash in between only means a harmless
+            # replay of entries that are already in Postgres.
+            self._write_checkpoint(0)
+            with open(self.path, "w"):
+                pass
+
+    def _run(self):
+        delay = RETRY_MIN_SECONDS
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._rounds:
+                self._rounds_started += 1
+                round_number = self._rounds_started
+            flushed = self.flush()
+            if flushed:
+                with self._rounds:
+                    self._round_flushed = round_number
+                    self._rounds.notify_all()
+            if flushed:
+                delay = RETRY_MIN_SECONDS
+                self._wake.wait()
+            else:
+                self._wake.wait(delay)
+                delay = min(delay * 2, RETRY_MAX_SECONDS)
+
+    def start_flusher(self):
+        """Start replaying to Postgres in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                name="journal-flusher",
+                daemon=True
+            )
+            self._thread.start()
+
+    def wake(self):
+        """Retry replaying now rather than after the current backoff."""
+        self._wake.set()
+
+    def drain(self, timeout: float):
+        """
+        Have the flusher replay everything journalled so far, waiting at
+        most timeout seconds.  Whatever is left is replayed next start.
+
+        :return: True if it was all replayed in time
+        :rtype: bool
+        """
+        if self._thread is None:
+            return False
+        with self._rounds:
+            # A round already running may have read the journal too early.
+            target = self._rounds_started + 1
+            self._wake.set()
+            return self._rounds.wait_for(
+                lambda: self._round_flushed >= target,
+                timeout=timeout
+            )
+
+    def stop_flusher(self):
+        """Stop the flusher; anything unflushed is replayed next start."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,288 @@
+import datetime
+import json
+import os
+import sqlite3
+import time
+
+from db import TRACKING_BACKEND
+from storage import Record, TrackingType
+
+CACHE_PATH = os.getenv(
+    "TRACKING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".tracking_entry", "cache.sqlite3")
+)
+# Only worth it in front of a remote database.
+CACHE_ENABLED = os.getenv(
+    "TRACKING_CACHE", "1" if TRACKING_BACKEND == "postgres" else "0"
+) == "1"
+MAX_AGE_DAYS = int(os.getenv("TRACKING_CACHE_MAX_AGE_DAYS", "30"))
+MAX_RECORDS = int(os.getenv("TRACKING_CACHE_MAX_RECORDS", "20000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cached_tracking_types (
+    position INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    drop_down_fields TEXT,
+    include_notes INTEGER,
+    cached_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cached_windows (
+    entry_title TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL,
+    oldest TEXT,
+    exhausted INTEGER NOT NULL,
+    history_start TEXT,
+    cached_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cached_records (
+    entry_title TEXT NOT NULL,
+    entry_date TEXT NOT NULL,
+    outcome_option TEXT,
+    notes TEXT,
+    PRIMARY KEY (entry_title, entry_date)
+);
+"""
+
+
+class LocalCache:
+    """
+    The last tracking types and each habit's newest page of records, kept
+    in a local SQLite file so the window has something to show before the
+    database answers.
+
+    Everything read back may be out of date: callers show it and then
+    revalidate.  Windows older than max_age_days are dropped, and the
+    oldest windows go first once more than max_records are kept.  Any
+    failure is printed and treated as a miss; the cache is only ever a
+    shortcut.  Used from the Tk thread only.
+    """
+    def __init__(self, path: str = CACHE_PATH, enabled: bool = CACHE_ENABLED,
+                 max_age_days: int = MAX_AGE_DAYS, max_records: int = MAX_RECORDS):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_records = max_records
+        self._conn = None
+        if not enabled:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path)
+            # A cache lost in a crash is just a slower start.
+            self._conn.execute("PRAGMA synchronous = OFF;")
+            with self._conn:
+                self._conn.executescript(SCHEMA)
+            self.evict()
+        except Exception as e:
+            print(str(e))
+            self.close()
+
+    def _read(self, sql, params=()):
+        if self._conn is None:
+            return list()
+        try:
+            return self._conn.execute(sql, params).fetchall()
+        except Exception as e:
+            print(str(e))
+            return list()
+
+    def _write(self, statements):
+        """Run (sql, params) pairs in one transaction."""
+        if self._conn is None:
+            return
+        try:
+            with self._conn:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self._conn.executemany(sql, params)
+                    else:
+                        self._conn.execute(sql, params)
+        except Exception as e:
+            print(str(e))
+
+    def tracking_types(self):
+        """
+        The tracking types last saved, in the same shape as
+        db.get_tracking_types.
+
+        :return: fields, or empty dict if there are none
+        :rtype: dict
+        """
+        return {
+            title: TrackingType(
+                title=title,
+                drop_down_fields=tuple(json.loads(drop_down_fields)),
+                include_notes=bool(include_notes)
+            )
+            for title, drop_down_fields, include_notes in self._read(
+                """
+                SELECT title, drop_down_fields, include_notes
+                FROM cached_tracking_types
+                ORDER BY position;
+                """
+            )
+        }
+
+    def save_tracking_types(self, tracking_types: dict):
+        """Replace the cached tracking types, keeping their order."""
+        now = time.time()
+        self._write([
+            ("DELETE FROM cached_tracking_types;", ()),
+            (
+                """
+                INSERT INTO cached_tracking_types (
+                    position, title, drop_down_fields, include_notes, cached_at
+                )
+                VALUES (?, ?, ?, ?, ?);
+                """,
+                [
+                    (
+                        position,
+                        title,
+                        json.dumps(tracking_type.drop_down_fields),
+                        int(tracking_type.include_notes),
+                        now
+                    )
+                    for position, (title, tracking_type) in enumerate(tracking_types.items())
+                ]
+            )
+        ])
+
+    def window(self, entry_title: str):
+        """
+        The newest page saved for a habit.
+
+        :return: (cursor, records newest first, exhausted, history start),
+            or None if nothing is cached
+        :rtype: tuple
+        """
+        rows = self._read(
+            """
+            SELECT cursor, exhausted, history_start
+            FROM cached_windows
+            WHERE entry_title = ?;
+            """,
+            (entry_title,)
+        )
+        if not rows:
+            return None
+        cursor, exhausted, history_start = rows[0]
+        records = [
+            Record(
+                entry_date=datetime.date.fromisoformat(entry_date),
+                entry_title=entry_title,
+                outcome_option=outcome_option,
+                notes=notes
+            )
+            for entry_date, outcome_option, notes in self._read(
+                """
+                SELECT entry_date, outcome_option, notes
+                FROM cached_records
+                WHERE entry_title = ?
+                ORDER BY entry_date DESC;
+                """,
+                (entry_title,)
+            )
+        ]
+        return (
+            datetime.date.fromisoformat(cursor),
+            records,
+            bool(exhausted),
+            datetime.date.fromisoformat(history_start) if history_start else None
+        )
+
+    def save_window(self, entry_title, cursor, records, exhausted, history_start=None):
+        """
+        Replace a habit's cached window with a page as loaded from the db,
+        see HistoryCache.add_page.
+        """
+        self._write([
+            ("DELETE FROM cached_records WHERE entry_title = ?;", (entry_title,)),
+            (
+                """
+                INSERT INTO cached_records (entry_title, entry_date, outcome_option, notes)
+                VALUES (?, ?, ?, ?);
+                """,
+                [
+                    (entry_title, record.entry_date.isoformat(),
+                     record.outcome_option, record.notes)
+                    for record in records
+                ]
+            ),
+            (
+                """
+                INSERT OR REPLACE INTO cached_windows (
+                    entry_title, cursor, oldest, exhausted, history_start, cached_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?);
+                """,
+                (
+                    entry_title,
+                    cursor.isoformat(),
+                    records[-1].entry_date.isoformat() if records else None,
+                    int(exhausted),
+                    history_start.isoformat() if history_start else None,
+                    time.time()
+                )
+            )
+        ])
+
+    def remember(self, records):
+        """Keep cached windows in step with records saved since they loaded."""
+        self._write([(
+            """
+            INSERT OR REPLACE INTO cached_records (entry_title, entry_date, outcome_option, notes)
+            SELECT ?1, ?2, ?3, ?4
+            WHERE EXISTS (
+                SELECT 1 FROM cached_windows
+                WHERE entry_title = ?1
+                    AND cursor >= ?2
+                    AND (exhausted OR oldest IS NULL OR oldest <= ?2)
+            );
+            """,
+            [
+                (record.entry_title, record.entry_date.isoformat(),
+                 record.outcome_option, record.notes)
+                for record in records
+            ]
+        )])
+
+    def evict(self):
+        """Drop windows past max_age_days, then the oldest over max_records."""
+        cutoff = time.time() - self.max_age_days * 86400
+        self._write([
+            (
+                """
+                DELETE FROM cached_records WHERE entry_title IN (
+                    SELECT entry_title FROM cached_windows WHERE cached_at < ?
+                );
+                """,
+                (cutoff,)
+            ),
+            ("DELETE FROM cached_windows WHERE cached_at < ?;", (cutoff,)),
+            ("DELETE FROM cached_tracking_types WHERE cached_at < ?;", (cutoff,))
+        ])
+        windows = self._read(
+            """
+            SELECT cached.entry_title, count(record.entry_date)
+            FROM cached_windows cached
+            LEFT JOIN cached_records record USING (entry_title)
+            GROUP BY cached.entry_title
+            ORDER BY max(cached.cached_at) DESC;
+            """
+        )
+        kept = 0
+        evicted = list()
+        for entry_title, records in windows:
+            kept += records
+            if kept > self.max_records:
+                evicted.append((entry_title,))
+        if evicted:
+            self._write([
+                ("DELETE FROM cached_records WHERE entry_title = ?;", evicted),
+                ("DELETE FROM cached_windows WHERE entry_title = ?;", evicted)
+            ])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
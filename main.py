@@ -1,13 +1,56 @@
+import colorsys
 import datetime
+import os
+import threading
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
 from tkinter import messagebox
 
-from db import write_new_tracking_type, add_record, get_tracking_types
+from db import (
+    database_online,
+    get_habit_summary,
+    get_outcome_matrix,
+    get_history_start,
+    get_records_page,
+    get_tracking_types,
+    search_notes,
+    Record,
+    invalidate_tracking_types,
+    close_storage,
+    NO_OUTCOME,
+    SEARCH_PAGE_SIZE,
+    TrackingType,
+    UNLISTED_OUTCOME
+)
+from changes import ChangeFeed
+from exporter import export_file
+from history import HistoryCache
+from instrumentation import stats, timed, timer
+from journal import Journal
+from local_cache import LocalCache
+from worker import DbWorker
 
 CREATOR_METHOD = 0
 CREATOR_TITLE = 1
+CREATOR_BINDER = 2
 WORK_GRID_ROWS = 7
+PAGE_SIZE = 60
+STATS_FILE = os.getenv("TRACKING_STATS_FILE")
+DIAGNOSTICS_REFRESH_MS = 1000
+ONLINE_CHECK_MS = 500
+CLOSE_FLUSH_SECONDS = 2
+EXPORT_STOP_SECONDS = 2
+WORKER_STOP_SECONDS = 2
+DASHBOARD_RANGES = (7, 28, 91, 182, 365)
+DASHBOARD_DAYS = 28
+DASHBOARD_CELL = 18
+DASHBOARD_TITLE_WIDTH = 180
+DASHBOARD_HEADER_HEIGHT = 36
+NO_OUTCOME_COLOUR = "#2b2b2b"
+UNLISTED_OUTCOME_COLOUR = "#8a8a8a"
+AUTOSAVE = os.getenv("TRACKING_AUTOSAVE", "0") == "1"
+AUTOSAVE_DEBOUNCE_MS = int(os.getenv("TRACKING_AUTOSAVE_DEBOUNCE_MS", "1500"))
 
 
 def display_message(title, message, is_error=True):
@@ -38,11 +81,7 @@ class AddItemDialog(tk.Toplevel):
         self.notes_frame = None
         self.add_another_field = None
         self.drop_down_str_values = list()
-        self.new_field_values = {
-            'title': str(),
-            'drop-down': list(),
-            'note': False
-        }
+        self.tracking_type = None
 
         frm = ttk.Frame(master=self, padding=12)
         frm.grid(sticky="nsew")
@@ -87,9 +126,9 @@ class AddItemDialog(tk.Toplevel):
         btns = ttk.Frame(frm)
 
         cancel_button = ttk.Button(master=btns, text="Cancel", command=self._on_cancel)
-        add_button = ttk.Button(btns, text="Add", command=self._on_add)
+        self.add_button = ttk.Button(btns, text="Add", command=self._on_add)
         cancel_button.grid(row=self.notes_base_row + 2, column=0, padx=(0, 6))
-        add_button.grid(row=self.notes_base_row + 2, column=1, padx=(0, 6))
+        self.add_button.grid(row=self.notes_base_row + 2, column=1, padx=(0, 6))
 
         btns.grid(row=11, column=0, sticky="e")
 
@@ -201,11 +240,13 @@ class AddItemDialog(tk.Toplevel):
         if not title:
             self.need_title_warning.grid(row=1, column=2, sticky="e", pady=(0, 20))
             return
-        self.new_field_values['title'] = title
-        drop_down_values = [v.get() for v in self.drop_down_str_values if v]
-        self.new_field_values['drop-down'] = drop_down_values
-        self.new_field_values['note'] = self.notes_selected.get()
-        success = write_new_tracking_type(self.new_field_values)
+        self.tracking_type = TrackingType(
+            title=title,
+            drop_down_fields=tuple(v.get() for v in self.drop_down_str_values if v),
+            include_notes=self.notes_selected.get()
+        )
+        success = self.master.journal.write_new_tracking_type(self.tracking_type)
+        invalidate_tracking_types()
         if not success:
             display_message(title="Error", message="Record could not be saved")
             return
@@ -213,14 +254,596 @@ class AddItemDialog(tk.Toplevel):
         self.destroy()
 
 
+class ExportDialog(tk.Toplevel):
+    """
+    Modal dialog picking what File > Export… writes: some habits or all,
+    and an optional inclusive date range, as exporter.py's --title,
+    --start and --end.
+    """
+    def __init__(self, parent: tk.Tk, titles):
+        super().__init__(parent)
+        self.result = None
+        self.title("Export Entries")
+        self.resizable(width=False, height=False)
+        self.titles = sorted(titles)
+
+        frm = ttk.Frame(master=self, padding=12)
+        frm.grid(sticky="nsew")
+
+        ttk.Label(
+            master=frm,
+            text="Habits (none selected exports all)"
+        ).grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 6))
+        self.habits = tk.Listbox(
+            master=frm,
+            selectmode="extended",
+            exportselection=False,
+            height=min(max(len(self.titles), 3), 12)
+        )
+        for title in self.titles:
+            self.habits.insert("end", title)
+        self.habits.grid(row=1, column=0, columnspan=2, sticky="nsew", pady=(0, 12))
+
+        self.start_value = tk.StringVar()
+        self.end_value = tk.StringVar()
+        for row, (text, value) in enumerate(
+            (("From (YYYY-MM-DD)", self.start_value), ("To (YYYY-MM-DD)", self.end_value)),
+            start=2
+        ):
+            ttk.Label(master=frm, text=text).grid(row=row, column=0, sticky="e", padx=(0, 6))
+            ttk.Entry(master=frm, textvariable=value).grid(
+                row=row, column=1, sticky="w", pady=(0, 6)
+            )
+        self.warning = ttk.Label(master=frm, foreground="red")
+        self.warning.grid(row=4, column=0, columnspan=2, sticky="w")
+
+        btns = ttk.Frame(frm)
+        cancel_button = ttk.Button(master=btns, text="Cancel", command=self.destroy)
+        export_button = ttk.Button(master=btns, text="Export…", command=self._on_export)
+        cancel_button.grid(row=0, column=0, padx=(0, 6))
+        export_button.grid(row=0, column=1)
+        btns.grid(row=5, column=0, columnspan=2, sticky="e", pady=(12, 0))
+
+        self.bind("<Return>", lambda e: self._on_export())
+        self.bind("<Escape>", lambda e: self.destroy())
+        self.transient(parent)
+        self.grab_set()
+
+    @staticmethod
+    def _date(text):
+        return datetime.date.fromisoformat(text) if text else None
+
+    def _on_export(self):
+        try:
+            start_date = self._date(self.start_value.get().strip())
+            end_date = self._date(self.end_value.get().strip())
+        except ValueError:
+            self.warning['text'] = "Dates are YYYY-MM-DD"
+            return
+        if start_date and end_date and start_date > end_date:
+            self.warning['text'] = "From is after To"
+            return
+        entry_titles = [self.titles[index] for index in self.habits.curselection()]
+        self.result = {
+            'entry_titles': entry_titles or None,
+            'start_date': start_date,
+            'end_date': end_date
+        }
+        self.destroy()
+
+
+class DiagnosticsDialog(tk.Toplevel):
+    """Live view of the timings and counters collected by instrumentation."""
+    def __init__(self, parent: tk.Tk):
+        super().__init__(parent)
+        self.title("Diagnostics")
+        self._after_id = None
+
+        frm = ttk.Frame(master=self, padding=12)
+        frm.grid(sticky="nsew")
+        self.columnconfigure(index=0, weight=1)
+        self.rowconfigure(index=0, weight=1)
+        frm.columnconfigure(index=0, weight=1)
+        frm.rowconfigure(index=0, weight=1)
+
+        columns = ('count', 'p50_ms', 'p95_ms', 'max_ms')
+        self.timings = ttk.Treeview(master=frm, columns=columns, height=16)
+        self.timings.heading('#0', text="Timing")
+        self.timings.column('#0', width=260)
+        for column, text in zip(columns, ("Count", "p50 ms", "p95 ms", "Max ms")):
+            self.timings.heading(column, text=text)
+            self.timings.column(column, width=90, anchor="e")
+        self.timings.grid(row=0, column=0, sticky="nsew")
+
+        self.counters = ttk.Label(master=frm, justify="left")
+        self.counters.grid(row=1, column=0, sticky="w", pady=(12, 0))
+
+        btns = ttk.Frame(frm)
+        reset_button = ttk.Button(master=btns, text="Reset", command=self._on_reset)
+        close_button = ttk.Button(master=btns, text="Close", command=self.destroy)
+        reset_button.grid(row=0, column=0, padx=(0, 6))
+        close_button.grid(row=0, column=1)
+        btns.grid(row=2, column=0, sticky="e", pady=(12, 0))
+
+        self.bind("<Escape>", lambda e: self.destroy())
+        self.transient(parent)
+        self._refresh()
+
+    def _refresh(self):
+        snapshot = stats.snapshot()
+        self.timings.delete(*self.timings.get_children())
+        for name, summary in snapshot['timings'].items():
+            self.timings.insert(
+                "",
+                "end",
+                text=name,
+                values=(
+                    summary['count'],
+                    f"{summary['p50_ms']:.2f}",
+                    f"{summary['p95_ms']:.2f}",
+                    f"{summary['max_ms']:.2f}"
+                )
+            )
+        self.counters['text'] = "\n".join(
+            f"{name}: {value}" for name, value in snapshot['counters'].items()
+        ) or "No counters yet"
+        self._after_id = self.after(DIAGNOSTICS_REFRESH_MS, self._refresh)
+
+    def _on_reset(self):
+        stats.reset()
+
+    def destroy(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super().destroy()
+
+
+def outcome_colours(options):
+    """A colour per option, from green for the first to red for the last."""
+    colours = list()
+    for index in range(len(options)):
+        hue = 1 / 3 * (1 - index / max(len(options) - 1, 1))
+        red, green, blue = colorsys.hsv_to_rgb(hue, 0.65, 0.8)
+        colours.append(f"#{int(red * 255):02x}{int(green * 255):02x}{int(blue * 255):02x}")
+    return colours
+
+
+class DashboardDialog(tk.Toplevel):
+    """
+    Every habit against the last few weeks or months of days, one cell per
+    day, loaded with a single query.
+
+    Cells are drawn on a Canvas, and only the ones in view, so hundreds of
+    habits over a year scroll as well as a handful.  Clicking a cell shows
+    that habit and day in the main window.
+    """
+    def __init__(self, parent: "App"):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("Dashboard")
+        self.matrix = dict()
+        self.titles = list()
+        self.colours = dict()
+        self.end_date = datetime.date.today()
+        self.start_date = self.end_date
+        self.days = DASHBOARD_DAYS
+        self._closed = False
+
+        frm = ttk.Frame(master=self, padding=12)
+        frm.grid(sticky="nsew")
+        self.columnconfigure(index=0, weight=1)
+        self.rowconfigure(index=0, weight=1)
+        frm.columnconfigure(index=0, weight=1)
+        frm.rowconfigure(index=1, weight=1)
+
+        controls = ttk.Frame(frm)
+        ttk.Label(master=controls, text="Days").grid(row=0, column=0, padx=(0, 6))
+        self.range_box = ttk.Combobox(
+            master=controls,
+            width=6,
+            state="readonly",
+            values=DASHBOARD_RANGES
+        )
+        self.range_box.set(self.days)
+        self.range_box.bind("<<ComboboxSelected>>", self._on_range)
+        self.range_box.grid(row=0, column=1, padx=(0, 12))
+        refresh_button = ttk.Button(master=controls, text="Refresh", command=self.reload)
+        refresh_button.grid(row=0, column=2)
+        controls.grid(row=0, column=0, sticky="w", pady=(0, 12))
+
+        grid = ttk.Frame(frm)
+        grid.columnconfigure(index=1, weight=1)
+        grid.rowconfigure(index=1, weight=1)
+        canvas_options = dict(highlightthickness=0, background="#1f1f1f")
+        self.header = tk.Canvas(grid, height=DASHBOARD_HEADER_HEIGHT, **canvas_options)
+        self.side = tk.Canvas(grid, width=DASHBOARD_TITLE_WIDTH, **canvas_options)
+        self.body = tk.Canvas(
+            grid,
+            width=600,
+            height=400,
+            xscrollincrement=DASHBOARD_CELL,
+            yscrollincrement=DASHBOARD_CELL,
+            **canvas_options
+        )
+        self.x_scrollbar = ttk.Scrollbar(master=grid, orient="horizontal", command=self._xview)
+        self.y_scrollbar = ttk.Scrollbar(master=grid, orient="vertical", command=self._yview)
+        self.body.config(
+            xscrollcommand=self.x_scrollbar.set,
+            yscrollcommand=self.y_scrollbar.set
+        )
+        self.header.grid(row=0, column=1, sticky="ew")
+        self.side.grid(row=1, column=0, sticky="ns")
+        self.body.grid(row=1, column=1, sticky="nsew")
+        self.y_scrollbar.grid(row=1, column=2, sticky="ns")
+        self.x_scrollbar.grid(row=2, column=1, sticky="ew")
+        grid.grid(row=1, column=0, sticky="nsew")
+
+        self.status = ttk.Label(master=frm, text="Loading…")
+        self.status.grid(row=2, column=0, sticky="w", pady=(12, 0))
+
+        close_button = ttk.Button(master=frm, text="Close", command=self.destroy)
+        close_button.grid(row=3, column=0, sticky="e", pady=(12, 0))
+
+        self.body.bind("<Configure>", lambda e: self._draw())
+        self.body.bind("<Motion>", self._on_motion)
+        self.body.bind("<Leave>", lambda e: self._show_status())
+        self.body.bind("<Button-1>", self._on_click)
+        for widget in (self.body, self.side):
+            widget.bind("<MouseWheel>", self._on_mouse_wheel)
+            widget.bind("<Button-4>", self._on_mouse_wheel)
+            widget.bind("<Button-5>", self._on_mouse_wheel)
+        self.bind("<Escape>", lambda e: self.destroy())
+        self.transient(parent)
+        self.reload()
+
+    # Loading
+
+    def reload(self):
+        """Load the grid again, ending today."""
+        self.end_date = datetime.date.today()
+        start_date = self.end_date - datetime.timedelta(days=self.days - 1)
+        self.parent.db_worker.submit(
+            get_outcome_matrix,
+            start_date,
+            self.end_date,
+            key='dashboard',
+            callback=lambda matrix: self._on_loaded(matrix, start_date)
+        )
+
+    def _on_range(self, event):
+        self.days = int(self.range_box.get())
+        self.reload()
+
+    @timed("ui.dashboard_loaded")
+    def _on_loaded(self, matrix, start_date):
+        if self._closed:
+            return
+        if matrix is None:
+            self._show_status("Could not load the dashboard")
+            return
+        self.start_date = start_date
+        self.matrix = matrix
+        self.titles = list(matrix)
+        self.colours = {
+            options: outcome_colours(options)
+            for options, _ in matrix.values()
+        }
+        # Saves still in the journal are newer than what came back.
+        for record in self.parent.journal.pending_records():
+            self._set_cell(record)
+        self.body.config(scrollregion=(
+            0, 0, self.days * DASHBOARD_CELL, len(self.titles) * DASHBOARD_CELL
+        ))
+        self.body.xview_moveto(1.0)
+        self._draw()
+        self._show_status()
+
+    def _set_cell(self, record):
+        """Put a saved record in the grid, if it's in range."""
+        if record.entry_title not in self.matrix:
+            return False
+        offset = (record.entry_date - self.start_date).days
+        if not 0 <= offset < self.days:
+            return False
+        options, cells = self.matrix[record.entry_title]
+        if not record.outcome_option:
+            cells[offset] = NO_OUTCOME
+        elif record.outcome_option in options:
+            cells[offset] = options.index(record.outcome_option)
+        else:
+            cells[offset] = UNLISTED_OUTCOME
+        return True
+
+    def apply_changes(self, changes):
+        """Patch in records saved since loading; reload for anything more."""
+        if changes['tracking_types'] or changes['records'] is None:
+            self.reload()
+            return
+        changed = [self._set_cell(record) for record in changes['records']]
+        if any(changed):
+            self._draw()
+
+    # Drawing
+
+    def _xview(self, *args):
+        self.body.xview(*args)
+        self.header.xview_moveto(self.body.xview()[0])
+        self._draw()
+
+    def _yview(self, *args):
+        self.body.yview(*args)
+        self.side.yview_moveto(self.body.yview()[0])
+        self._draw()
+
+    def _on_mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            step = -1
+        else:
+            step = 1
+        if event.state & 0x1:
+            self._xview('scroll', step, 'units')
+        else:
+            self._yview('scroll', step, 'units')
+        return "break"
+
+    def _visible(self):
+        """(first day, last day, first row, last row) in view."""
+        left = int(self.body.canvasx(0))
+        top = int(self.body.canvasy(0))
+        right = left + self.body.winfo_width()
+        bottom = top + self.body.winfo_height()
+        return (
+            max(left // DASHBOARD_CELL, 0),
+            min(right // DASHBOARD_CELL + 1, self.days),
+            max(top // DASHBOARD_CELL, 0),
+            min(bottom // DASHBOARD_CELL + 1, len(self.titles))
+        )
+
+    def _draw(self):
+        """Redraw only the cells, titles and dates in view."""
+        for canvas in (self.header, self.side, self.body):
+            canvas.delete("all")
+        if not self.titles:
+            return
+        # Keep the header and titles scrolled with the grid.
+        width, height = self.days * DASHBOARD_CELL, len(self.titles) * DASHBOARD_CELL
+        self.header.config(scrollregion=(0, 0, width, DASHBOARD_HEADER_HEIGHT))
+        self.side.config(scrollregion=(0, 0, DASHBOARD_TITLE_WIDTH, height))
+        self.header.xview_moveto(self.body.xview()[0])
+        self.side.yview_moveto(self.body.yview()[0])
+
+        first_day, last_day, first_row, last_row = self._visible()
+        for day in range(first_day, last_day):
+            date = self.start_date + datetime.timedelta(days=day)
+            x = day * DASHBOARD_CELL + DASHBOARD_CELL // 2
+            if date.day == 1 or day == first_day:
+                self.header.create_text(
+                    x, 2, anchor="n", text=f"{date:%b}", fill="#cfcfcf"
+                )
+            self.header.create_text(
+                x, DASHBOARD_HEADER_HEIGHT - 2, anchor="s",
+                text=str(date.day), fill="#cfcfcf"
+            )
+        for row in range(first_row, last_row):
+            title = self.titles[row]
+            options, cells = self.matrix[title]
+            colours = self.colours[options]
+            y = row * DASHBOARD_CELL
+            self.side.create_text(
+                4, y + DASHBOARD_CELL // 2, anchor="w", text=title, fill="#cfcfcf"
+            )
+            for day in range(first_day, last_day):
+                cell = cells[day]
+                if cell == NO_OUTCOME:
+                    colour = NO_OUTCOME_COLOUR
+                elif cell == UNLISTED_OUTCOME:
+                    colour = UNLISTED_OUTCOME_COLOUR
+                else:
+                    colour = colours[cell]
+                x = day * DASHBOARD_CELL
+                self.body.create_rectangle(
+                    x + 1, y + 1, x + DASHBOARD_CELL - 1, y + DASHBOARD_CELL - 1,
+                    fill=colour, width=0
+                )
+
+    # Pointer
+
+    def _cell_at(self, event):
+        """(title, date, outcome) under the pointer, or None."""
+        day = int(self.body.canvasx(event.x)) // DASHBOARD_CELL
+        row = int(self.body.canvasy(event.y)) // DASHBOARD_CELL
+        if not (0 <= day < self.days and 0 <= row < len(self.titles)):
+            return None
+        title = self.titles[row]
+        options, cells = self.matrix[title]
+        date = self.start_date + datetime.timedelta(days=day)
+        cell = cells[day]
+        if cell == NO_OUTCOME:
+            outcome = "nothing"
+        elif cell == UNLISTED_OUTCOME:
+            outcome = "not one of the options"
+        else:
+            outcome = options[cell]
+        return title, date, outcome
+
+    def _show_status(self, text=None):
+        if text is None:
+            text = f"{len(self.titles)} habits over {self.days} days"
+        self.status['text'] = text
+
+    def _on_motion(self, event):
+        cell = self._cell_at(event)
+        if cell is None:
+            self._show_status()
+            return
+        title, date, outcome = cell
+        self._show_status(f"{title} · {date:%d/%m/%Y} · {outcome}")
+
+    def _on_click(self, event):
+        cell = self._cell_at(event)
+        if cell is not None:
+            title, date, _ = cell
+            self.parent.view.show_entry(title, date)
+
+    def destroy(self):
+        self._closed = True
+        self.parent.db_worker.cancel('dashboard')
+        if self.parent.dashboard is self:
+            self.parent.dashboard = None
+        super().destroy()
+
+
+class SearchDialog(tk.Toplevel):
+    """
+    A page at a time of the entries whose notes match a search, best match
+    first.  Selecting one shows that habit and day in the main window.
+    """
+    def __init__(self, parent: "App", view: "MainView"):
+        super().__init__(parent)
+        self.parent = parent
+        self.view = view
+        self.title("Search Notes")
+        self.query = ""
+        self.offset = 0
+        self.records = dict()
+        self._closed = False
+
+        frm = ttk.Frame(master=self, padding=12)
+        frm.grid(sticky="nsew")
+        self.columnconfigure(index=0, weight=1)
+        self.rowconfigure(index=0, weight=1)
+        frm.columnconfigure(index=0, weight=1)
+        frm.rowconfigure(index=0, weight=1)
+
+        columns = ('habit', 'notes')
+        self.results = ttk.Treeview(
+            master=frm,
+            columns=columns,
+            height=SEARCH_PAGE_SIZE,
+            selectmode="browse"
+        )
+        self.results.heading('#0', text="Date")
+        self.results.column('#0', width=100)
+        self.results.heading('habit', text="Habit")
+        self.results.column('habit', width=160)
+        self.results.heading('notes', text="Notes")
+        self.results.column('notes', width=380)
+        self.results.bind("<<TreeviewSelect>>", self._on_select)
+        self.results.grid(row=0, column=0, sticky="nsew")
+
+        self.status = ttk.Label(master=frm)
+        self.status.grid(row=1, column=0, sticky="w", pady=(12, 0))
+
+        btns = ttk.Frame(frm)
+        self.previous_button = ttk.Button(
+            master=btns,
+            text="Previous",
+            command=lambda: self._load(self.offset - SEARCH_PAGE_SIZE)
+        )
+        self.next_button = ttk.Button(
+            master=btns,
+            text="Next",
+            command=lambda: self._load(self.offset + SEARCH_PAGE_SIZE)
+        )
+        close_button = ttk.Button(master=btns, text="Close", command=self.destroy)
+        self.previous_button.grid(row=0, column=0, padx=(0, 6))
+        self.next_button.grid(row=0, column=1, padx=(0, 6))
+        close_button.grid(row=0, column=2)
+        btns.grid(row=2, column=0, sticky="e", pady=(12, 0))
+
+        self.bind("<Escape>", lambda e: self.destroy())
+        self.transient(parent)
+
+    def search(self, query):
+        """Show the first page of matches for query."""
+        self.query = query
+        self._load(0)
+
+    def _load(self, offset):
+        offset = max(offset, 0)
+        query = self.query
+        self.previous_button.state(['disabled'])
+        self.next_button.state(['disabled'])
+        self.status['text'] = f"Searching for “{query}”…"
+        self.parent.db_worker.submit(
+            search_notes,
+            query,
+            offset,
+            key='search',
+            callback=lambda result: self._on_results(result, query, offset)
+        )
+
+    def _on_results(self, result, query, offset):
+        if self._closed:
+            return
+        if result is None:
+            self.status['text'] = f"Could not search for “{query}”"
+            if self.offset:
+                self.previous_button.state(['!disabled'])
+            return
+        records, more = result
+        self.offset = offset
+        self.records.clear()
+        self.results.delete(*self.results.get_children())
+        for record in records:
+            iid = self.results.insert(
+                "",
+                "end",
+                text=f"{record.entry_date:%d/%m/%Y}",
+                values=(record.entry_title, " ".join((record.notes or "").split()))
+            )
+            self.records[iid] = record
+        if records:
+            self.status['text'] = (
+                f"Matches {offset + 1}–{offset + len(records)} for “{query}”"
+            )
+        else:
+            self.status['text'] = f"No notes match “{query}”"
+        if offset:
+            self.previous_button.state(['!disabled'])
+        if more:
+            self.next_button.state(['!disabled'])
+
+    def _on_select(self, event):
+        selected = self.results.selection()
+        if selected and selected[0] in self.records:
+            record = self.records[selected[0]]
+            self.view.show_entry(record.entry_title, record.entry_date)
+
+    def destroy(self):
+        self._closed = True
+        self.parent.db_worker.cancel('search')
+        if self.view.search_results is self:
+            self.view.search_results = None
+        super().destroy()
+
+
 class MainView(ttk.Frame):
     """Main screen"""
     def __init__(self, parent, controller: "App"):
         super().__init__(master=parent, padding=12, style="DarkMain.TFrame")
         self.controller = controller
-        self.panel_frame = ttk.Frame(self)
+        self.work_rows = list()
+        self.work_dates = list()
+        self.panel_ready = False
         self.tracking_tasks = dict()
-        self.tracking_tasks = get_tracking_types()
+        self.window_end = datetime.date.today()
+        self.history = HistoryCache()
+        self.history_starts = dict()
+        # Unsaved cell values, {(entry_date, entry_title): (outcome, notes)}.
+        self.edits = dict()
+        self.binding = False
+        self.autosave_after = None
+        self.selection = None
+        # journal.replayed when the summary shown left pending saves out.
+        self.summary_replayed = None
+        # Habits whose cached window has been put in self.history.
+        self.cached_windows = set()
+        # Last session's habits, to show while the db is asked again.
+        self.tracking_tasks = self.controller.local_cache.tracking_types()
+        if self.tracking_tasks:
+            self.tracking_tasks.update(self.controller.journal.pending_tracking_types())
 
         # Selection Section
         selection_grid_style = ttk.Style()
@@ -243,8 +866,30 @@ class MainView(ttk.Frame):
         # Selection Section
         self._build_listbox()
 
+        # Search
+        self.search_results = None
+        self.search_text = tk.StringVar(master=self)
+        search_frame = ttk.Frame(self.selection_frame)
+        search_entry = ttk.Entry(
+            master=search_frame,
+            textvariable=self.search_text,
+            width=20
+        )
+        search_entry.bind("<Return>", lambda e: self.search())
+        search_button = ttk.Button(
+            master=search_frame,
+            text="Search Notes",
+            command=self.search
+        )
+        search_entry.grid(row=0, column=0, padx=(0, 6))
+        search_button.grid(row=0, column=1)
+        search_frame.grid(row=1, column=0, columnspan=2, sticky="w", pady=(12, 0))
+
         # Work Section
-        self._fill_panel_frame()
+        self._build_panel_frame()
+        self._show_cached()
+        # Let the window paint before the first query starts competing.
+        self.after_idle(self._load_tracking_types)
 
         # Footer
         footer = ttk.Frame(self)
@@ -253,13 +898,21 @@ class MainView(ttk.Frame):
             text="Add Item…",
             command=self.controller.add_item_dialog
         )
-        add_item_button.grid(row=0, column=0)
+        self.offline_label = ttk.Label(
+            footer,
+            text="Database offline: saves are kept locally until it's back"
+        )
+        self.offline_label.grid(row=0, column=0, padx=(0, 12))
+        self.offline_label.grid_remove()
+        add_item_button.grid(row=0, column=1)
 
         footer.grid(row=1, column=0, columnspan=2, sticky="e", pady=(12, 0))
 
+    @timed("ui._build_listbox")
     def _build_listbox(self):
         self.track_tasks = list(self.tracking_tasks.keys())
-        self.selection = self.track_tasks[0]
+        if self.selection not in self.tracking_tasks:
+            self.selection = self.track_tasks[0] if self.track_tasks else None
         self.listbox = tk.Listbox(
             self.selection_frame,
             height=12,
@@ -274,9 +927,20 @@ class MainView(ttk.Frame):
         self.listbox.config(yscrollcommand=scrollbar.set)
 
         def on_select(event):
-            self.panel_frame.destroy()
-            self.selection = self.listbox.get(self.listbox.curselection())
-            self._fill_panel_frame()
+            if not self.listbox.curselection():
+                return
+            selection = self.listbox.get(self.listbox.curselection())
+            if selection == self.selection:
+                return
+            if self.edits and not self._resolve_unsaved():
+                # Stay on the habit with the edits.
+                self.listbox.selection_clear(0, "end")
+                self.listbox.selection_set(self.track_tasks.index(self.selection))
+                return
+            self.selection = selection
+            self.window_end = datetime.date.today()
+            self._request_panel()
+            self._request_summary()
 
         self.listbox.bind("<<ListboxSelect>>", on_select)
 
@@ -285,66 +949,484 @@ class MainView(ttk.Frame):
 
         for task in self.track_tasks:
             self.listbox.insert("end", task)
+        if self.selection is not None:
+            self.listbox.selection_set(self.track_tasks.index(self.selection))
+
+    @staticmethod
+    def _fetch_page(entry_title, cursor_date, with_start):
+        """
+        Worker job: one keyset page of a habit's records, and the date its
+        history starts if asked for.
+
+        :return: (records or None on failure, history start)
+        """
+        records = get_records_page(entry_title, cursor_date, PAGE_SIZE)
+        history_start = get_history_start(entry_title) if with_start else None
+        return records, history_start
+
+    def _submit_page(self, key, entry_title, cursor_date, callback):
+        with_start = entry_title not in self.history_starts
+
+        def on_fetched(result):
+            records, history_start = result or (None, None)
+            if records is None:
+                callback(False)
+                return
+            self.history.add_page(
+                entry_title,
+                cursor_date,
+                records,
+                exhausted=len(records) < PAGE_SIZE
+            )
+            # Saves still in the journal are newer than what Postgres has.
+            for record in self.controller.journal.pending_records(entry_title):
+                self.history.remember(record)
+            if with_start:
+                self.history_starts[entry_title] = (
+                    history_start or datetime.date.today()
+                )
+            if cursor_date >= datetime.date.today():
+                self.controller.local_cache.save_window(
+                    entry_title,
+                    cursor_date,
+                    records,
+                    len(records) < PAGE_SIZE,
+                    self.history_starts.get(entry_title)
+                )
+            callback(True)
+
+        self.controller.db_worker.submit(
+            self._fetch_page,
+            entry_title,
+            cursor_date,
+            with_start,
+            key=key,
+            callback=on_fetched
+        )
+
+    def _viewport_dates(self, window_end=None):
+        window_end = window_end or self.window_end
+        return [
+            window_end - datetime.timedelta(days=offset)
+            for offset in range(WORK_GRID_ROWS)
+        ]
 
     @staticmethod
-    def _get_date_range(today, day):
-        return datetime.datetime(today.year, today.month, day)
+    def _date_labels(master):
+        return ttk.Label(master=master, width=25)
 
     @staticmethod
-    def _date_labels(master, date):
-        return ttk.Label(master=master, text=f"{date:%d/%m/%Y}", width=25)
+    def _bind_date_label(label, date):
+        label['text'] = f"{date:%d/%m/%Y}"
 
     @staticmethod
-    def _drop_down_maker(master, the_options_that_should_be_packed=None):
+    def _drop_down_maker(master):
         cb = ttk.Combobox(master=master, width=25)
         cb['state'] = 'readonly'
-        cb.set('option 1')
-        cb['values'] = 'option 1', 'option 2', 'option 3'
         return cb
 
     @staticmethod
-    def _notebook_maker(master, other_stuff=None):
+    def _bind_drop_down(cb, options_and_value):
+        options, value = options_and_value
+        cb['values'] = options
+        cb.set(value)
+
+    @staticmethod
+    def _notebook_maker(master):
         return ttk.Entry(master, width=25)
 
-    def _save_records(self):
-        # Get the records to save
-        new_record = {
-            'date': datetime.datetime.now(),
-            'entry_title': "Study X",
-            'drop-down': "Great",
-            'notes': "Good study session, and stuff"
+    @staticmethod
+    def _bind_notebook(entry, notes):
+        entry.delete(0, "end")
+        entry.insert(0, notes)
+
+    def _load_tracking_types(self, revalidate=False):
+        self.controller.db_worker.submit(
+            get_tracking_types,
+            revalidate,
+            key='tracking-types',
+            callback=self._on_tracking_types
+        )
+
+    def _on_tracking_types(self, tracking_types):
+        if not tracking_types and self.tracking_tasks:
+            # Couldn't reach the db; keep showing what was cached.
+            return
+        if tracking_types:
+            self.controller.local_cache.save_tracking_types(tracking_types)
+        self.tracking_tasks = tracking_types or dict()
+        self.tracking_tasks.update(self.controller.journal.pending_tracking_types())
+        self.listbox.destroy()
+        self._build_listbox()
+        self._request_panel()
+        self._request_summary()
+
+    @staticmethod
+    def _fetch_summary(journal, entry_title):
+        """
+        Runs on the db worker.  The summary is as stored; saves the flusher
+        hasn't replayed yet are only counted, and shown as pending.
+
+        :return: (summary, pending saves, journal.replayed when read)
+        """
+        replayed = journal.replayed
+        pending = len(journal.pending_records(entry_title))
+        return get_habit_summary(entry_title), pending, replayed
+
+    def _request_summary(self):
+        self.summary_label['text'] = ""
+        self.summary_replayed = None
+        if self.selection is None:
+            self.controller.db_worker.cancel('summary')
+            return
+        entry_title = self.selection
+
+        def on_summary(result):
+            summary, pending, replayed = result
+            if entry_title != self.selection or summary is None:
+                return
+            self.summary_label['text'] = self._summary_text(summary, pending)
+            if pending:
+                self.summary_replayed = replayed
+
+        self.controller.db_worker.submit(
+            self._fetch_summary,
+            self.controller.journal,
+            entry_title,
+            key='summary',
+            callback=on_summary
+        )
+
+    def journal_replayed(self, replayed):
+        """Read the summary again once saves it left out may be written."""
+        if self.summary_replayed is not None and replayed != self.summary_replayed:
+            self._request_summary()
+
+    @staticmethod
+    def _summary_text(summary, pending=0):
+        def rate(period):
+            _, done, days = period
+            return f"{done}/{days} ({done / days:.0%})" if days else "–"
+
+        lines = [
+            f"Streak: {summary['current_streak']} days "
+            f"(longest {summary['longest_streak']})",
+            f"This week {rate(summary['weeks'][0])} · "
+            f"last week {rate(summary['weeks'][1])} · "
+            f"this month {rate(summary['months'][0])} · "
+            f"last month {rate(summary['months'][1])}"
+        ]
+        if summary['outcomes']:
+            lines.append(" · ".join(
+                f"{outcome} {entries}" for outcome, entries in summary['outcomes']
+            ))
+        if pending:
+            lines.append(f"{pending} pending save(s) not counted yet")
+        return "\n".join(lines)
+
+    def _load_cached_window(self, entry_title):
+        """Put last session's page for a habit in the history, as stale."""
+        if entry_title in self.cached_windows:
+            return
+        self.cached_windows.add(entry_title)
+        window = self.controller.local_cache.window(entry_title)
+        if window is None:
+            return
+        cursor, records, exhausted, history_start = window
+        self.history.add_page(entry_title, cursor, records, exhausted, stale=True)
+        for record in self.controller.journal.pending_records(entry_title):
+            self.history.remember(record)
+        if history_start is not None:
+            self.history_starts.setdefault(entry_title, history_start)
+
+    def _show_cached(self):
+        """First paint: the selected habit as cached, or a loading message."""
+        if self.selection is not None:
+            self._load_cached_window(self.selection)
+            if self.history.shows(self.selection, self._viewport_dates()):
+                self._fill_panel_frame()
+                return
+        self._show_pending("Loading…")
+
+    def _show_pending(self, message):
+        """Hide the grid and show a message while data is on its way."""
+        self.panel_ready = False
+        self.panel_title['text'] = message
+        self.panel_body.grid_remove()
+        self.empty_state.grid_remove()
+        self.save_button.state(['disabled'])
+
+    def _request_panel(self, scrolling=False):
+        """
+        Show the selected habit, loading a page in the background if the
+        viewport isn't cached.  Newest request wins.
+        """
+        if self.selection is None:
+            self._show_pending("Nothing to track yet")
+            self.empty_state.grid()
+            return
+        entry_title = self.selection
+        self._load_cached_window(entry_title)
+        missing = self.history.first_missing(entry_title, self._viewport_dates())
+        if missing is None:
+            self.controller.db_worker.cancel('panel')
+            self._fill_panel_frame()
+            self._prefetch_older_page()
+            return
+        if self.history.shows(entry_title, self._viewport_dates()):
+            # Show the cached copy; the fresh page replaces it when it lands.
+            self._fill_panel_frame()
+        elif scrolling:
+            # Keep the grid up while scrolling, blank rows fill in shortly.
+            self._fill_panel_frame(loading=True)
+        else:
+            self._show_pending(f"Loading {entry_title}…")
+
+        def on_loaded(success):
+            if entry_title != self.selection:
+                return
+            if not success:
+                if not self.history.shows(entry_title, self._viewport_dates()):
+                    self._show_pending(f"Could not load {entry_title}")
+                return
+            self._request_panel(scrolling=scrolling)
+
+        self._submit_page('panel', entry_title, missing, on_loaded)
+
+    def _prefetch_older_page(self):
+        """Load the page behind the viewport so scrolling back is instant."""
+        window_start = self._viewport_dates()[-1]
+        ahead = [
+            window_start - datetime.timedelta(days=offset)
+            for offset in range(1, 2 * WORK_GRID_ROWS + 1)
+        ]
+        history_start = self.history_starts.get(self.selection)
+        if history_start is not None:
+            ahead = [date for date in ahead if date >= history_start]
+        missing = self.history.first_missing(self.selection, ahead)
+        if missing is not None:
+            self._submit_page('prefetch', self.selection, missing, lambda _: None)
+
+    def _history_days(self):
+        today = datetime.date.today()
+        history_start = self.history_starts.get(self.selection, today)
+        return max((today - history_start).days + 1, WORK_GRID_ROWS)
+
+    def _scroll_to(self, window_end):
+        today = datetime.date.today()
+        oldest_end = today - datetime.timedelta(days=self._history_days() - WORK_GRID_ROWS)
+        window_end = max(min(window_end, today), oldest_end)
+        if window_end == self.window_end:
+            return
+        self.window_end = window_end
+        self._request_panel(scrolling=True)
+
+    def _scroll_days(self, days):
+        """Move the viewport; negative goes back in time."""
+        self._scroll_to(self.window_end + datetime.timedelta(days=days))
+
+    def _page(self, weeks):
+        self._scroll_days(weeks * WORK_GRID_ROWS)
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            days_back = round(float(args[1]) * self._history_days())
+            self._scroll_to(datetime.date.today() - datetime.timedelta(days=days_back))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (WORK_GRID_ROWS if args[2] == 'pages' else 1)
+            self._scroll_days(-step)
+
+    def _on_mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self._scroll_days(1)
+        elif event.num == 5 or event.delta < 0:
+            self._scroll_days(-1)
+        return "break"
+
+    def _stored_values(self, entry_date, entry_title):
+        """The (outcome, notes) last loaded or saved for a cell row."""
+        record = self.history.get(entry_title, entry_date)
+        if record is None:
+            return '', ''
+        return record.outcome_option or '', record.notes or ''
+
+    def _on_cell_edit(self, row):
+        """Trace on the cell variables: note the row as edited or clean."""
+        if self.binding or self.selection is None or row >= len(self.work_dates):
+            return
+        key = (self.work_dates[row], self.selection)
+        values = (
+            self.work_rows[row]['drop-down'].get(),
+            self.work_rows[row]['notes'].get()
+        )
+        if values == self._stored_values(*key):
+            self.edits.pop(key, None)
+        else:
+            self.edits[key] = values
+        self.save_status['text'] = "Unsaved changes" if self.edits else ""
+        if self.controller.autosave.get():
+            self._schedule_autosave()
+
+    def _schedule_autosave(self):
+        """(Re)start the idle timer; edits until it fires share one save."""
+        self._cancel_autosave()
+        if self.edits:
+            self.autosave_after = self.after(AUTOSAVE_DEBOUNCE_MS, self._autosave)
+
+    def _cancel_autosave(self):
+        if self.autosave_after is not None:
+            self.after_cancel(self.autosave_after)
+            self.autosave_after = None
+
+    def on_autosave_toggled(self):
+        if self.controller.autosave.get():
+            self._schedule_autosave()
+        else:
+            self._cancel_autosave()
+
+    def _autosave(self):
+        """
+        Save every pending edit as one batch, then push it to the db.
+
+        :return: True if nothing is left unsaved
+        :rtype: bool
+        """
+        self.autosave_after = None
+        if not self.edits:
+            return True
+        if not self._save_records(quiet=True):
+            self.save_status['text'] = "Could not save"
+            return False
+        self.save_status['text'] = "Saving…"
+
+        def on_flushed(flushed):
+            if self.edits:
+                return
+            # Unflushed saves are safe in the journal and retried later.
+            self.save_status['text'] = "Saved" if flushed else "Saved locally"
+
+        self.controller.db_worker.submit(
+            self.controller.journal.flush,
+            key='autosave',
+            callback=on_flushed
+        )
+        return True
+
+    def confirm_close(self):
+        """
+        Deal with unsaved edits before the window closes.
+
+        :return: False to keep the window open
+        :rtype: bool
+        """
+        return not self.edits or self._resolve_unsaved()
+
+    def _resolve_unsaved(self):
+        """
+        Save or ask what to do with unsaved edits before leaving them.
+
+        :return: False to stay put
+        :rtype: bool
+        """
+        if self.controller.autosave.get():
+            self._cancel_autosave()
+            if self._autosave():
+                return True
+            display_message(title="Error", message="Records could not be saved")
+            return False
+        answer = messagebox.askyesnocancel(
+            title="Unsaved Changes",
+            message=f"Save your changes to {self.selection}?"
+        )
+        if answer is None:
+            return False
+        if answer:
+            return self._save_records()
+        self.edits.clear()
+        return True
+
+    def _save_records(self, quiet=False):
+        """
+        Write the edited cells, and only those.
+
+        :param quiet: no message boxes, for autosave
+        :return: True if nothing is left unsaved
+        :rtype: bool
+        """
+        # A background load may have caught up with an edit since.
+        self.edits = {
+            key: values for key, values in self.edits.items()
+            if values != self._stored_values(*key)
         }
-        success = add_record(new_record)
-        if success:
+        if not self.edits:
+            return True
+        records = [
+            Record(entry_date, entry_title, outcome_option, notes)
+            for (entry_date, entry_title), (outcome_option, notes)
+            in sorted(self.edits.items())
+        ]
+        results = self.controller.journal.add_records(records)
+        saved = list()
+        for record, success in zip(records, results):
+            if success:
+                del self.edits[record.entry_date, record.entry_title]
+                history_start = self.history_starts.get(record.entry_title)
+                if history_start is not None and record.entry_date < history_start:
+                    self.history_starts[record.entry_title] = record.entry_date
+                saved.append(record)
+                self.history.remember(record)
+        self.controller.local_cache.remember(saved)
+        failed = [
+            f"{record.entry_date:%d/%m/%Y}"
+            for record, success in zip(records, results)
+            if not success
+        ]
+        if len(failed) < len(records):
+            self._request_summary()
+        if not failed:
+            self.save_status['text'] = "Saved"
+        if quiet:
+            return not failed
+        if not failed:
             display_message(
                 title="Saved",
-                message="Record saved successfully"
+                message="Records saved successfully",
+                is_error=False
             )
-            print("Good save")
+        elif len(failed) == len(records):
+            display_message(title="Error", message="Records could not be saved")
         else:
-            print("Not good")
+            display_message(
+                title="Partly Saved",
+                message="Could not save: " + ", ".join(failed)
+            )
+        return not failed
 
     def _get_fields(self):
-        fields = get_tracking_types()
-        # todo: pick up here....
-
-        today = datetime.datetime.now()
-        day_range = range(today.day, today.day-WORK_GRID_ROWS, -1)
-        past_week_date_strs = (self._get_date_range(today, day) for day in day_range)
-        # TODO: fills to be updated from DB
+        tracking_type = self.tracking_tasks.get(self.selection)
+        options = tracking_type.drop_down_fields if tracking_type else ()
+        dates = self._viewport_dates()
+        rows = [
+            self.edits.get((date, self.selection))
+            or self._stored_values(date, self.selection)
+            for date in dates
+        ]
         fills = {
-            'date': [date for date in past_week_date_strs],
-            'drop-down': ['drop-down thingi'] * WORK_GRID_ROWS,
-            'notes': ['notes']*WORK_GRID_ROWS
+            'date': dates,
+            'drop-down': [(options, outcome_option) for outcome_option, _ in rows],
+            'notes': [notes for _, notes in rows]
         }
-        creators = (
-            (self._date_labels, 'date'),
-            (self._drop_down_maker, 'drop-down'),
-            (self._notebook_maker, 'notes')
+        return fills, self._creators()
+
+    def _creators(self):
+        return (
+            (self._date_labels, 'date', self._bind_date_label),
+            (self._drop_down_maker, 'drop-down', self._bind_drop_down),
+            (self._notebook_maker, 'notes', self._bind_notebook)
         )
-        return fills, creators
 
-    def _fill_panel_frame(self):
+    def _build_panel_frame(self):
+        """Build the work panel once; _fill_panel_frame rebinds its values."""
         self.panel_frame_style = ttk.Style()
         self.panel_frame_style.configure(
             style="PA.TFrame",
@@ -358,15 +1440,16 @@ class MainView(ttk.Frame):
             sticky="nsew",
         )
 
-        panel_title = ttk.Label(master=self.panel_frame, text=self.selection)
-        panel_title.grid(
+        self.panel_title = ttk.Label(master=self.panel_frame)
+        self.panel_title.grid(
             row=0,
             column=0,
             columnspan=3,
             pady=12
         )
+        self.panel_body = ttk.Frame(master=self.panel_frame)
         gird_titles = ttk.Frame(
-            master=self.panel_frame
+            master=self.panel_body
         )
         for column, title in enumerate(['Date', 'Selection', 'Notes']):
             title_label = ttk.Label(
@@ -383,13 +1466,29 @@ class MainView(ttk.Frame):
                 ipady=2,
                 sticky="ew"
             )
-        gird_titles.grid(row=1, column=0, sticky="nsew")
+        gird_titles.grid(row=0, column=0, sticky="nsew")
 
-        work_grid = ttk.Frame(self.panel_frame)
-        fills, creators = self._get_fields()
+        paging = ttk.Frame(master=self.panel_body)
+        earlier_button = ttk.Button(
+            paging,
+            text="◀ Earlier",
+            command=lambda: self._page(-1)
+        )
+        self.later_button = ttk.Button(
+            paging,
+            text="Later ▶",
+            command=lambda: self._page(1)
+        )
+        earlier_button.grid(row=0, column=0, padx=(0, 6))
+        self.later_button.grid(row=0, column=1)
+        paging.grid(row=1, column=0, sticky="w", pady=(6, 6))
+
+        work_grid = ttk.Frame(self.panel_body)
+        self.work_rows = list()
 
         for row in range(WORK_GRID_ROWS):
-            for column, creator in enumerate(creators):
+            work_row = dict()
+            for column, creator in enumerate(self._creators()):
                 box = ttk.Frame(master=work_grid, width=182)
                 box.grid(
                     row=row,
@@ -400,8 +1499,7 @@ class MainView(ttk.Frame):
                     ipady=2,
                     sticky="nsew"
                 )
-                title = creator[CREATOR_TITLE]
-                placer = creator[CREATOR_METHOD](box, fills[title][row])
+                placer = creator[CREATOR_METHOD](box)
                 placer.grid(
                     row=0,
                     column=0,
@@ -411,20 +1509,72 @@ class MainView(ttk.Frame):
                     ipady=2,
                     sticky="e"
                 )
-        work_grid.grid(row=3, column=0, sticky="nsew")
+                work_row[creator[CREATOR_TITLE]] = placer
+                if creator[CREATOR_TITLE] in ('drop-down', 'notes'):
+                    variable = tk.StringVar(master=placer)
+                    placer.configure(textvariable=variable)
+                    variable.trace_add(
+                        "write",
+                        lambda *_, row=row: self._on_cell_edit(row)
+                    )
+                for widget in (box, placer):
+                    widget.bind("<MouseWheel>", self._on_mouse_wheel)
+                    widget.bind("<Button-4>", self._on_mouse_wheel)
+                    widget.bind("<Button-5>", self._on_mouse_wheel)
+            self.work_rows.append(work_row)
+        work_grid.grid(row=2, column=0, sticky="nsew")
+        self.history_scrollbar = ttk.Scrollbar(
+            master=self.panel_body,
+            orient="vertical",
+            command=self._on_scrollbar
+        )
+        self.history_scrollbar.grid(row=2, column=1, sticky="ns")
+        self.panel_body.grid(row=1, column=0, columnspan=3, sticky="nsew")
+
+        self.empty_state = ttk.Frame(master=self.panel_frame, padding=12)
+        empty_label = ttk.Label(
+            master=self.empty_state,
+            text="Add a habit to start tracking it."
+        )
+        empty_add_button = ttk.Button(
+            master=self.empty_state,
+            text="Add Item…",
+            command=self.controller.add_item_dialog
+        )
+        empty_label.grid(row=0, column=0, pady=(0, 12))
+        empty_add_button.grid(row=1, column=0)
+        self.empty_state.grid(row=1, column=0, columnspan=3)
+        self.empty_state.grid_remove()
+
+        self.summary_label = ttk.Label(master=self.panel_frame, justify="left")
+        self.summary_label.grid(
+            row=3,
+            column=0,
+            columnspan=3,
+            sticky="w",
+            pady=(12, 0)
+        )
+
         panel_button_style = ttk.Style()
         panel_button_style.configure(
             style="PA.TButton",
             font=('Helvetica', 16)
         )
-        save_button = ttk.Button(
+        self.save_button = ttk.Button(
             self.panel_frame,
             text="Save",
             padding=16,
             style="PA.TButton",
             command=self._save_records
         )
-        save_button.grid(
+        self.save_status = ttk.Label(master=self.panel_frame)
+        self.save_status.grid(
+            row=4,
+            column=2,
+            sticky="w",
+            padx=(12, 0)
+        )
+        self.save_button.grid(
             row=4,
             column=0,
             sticky="e"
@@ -434,7 +1584,7 @@ class MainView(ttk.Frame):
             text="Quit",
             padding=16,
             style="PA.TButton",
-            command=self.controller.destroy
+            command=self.controller.close
         )
         quit_button.grid(
             row=4,
@@ -443,10 +1593,126 @@ class MainView(ttk.Frame):
             padx=(12, 0)
         )
 
-    def refresh(self):
-        self.tracking_tasks = get_tracking_types()
-        self.listbox.destroy()
-        self._build_listbox()
+    @timed("ui._fill_panel_frame")
+    def _fill_panel_frame(self, loading=False):
+        """Rebind the existing panel widgets to the current selection."""
+        fills, creators = self._get_fields()
+        if loading:
+            self.panel_title['text'] = f"{self.selection} (loading…)"
+        else:
+            self.panel_title['text'] = self.selection
+        self.work_dates = fills['date']
+        # Values set here come from the db or self.edits, not the user.
+        self.binding = True
+        try:
+            for row, work_row in enumerate(self.work_rows):
+                for creator in creators:
+                    title = creator[CREATOR_TITLE]
+                    creator[CREATOR_BINDER](work_row[title], fills[title][row])
+        finally:
+            self.binding = False
+        if self.window_end >= datetime.date.today():
+            self.later_button.state(['disabled'])
+        else:
+            self.later_button.state(['!disabled'])
+        history_days = self._history_days()
+        first = (datetime.date.today() - self.window_end).days / history_days
+        self.history_scrollbar.set(first, first + WORK_GRID_ROWS / history_days)
+        self.empty_state.grid_remove()
+        self.panel_body.grid()
+        self.panel_ready = not loading
+        if loading:
+            self.save_button.state(['disabled'])
+        else:
+            self.save_button.state(['!disabled'])
+
+    def set_online(self, online):
+        """Show or hide the offline notice, and retry what failed once back."""
+        if not online:
+            self.offline_label.grid()
+            return
+        self.offline_label.grid_remove()
+        # Reloads the panel too, replacing anything shown from the cache.
+        self._load_tracking_types(revalidate=True)
+
+    def search(self):
+        """Search the notes for what's in the search box."""
+        query = self.search_text.get().strip()
+        if not query:
+            return
+        if self.search_results is None:
+            self.search_results = SearchDialog(self.controller, self)
+        self.search_results.search(query)
+        self.search_results.lift()
+
+    def show_entry(self, entry_title, entry_date):
+        """Select a habit and scroll its panel to show entry_date."""
+        if entry_title not in self.tracking_tasks:
+            return
+        if entry_title != self.selection:
+            if self.edits and not self._resolve_unsaved():
+                return
+            self.selection = entry_title
+            index = self.track_tasks.index(entry_title)
+            self.listbox.selection_clear(0, "end")
+            self.listbox.selection_set(index)
+            self.listbox.see(index)
+            self._request_summary()
+        # Put the day in the middle of the viewport where there's room.
+        self.window_end = min(
+            entry_date + datetime.timedelta(days=WORK_GRID_ROWS // 2),
+            datetime.date.today()
+        )
+        self._request_panel()
+
+    def add_tracking_type(self, tracking_type):
+        """Show a habit just added here, without reloading the list."""
+        self._add_task(tracking_type)
+
+    def _add_task(self, tracking_type):
+        title = tracking_type.title
+        self.tracking_tasks[title] = tracking_type
+        if title in self.track_tasks:
+            return
+        self.track_tasks.append(title)
+        self.listbox.insert("end", title)
+        if self.selection is None:
+            self.selection = title
+            self.listbox.selection_set(0)
+            self._request_panel()
+            self._request_summary()
+
+    def apply_changes(self, changes):
+        """
+        Fold committed changes, from this or another client, into the list
+        and the open panel.  Unsaved edits stay as they are.
+        """
+        for tracking_type in changes['tracking_types'].values():
+            self._add_task(tracking_type)
+        if changes['records'] is None:
+            # Too many to patch in, start the history over.
+            self.history.forget()
+            self.history_starts.clear()
+            if self.selection is not None:
+                self._request_panel()
+                self._request_summary()
+            return
+        self.controller.local_cache.remember(changes['records'])
+        touched = set()
+        for record in changes['records']:
+            self.history.remember(record)
+            history_start = self.history_starts.get(record.entry_title)
+            if history_start is not None and record.entry_date < history_start:
+                self.history_starts[record.entry_title] = record.entry_date
+            touched.add(record.entry_title)
+        for title in touched:
+            # Saves still in the journal are newer than what came back.
+            for record in self.controller.journal.pending_records(title):
+                self.history.remember(record)
+        if self.selection in touched:
+            if self.panel_ready:
+                self._fill_panel_frame()
+            self._request_summary()
 
 
 
@@ -463,10 +1729,47 @@ class App(tk.Tk):
             label="Add Item…",
             command=self.add_item_dialog
         )
+        file_menu.add_command(
+            label="Dashboard…",
+            command=self.dashboard_dialog
+        )
+        file_menu.add_command(
+            label="Export…",
+            command=self.export_dialog
+        )
+        file_menu.add_command(
+            label="Diagnostics…",
+            command=self.diagnostics_dialog
+        )
+        self.autosave = tk.BooleanVar(master=self, value=AUTOSAVE)
+        file_menu.add_checkbutton(
+            label="Autosave",
+            variable=self.autosave,
+            command=lambda: self.view.on_autosave_toggled()
+        )
         file_menu.add_separator()
-        file_menu.add_command(label="Quit", command=self.destroy)
+        file_menu.add_command(label="Quit", command=self.close)
         menubar.add_cascade(label="File", menu=file_menu)
 
+        self.db_worker = DbWorker(self)
+        self.db_worker.start()
+        self.journal = Journal()
+        self.local_cache = LocalCache()
+        self.dashboard = None
+        self.export_thread = None
+        self.export_cancel = threading.Event()
+        # Replaying the journal can wait until the window is up.
+        self.after_idle(self.journal.start_flusher)
+        self.changes = ChangeFeed(
+            self,
+            self.db_worker,
+            on_changes=self._on_changes
+        )
+        # Queued ahead of the first load, so the watermark comes first.
+        self.changes.start()
+        self.online = True
+        self._online_after = self.after(ONLINE_CHECK_MS, self._check_online)
+
         # Main view
         style = ttk.Style()
         style.configure(style="TFrame", background="#1f1f1f")
@@ -474,16 +1777,119 @@ class App(tk.Tk):
         self.view.grid(sticky="nsew")
         self.grid_rowconfigure(index=0, weight=1)
         self.grid_columnconfigure(index=0, weight=1)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        """Quit, after saving or asking about unsaved edits."""
+        if not self.view.confirm_close():
+            return
+        if self.autosave.get():
+            # Try to get autosaved edits into the db now rather than next
+            # start, without hanging the window on an unreachable db.
+            self.journal.drain(CLOSE_FLUSH_SECONDS)
+        self.destroy()
+
+    def _on_changes(self, changes):
+        self.view.apply_changes(changes)
+        if self.dashboard is not None:
+            self.dashboard.apply_changes(changes)
+
+    def _check_online(self):
+        # Only reads the circuit breaker's state, so it never blocks.
+        online = database_online()
+        if online is not None and online != self.online:
+            self.online = online
+            self.view.set_online(online)
+            if online:
+                self.journal.wake()
+                self.changes.poll()
+        self.view.journal_replayed(self.journal.replayed)
+        rejected = self.journal.take_rejected()
+        if rejected:
+            display_message(
+                title="Error",
+                message=f"{rejected} saved entries were refused by the database "
+                        f"and moved to {self.journal.rejected_path}"
+            )
+        self._online_after = self.after(ONLINE_CHECK_MS, self._check_online)
+
+    def destroy(self):
+        self.after_cancel(self._online_after)
+        self.changes.stop()
+        self.journal.stop_flusher()
+        # The export stops at its next record and removes its partial file.
+        self.export_cancel.set()
+        if self.export_thread is not None:
+            self.export_thread.join(timeout=EXPORT_STOP_SECONDS)
+        # A query still running after this is abandoned with the app.
+        self.db_worker.shutdown(timeout=WORKER_STOP_SECONDS)
+        super().destroy()
+        self.local_cache.close()
+        close_storage()
+        if STATS_FILE:
+            try:
+                stats.dump(STATS_FILE)
+            except Exception as e:
+                print(str(e))
+
+    def export_dialog(self):
+        if self.export_thread is not None:
+            display_message("Export", "An export is already running.")
+            return
+        export_dialog = ExportDialog(self, self.view.tracking_tasks)
+        self.wait_window(export_dialog)
+        if export_dialog.result is None:
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self,
+            title="Export entries",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not path:
+            return
+        # On its own thread and connection, so habits keep loading meanwhile.
+        self.export_thread = self.db_worker.spawn(
+            export_file,
+            path,
+            **export_dialog.result,
+            progress=None,
+            cancel=self.export_cancel,
+            callback=self._on_export,
+            name="export"
+        )
+
+    def _on_export(self, totals):
+        self.export_thread = None
+        if totals is None:
+            display_message("Error", "Export failed.")
+        else:
+            display_message(
+                "Exported",
+                f"Exported {totals['exported']} entries to {totals['path']}.",
+                is_error=False
+            )
+
+    def diagnostics_dialog(self):
+        DiagnosticsDialog(self)
+
+    def dashboard_dialog(self):
+        if self.dashboard is None:
+            self.dashboard = DashboardDialog(self)
+        else:
+            self.dashboard.lift()
 
     def add_item_dialog(self):
         add_item_dialog = AddItemDialog(self)
         self.wait_window(add_item_dialog)
         if add_item_dialog.result:
-            self.view.refresh()
+            self.view.add_tracking_type(add_item_dialog.tracking_type)
 
 
 def main():
-    app = App()
+    with timer("ui.first_window"):
+        app = App()
+        app.update_idletasks()
     app.mainloop()
 
 
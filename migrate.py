@@ -0,0 +1,184 @@
+"""
+Bring the Postgres schema up to date.
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   list applied and pending migrations
+
+Migrations are the numbered files in migrations/, applied in order and
+recorded in schema_migrations, so each runs once per database.  A file is
+run the way psql -f runs it: statement by statement with autocommit.  A
+file that needs a transaction has its own BEGIN/COMMIT, and CREATE INDEX
+CONCURRENTLY and procedures that COMMIT in batches work.
+
+Files are written so that re-running them is safe; one that fails part
+way can be applied again once the cause is fixed.  Only one runner works
+on a database at a time.
+"""
+import argparse
+import os
+import re
+import sys
+from collections import deque
+
+import psycopg2
+
+from pg_storage import CONNECT_KWARGS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Any constant works; it only has to be the same for every runner.
+LOCK_KEY = 20240101
+FILE_PATTERN = re.compile(r"^(\d+)_.*\.sql$")
+DOLLAR_TAG = re.compile(r"\$[A-Za-z_]*\$")
+
+
+def migrations(directory=MIGRATIONS_DIR):
+    """
+    The migration files, in order.
+
+    :return: (version, name, path) tuples
+    :rtype: list
+    """
+    found = list()
+    for name in os.listdir(directory):
+        match = FILE_PATTERN.match(name)
+        if match:
+            found.append((int(match.group(1)), name, os.path.join(directory, name)))
+    found.sort()
+    versions = [version for version, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration numbers in {directory}")
+    return found
+
+
+def split_statements(sql):
+    """
+    Split a SQL script into statements on the semicolons that end them,
+    leaving those inside quotes, comments and $$ bodies alone.
+
+    :rtype: list[str]
+    """
+    statements = list()
+    start = 0
+    index = 0
+    length = len(sql)
+    while index < length:
+        char = sql[index]
+        if sql.startswith("--", index):
+            end = sql.find("\n", index)
+            index = length if end == -1 else end + 1
+        elif sql.startswith("/*", index):
+            end = sql.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+        elif char in ("'", '"'):
+            # A doubled quote is an escaped one, and is skipped the same way.
+            end = sql.find(char, index + 1)
+            index = length if end == -1 else end + 1
+        elif char == "$":
+            tag = DOLLAR_TAG.match(sql, index)
+            if tag:
+                end = sql.find(tag.group(0), index + len(tag.group(0)))
+                index = length if end == -1 else end + len(tag.group(0))
+            else:
+                index += 1
+        elif char == ";":
+            statements.append(sql[start:index + 1])
+            start = index = index + 1
+        else:
+            index += 1
+    statements.append(sql[start:])
+    return [
+        statement.strip() for statement in statements
+        if _strip_comments(statement).strip()
+    ]
+
+
+def _strip_comments(sql):
+    return re.sub(r"--[^\n]*|/\*.*?\*/", "", sql, flags=re.S)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations ORDER BY version;")
+    return {version for version, in cursor.fetchall()}
+
+
+def migrate(conn, progress=print):
+    """
+    Apply the pending migrations in order.
+
+    :return: names of the migrations applied
+    :rtype: list
+    """
+    conn.autocommit = True
+    # Unbounded, unlike psycopg2's default list of the last 50.
+    conn.notices = deque()
+    applied = list()
+    with conn.cursor() as cursor:
+        # Backfills run for as long as they need, whatever the app's limit.
+        cursor.execute("SET statement_timeout = 0;")
+        cursor.execute("SELECT pg_advisory_lock(%s);", (LOCK_KEY,))
+        try:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """
+            )
+            done = applied_versions(cursor)
+            for version, name, path in migrations():
+                if version in done:
+                    continue
+                progress(f"Applying {name}")
+                with open(path, encoding="utf-8") as source:
+                    statements = split_statements(source.read())
+                try:
+                    for statement in statements:
+                        cursor.execute(statement)
+                        # RAISE NOTICEs, e.g. what a file had to merge or remove.
+                        while conn.notices:
+                            progress(conn.notices.popleft().strip())
+                except Exception:
+                    # Don't leave a file's own BEGIN open on the connection.
+                    cursor.execute("ROLLBACK;")
+                    raise
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                    (version, name)
+                )
+                applied.append(name)
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (LOCK_KEY,))
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the Postgres schema up to date.")
+    parser.add_argument("--status", action="store_true", help="list, don't apply")
+    args = parser.parse_args()
+
+    try:
+        conn = psycopg2.connect(**CONNECT_KWARGS)
+    except psycopg2.Error as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    try:
+        if args.status:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL;")
+                done = applied_versions(cursor) if cursor.fetchone()[0] else set()
+            for version, name, _ in migrations():
+                print(f"{'applied' if version in done else 'pending'}  {name}")
+            return
+        applied = migrate(conn)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Up to date")
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
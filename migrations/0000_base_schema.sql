@@ -0,0 +1,17 @@
+-- The original tables.  Later migrations build on these.
+CREATE TABLE IF NOT EXISTS habit_tracking_types
+(
+    id SERIAL PRIMARY KEY,
+    title text,
+    drop_down_fields jsonb,
+    include_notes boolean
+);
+
+CREATE TABLE IF NOT EXISTS habit_tracking_fields (
+    id SERIAL PRIMARY KEY,
+    entry_date DATE NOT NULL,
+    entry_title TEXT NOT NULL,
+    outcome_option TEXT,
+    notes TEXT,
+    UNIQUE (entry_date, entry_title)
+);
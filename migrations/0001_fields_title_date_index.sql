@@ -0,0 +1,5 @@
+-- Serve "one habit, recent dates" reads (db.get_records) from an index.
+-- The existing UNIQUE (entry_date, entry_title) leads with the date, so it
+-- can't be used to look up a single title.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habit_tracking_fields_title_date_idx
+    ON habit_tracking_fields (entry_title, entry_date DESC);
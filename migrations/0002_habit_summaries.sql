@@ -0,0 +1,157 @@
+-- Per-habit summaries (outcome counts, done days per week and month, and
+-- streaks) kept up to date by triggers on habit_tracking_fields, so the
+-- panel reads a few summary rows instead of scanning a habit's history.
+--
+-- A day is done when it has an outcome.  Overwriting an outcome moves the
+-- count from the old outcome to the new one; clearing it undoes the day.
+--
+-- Writes to habit_tracking_fields wait while this runs: the table is locked
+-- so the backfill and the triggers see the same rows.
+BEGIN;
+
+LOCK TABLE habit_tracking_fields IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS habit_tracking_outcome_counts (
+    entry_title TEXT NOT NULL,
+    outcome_option TEXT NOT NULL,
+    entries INTEGER NOT NULL,
+    PRIMARY KEY (entry_title, outcome_option)
+);
+
+CREATE TABLE IF NOT EXISTS habit_tracking_period_counts (
+    entry_title TEXT NOT NULL,
+    period TEXT NOT NULL CHECK (period IN ('week', 'month')),
+    period_start DATE NOT NULL,
+    done INTEGER NOT NULL,
+    PRIMARY KEY (entry_title, period, period_start)
+);
+
+-- Maximal runs of consecutive done days.
+CREATE TABLE IF NOT EXISTS habit_tracking_streaks (
+    entry_title TEXT NOT NULL,
+    run_start DATE NOT NULL,
+    run_end DATE NOT NULL,
+    PRIMARY KEY (entry_title, run_start)
+);
+CREATE INDEX IF NOT EXISTS habit_tracking_streaks_title_end_idx
+    ON habit_tracking_streaks (entry_title, run_end DESC);
+
+CREATE OR REPLACE FUNCTION habit_tracking_summarise() RETURNS trigger AS $$
+DECLARE
+    was_done BOOLEAN := TG_OP = 'UPDATE' AND coalesce(OLD.outcome_option, '') <> '';
+    is_done BOOLEAN := coalesce(NEW.outcome_option, '') <> '';
+    delta INTEGER;
+BEGIN
+    IF was_done THEN
+        UPDATE habit_tracking_outcome_counts
+        SET entries = entries - 1
+        WHERE entry_title = OLD.entry_title
+            AND outcome_option = OLD.outcome_option;
+    END IF;
+    IF is_done THEN
+        INSERT INTO habit_tracking_outcome_counts (entry_title, outcome_option, entries)
+        VALUES (NEW.entry_title, NEW.outcome_option, 1)
+        ON CONFLICT (entry_title, outcome_option)
+        DO UPDATE SET entries = habit_tracking_outcome_counts.entries + 1;
+    END IF;
+    IF was_done = is_done THEN
+        RETURN NULL;
+    END IF;
+
+    delta := CASE WHEN is_done THEN 1 ELSE -1 END;
+    INSERT INTO habit_tracking_period_counts (entry_title, period, period_start, done)
+    VALUES
+        (NEW.entry_title, 'week', date_trunc('week', NEW.entry_date)::date, delta),
+        (NEW.entry_title, 'month', date_trunc('month', NEW.entry_date)::date, delta)
+    ON CONFLICT (entry_title, period, period_start)
+    DO UPDATE SET done = habit_tracking_period_counts.done + EXCLUDED.done;
+
+    -- One writer at a time rewrites a habit's runs.
+    PERFORM pg_advisory_xact_lock(hashtext('habit_tracking_streaks:' || NEW.entry_title));
+    IF is_done THEN
+        -- Join the run ending yesterday and the run starting tomorrow.
+        UPDATE habit_tracking_streaks
+        SET run_end = coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE entry_title = NEW.entry_title AND run_start = NEW.entry_date + 1),
+            NEW.entry_date
+        )
+        WHERE entry_title = NEW.entry_title AND run_end = NEW.entry_date - 1;
+        INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+        SELECT NEW.entry_title, NEW.entry_date, coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE entry_title = NEW.entry_title AND run_start = NEW.entry_date + 1),
+            NEW.entry_date
+        )
+        WHERE NOT EXISTS (
+            SELECT 1 FROM habit_tracking_streaks
+            WHERE entry_title = NEW.entry_title
+                AND run_start <= NEW.entry_date AND run_end >= NEW.entry_date
+        );
+        DELETE FROM habit_tracking_streaks
+        WHERE entry_title = NEW.entry_title AND run_start = NEW.entry_date + 1;
+    ELSE
+        -- Split the run around the day.
+        INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+        SELECT entry_title, NEW.entry_date + 1, run_end
+        FROM habit_tracking_streaks
+        WHERE entry_title = NEW.entry_title
+            AND run_start <= NEW.entry_date AND run_end > NEW.entry_date;
+        DELETE FROM habit_tracking_streaks
+        WHERE entry_title = NEW.entry_title AND run_start = NEW.entry_date;
+        UPDATE habit_tracking_streaks
+        SET run_end = NEW.entry_date - 1
+        WHERE entry_title = NEW.entry_title
+            AND run_start < NEW.entry_date AND run_end >= NEW.entry_date;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS habit_tracking_fields_summarise_insert ON habit_tracking_fields;
+CREATE TRIGGER habit_tracking_fields_summarise_insert
+    AFTER INSERT ON habit_tracking_fields
+    FOR EACH ROW EXECUTE PROCEDURE habit_tracking_summarise();
+
+DROP TRIGGER IF EXISTS habit_tracking_fields_summarise_update ON habit_tracking_fields;
+CREATE TRIGGER habit_tracking_fields_summarise_update
+    AFTER UPDATE OF outcome_option ON habit_tracking_fields
+    FOR EACH ROW
+    WHEN (OLD.outcome_option IS DISTINCT FROM NEW.outcome_option)
+    EXECUTE PROCEDURE habit_tracking_summarise();
+
+-- Backfill from what is already there.
+TRUNCATE habit_tracking_outcome_counts, habit_tracking_period_counts, habit_tracking_streaks;
+
+INSERT INTO habit_tracking_outcome_counts (entry_title, outcome_option, entries)
+SELECT entry_title, outcome_option, count(*)
+FROM habit_tracking_fields
+WHERE coalesce(outcome_option, '') <> ''
+GROUP BY entry_title, outcome_option;
+
+INSERT INTO habit_tracking_period_counts (entry_title, period, period_start, done)
+SELECT entry_title, 'week', date_trunc('week', entry_date)::date, count(*)
+FROM habit_tracking_fields
+WHERE coalesce(outcome_option, '') <> ''
+GROUP BY 1, 2, 3
+UNION ALL
+SELECT entry_title, 'month', date_trunc('month', entry_date)::date, count(*)
+FROM habit_tracking_fields
+WHERE coalesce(outcome_option, '') <> ''
+GROUP BY 1, 2, 3;
+
+INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+SELECT entry_title, min(entry_date), max(entry_date)
+FROM (
+    SELECT
+        entry_title,
+        entry_date,
+        entry_date - (row_number() OVER (
+            PARTITION BY entry_title ORDER BY entry_date
+        ))::int AS island
+    FROM habit_tracking_fields
+    WHERE coalesce(outcome_option, '') <> ''
+) done_days
+GROUP BY entry_title, island;
+
+COMMIT;
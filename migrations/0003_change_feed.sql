@@ -0,0 +1,56 @@
+-- Change feed: every row remembers the transaction that last wrote it, so
+-- clients can ask for what changed since they last looked.
+--
+-- change_seq is txid_current() of the writing transaction.  A reader's
+-- watermark is the xmin of its snapshot: every transaction below it has
+-- finished, so nothing committed later can land behind the watermark.
+-- Rows at or above it may be handed out twice, which is harmless.
+--
+-- A statement level trigger also sends NOTIFY habit_tracking_changes on
+-- commit, for clients that LISTEN instead of polling.
+--
+-- Run outside a transaction (psql -f does) for CREATE INDEX CONCURRENTLY.
+
+ALTER TABLE habit_tracking_types
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT txid_current();
+ALTER TABLE habit_tracking_fields
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT txid_current();
+
+CREATE OR REPLACE FUNCTION habit_tracking_stamp_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION habit_tracking_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('habit_tracking_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS habit_tracking_types_stamp_change ON habit_tracking_types;
+CREATE TRIGGER habit_tracking_types_stamp_change
+    BEFORE INSERT OR UPDATE ON habit_tracking_types
+    FOR EACH ROW EXECUTE PROCEDURE habit_tracking_stamp_change();
+
+DROP TRIGGER IF EXISTS habit_tracking_fields_stamp_change ON habit_tracking_fields;
+CREATE TRIGGER habit_tracking_fields_stamp_change
+    BEFORE INSERT OR UPDATE ON habit_tracking_fields
+    FOR EACH ROW EXECUTE PROCEDURE habit_tracking_stamp_change();
+
+DROP TRIGGER IF EXISTS habit_tracking_types_notify_change ON habit_tracking_types;
+CREATE TRIGGER habit_tracking_types_notify_change
+    AFTER INSERT OR UPDATE ON habit_tracking_types
+    FOR EACH STATEMENT EXECUTE PROCEDURE habit_tracking_notify_change();
+
+DROP TRIGGER IF EXISTS habit_tracking_fields_notify_change ON habit_tracking_fields;
+CREATE TRIGGER habit_tracking_fields_notify_change
+    AFTER INSERT OR UPDATE ON habit_tracking_fields
+    FOR EACH STATEMENT EXECUTE PROCEDURE habit_tracking_notify_change();
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habit_tracking_types_change_seq_idx
+    ON habit_tracking_types (change_seq);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habit_tracking_fields_change_seq_idx
+    ON habit_tracking_fields (change_seq);
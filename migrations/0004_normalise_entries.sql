@@ -0,0 +1,311 @@
+-- Normalise entries.  habit_entries keys each row by an integer habit_id,
+-- a foreign key to habit_tracking_types (whose titles become unique), and
+-- stores the outcome as a smallint index into the habit's
+-- drop_down_fields, instead of repeating both as text on every row.
+-- The summary tables are still keyed by title here, so renaming a habit
+-- loses its streaks and counts until 0006 re-keys them on habit_id.
+--
+-- This runs online.  habit_tracking_fields stays, and a trigger mirrors
+-- every write to it into habit_entries, so clients still on the old
+-- version keep working while existing rows are copied across in batches,
+-- each batch in its own transaction.  An outcome that isn't one of its
+-- habit's options is appended to them, and an entry for a habit that
+-- doesn't exist gets one, so nothing is dropped.  habit_tracking_fields
+-- can go in a later migration once every client has moved over.
+--
+-- Needs autocommit (migrate.py and psql -f both use it) for CONCURRENTLY
+-- and the batch commits, and Postgres 11+ for the procedure.
+
+-- Unique titles.  Untitled habits can't hold entries and are dropped.  A
+-- duplicate title is folded into its oldest habit: options it has that
+-- the oldest doesn't are appended, so its entries keep their outcomes, and
+-- notes are on if either had them.  Each one is reported with a NOTICE.
+DO $$
+DECLARE
+    untitled INTEGER;
+    duplicate RECORD;
+BEGIN
+    DELETE FROM habit_tracking_types WHERE title IS NULL;
+    GET DIAGNOSTICS untitled = ROW_COUNT;
+    IF untitled > 0 THEN
+        RAISE NOTICE 'removed % untitled habit(s)', untitled;
+    END IF;
+
+    FOR duplicate IN
+        SELECT habit.*, original.id AS original_id
+        FROM habit_tracking_types habit
+        JOIN LATERAL (
+            SELECT min(id) AS id FROM habit_tracking_types WHERE title = habit.title
+        ) original ON original.id < habit.id
+        ORDER BY habit.id
+    LOOP
+        UPDATE habit_tracking_types original
+        SET drop_down_fields = coalesce(original.drop_down_fields, '[]') || coalesce((
+                SELECT jsonb_agg(option.value ORDER BY option.ordinality)
+                FROM jsonb_array_elements(coalesce(duplicate.drop_down_fields, '[]'))
+                    WITH ORDINALITY option (value, ordinality)
+                WHERE NOT coalesce(original.drop_down_fields, '[]')
+                    @> jsonb_build_array(option.value)
+            ), '[]'),
+            include_notes = coalesce(original.include_notes, false)
+                OR coalesce(duplicate.include_notes, false)
+        WHERE original.id = duplicate.original_id;
+        DELETE FROM habit_tracking_types WHERE id = duplicate.id;
+        RAISE NOTICE 'merged habit % (id %, options %) into id %',
+            quote_literal(duplicate.title), duplicate.id,
+            coalesce(duplicate.drop_down_fields, '[]'), duplicate.original_id;
+    END LOOP;
+END;
+$$;
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS habit_tracking_types_title_key
+    ON habit_tracking_types (title);
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'habit_tracking_types_title_key'
+    ) THEN
+        ALTER TABLE habit_tracking_types
+            ADD CONSTRAINT habit_tracking_types_title_key
+            UNIQUE USING INDEX habit_tracking_types_title_key;
+    END IF;
+END;
+$$;
+ALTER TABLE habit_tracking_types ALTER COLUMN title SET NOT NULL;
+
+-- id of the habit with this title, adding it if there isn't one.
+CREATE OR REPLACE FUNCTION habit_tracking_habit_id(p_title TEXT) RETURNS INTEGER AS $$
+DECLARE
+    found_id INTEGER;
+BEGIN
+    SELECT id INTO found_id FROM habit_tracking_types WHERE title = p_title;
+    IF found_id IS NULL THEN
+        INSERT INTO habit_tracking_types (title, drop_down_fields, include_notes)
+        VALUES (p_title, '[]', true)
+        ON CONFLICT (title) DO NOTHING;
+        SELECT id INTO found_id FROM habit_tracking_types WHERE title = p_title;
+    END IF;
+    RETURN found_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Index of an outcome in the habit's options, appending it if it isn't
+-- there; NULL for no outcome.  Options are only ever appended, so stored
+-- indexes stay valid.
+CREATE OR REPLACE FUNCTION habit_tracking_outcome_index(
+    p_habit_id INTEGER, p_outcome TEXT
+) RETURNS SMALLINT AS $$
+DECLARE
+    options JSONB;
+    found_at BIGINT;
+BEGIN
+    IF coalesce(p_outcome, '') = '' THEN
+        RETURN NULL;
+    END IF;
+    SELECT coalesce(drop_down_fields, '[]') INTO options
+    FROM habit_tracking_types WHERE id = p_habit_id;
+    SELECT option.ordinality - 1 INTO found_at
+    FROM jsonb_array_elements_text(options) WITH ORDINALITY option (value, ordinality)
+    WHERE option.value = p_outcome
+    LIMIT 1;
+    IF found_at IS NULL THEN
+        -- Look again under the row lock, another writer may have added it.
+        SELECT coalesce(drop_down_fields, '[]') INTO options
+        FROM habit_tracking_types WHERE id = p_habit_id FOR UPDATE;
+        SELECT option.ordinality - 1 INTO found_at
+        FROM jsonb_array_elements_text(options) WITH ORDINALITY option (value, ordinality)
+        WHERE option.value = p_outcome
+        LIMIT 1;
+        IF found_at IS NULL THEN
+            UPDATE habit_tracking_types
+            SET drop_down_fields = options || to_jsonb(p_outcome)
+            WHERE id = p_habit_id;
+            found_at := jsonb_array_length(options);
+        END IF;
+    END IF;
+    RETURN found_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE IF NOT EXISTS habit_entries (
+    habit_id INTEGER NOT NULL REFERENCES habit_tracking_types (id),
+    entry_date DATE NOT NULL,
+    outcome SMALLINT,
+    notes TEXT,
+    change_seq BIGINT NOT NULL DEFAULT txid_current(),
+    PRIMARY KEY (habit_id, entry_date)
+);
+CREATE INDEX IF NOT EXISTS habit_entries_change_seq_idx
+    ON habit_entries (change_seq);
+
+-- Change feed, as 0003 set up for habit_tracking_fields.
+DROP TRIGGER IF EXISTS habit_entries_stamp_change ON habit_entries;
+CREATE TRIGGER habit_entries_stamp_change
+    BEFORE INSERT OR UPDATE ON habit_entries
+    FOR EACH ROW EXECUTE PROCEDURE habit_tracking_stamp_change();
+DROP TRIGGER IF EXISTS habit_entries_notify_change ON habit_entries;
+CREATE TRIGGER habit_entries_notify_change
+    AFTER INSERT OR UPDATE ON habit_entries
+    FOR EACH STATEMENT EXECUTE PROCEDURE habit_tracking_notify_change();
+
+-- Summaries, as 0002 set up for habit_tracking_fields, now worked out
+-- from outcome text so either table can feed them.
+CREATE OR REPLACE FUNCTION habit_tracking_summarise_day(
+    p_title TEXT, p_date DATE, p_old TEXT, p_new TEXT
+) RETURNS void AS $$
+DECLARE
+    was_done BOOLEAN := coalesce(p_old, '') <> '';
+    is_done BOOLEAN := coalesce(p_new, '') <> '';
+    delta INTEGER;
+BEGIN
+    IF was_done THEN
+        UPDATE habit_tracking_outcome_counts
+        SET entries = entries - 1
+        WHERE entry_title = p_title AND outcome_option = p_old;
+    END IF;
+    IF is_done THEN
+        INSERT INTO habit_tracking_outcome_counts (entry_title, outcome_option, entries)
+        VALUES (p_title, p_new, 1)
+        ON CONFLICT (entry_title, outcome_option)
+        DO UPDATE SET entries = habit_tracking_outcome_counts.entries + 1;
+    END IF;
+    IF was_done = is_done THEN
+        RETURN;
+    END IF;
+
+    delta := CASE WHEN is_done THEN 1 ELSE -1 END;
+    INSERT INTO habit_tracking_period_counts (entry_title, period, period_start, done)
+    VALUES
+        (p_title, 'week', date_trunc('week', p_date)::date, delta),
+        (p_title, 'month', date_trunc('month', p_date)::date, delta)
+    ON CONFLICT (entry_title, period, period_start)
+    DO UPDATE SET done = habit_tracking_period_counts.done + EXCLUDED.done;
+
+    -- One writer at a time rewrites a habit's runs.
+    PERFORM pg_advisory_xact_lock(hashtext('habit_tracking_streaks:' || p_title));
+    IF is_done THEN
+        -- Join the run ending yesterday and the run starting tomorrow.
+        UPDATE habit_tracking_streaks
+        SET run_end = coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE entry_title = p_title AND run_start = p_date + 1),
+            p_date
+        )
+        WHERE entry_title = p_title AND run_end = p_date - 1;
+        INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+        SELECT p_title, p_date, coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE entry_title = p_title AND run_start = p_date + 1),
+            p_date
+        )
+        WHERE NOT EXISTS (
+            SELECT 1 FROM habit_tracking_streaks
+            WHERE entry_title = p_title AND run_start <= p_date AND run_end >= p_date
+        );
+        DELETE FROM habit_tracking_streaks
+        WHERE entry_title = p_title AND run_start = p_date + 1;
+    ELSE
+        -- Split the run around the day.
+        INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+        SELECT entry_title, p_date + 1, run_end
+        FROM habit_tracking_streaks
+        WHERE entry_title = p_title AND run_start <= p_date AND run_end > p_date;
+        DELETE FROM habit_tracking_streaks
+        WHERE entry_title = p_title AND run_start = p_date;
+        UPDATE habit_tracking_streaks
+        SET run_end = p_date - 1
+        WHERE entry_title = p_title AND run_start < p_date AND run_end >= p_date;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION habit_entries_summarise() RETURNS trigger AS $$
+DECLARE
+    habit habit_tracking_types%ROWTYPE;
+BEGIN
+    SELECT * INTO habit FROM habit_tracking_types WHERE id = NEW.habit_id;
+    PERFORM habit_tracking_summarise_day(
+        habit.title,
+        NEW.entry_date,
+        CASE WHEN TG_OP = 'UPDATE' THEN habit.drop_down_fields->>(OLD.outcome::int) END,
+        habit.drop_down_fields->>(NEW.outcome::int)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS habit_entries_summarise_insert ON habit_entries;
+CREATE TRIGGER habit_entries_summarise_insert
+    AFTER INSERT ON habit_entries
+    FOR EACH ROW EXECUTE PROCEDURE habit_entries_summarise();
+DROP TRIGGER IF EXISTS habit_entries_summarise_update ON habit_entries;
+CREATE TRIGGER habit_entries_summarise_update
+    AFTER UPDATE OF outcome ON habit_entries
+    FOR EACH ROW
+    WHEN (OLD.outcome IS DISTINCT FROM NEW.outcome)
+    EXECUTE PROCEDURE habit_entries_summarise();
+
+-- From here the summaries follow habit_entries only.  On the first run
+-- they start over and are rebuilt as rows are copied in below.
+DROP TRIGGER IF EXISTS habit_tracking_fields_summarise_insert ON habit_tracking_fields;
+DROP TRIGGER IF EXISTS habit_tracking_fields_summarise_update ON habit_tracking_fields;
+DROP FUNCTION IF EXISTS habit_tracking_summarise();
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM habit_entries) THEN
+        TRUNCATE habit_tracking_outcome_counts, habit_tracking_period_counts,
+            habit_tracking_streaks;
+    END IF;
+END;
+$$;
+
+-- Mirror writes from clients still using habit_tracking_fields.
+CREATE OR REPLACE FUNCTION habit_tracking_fields_mirror() RETURNS trigger AS $$
+DECLARE
+    v_habit_id INTEGER := habit_tracking_habit_id(NEW.entry_title);
+BEGIN
+    INSERT INTO habit_entries (habit_id, entry_date, outcome, notes)
+    VALUES (
+        v_habit_id,
+        NEW.entry_date,
+        habit_tracking_outcome_index(v_habit_id, NEW.outcome_option),
+        NEW.notes
+    )
+    ON CONFLICT (habit_id, entry_date)
+    DO UPDATE SET outcome = EXCLUDED.outcome, notes = EXCLUDED.notes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS habit_tracking_fields_mirror ON habit_tracking_fields;
+CREATE TRIGGER habit_tracking_fields_mirror
+    AFTER INSERT OR UPDATE ON habit_tracking_fields
+    FOR EACH ROW EXECUTE PROCEDURE habit_tracking_fields_mirror();
+
+-- Copy what was there before the mirror, batch_size ids per transaction.
+-- Rows the mirror already wrote are newer and are left alone.
+CREATE OR REPLACE PROCEDURE habit_entries_backfill(batch_size INTEGER) AS $$
+DECLARE
+    last_id BIGINT := 0;
+    max_id BIGINT;
+BEGIN
+    SELECT coalesce(max(id), 0) INTO max_id FROM habit_tracking_fields;
+    WHILE last_id < max_id LOOP
+        INSERT INTO habit_entries (habit_id, entry_date, outcome, notes)
+        SELECT
+            habit.id,
+            field.entry_date,
+            habit_tracking_outcome_index(habit.id, field.outcome_option),
+            field.notes
+        FROM habit_tracking_fields field
+        CROSS JOIN LATERAL (
+            SELECT habit_tracking_habit_id(field.entry_title) AS id
+        ) habit
+        WHERE field.id > last_id AND field.id <= last_id + batch_size
+        ON CONFLICT (habit_id, entry_date) DO NOTHING;
+        last_id := last_id + batch_size;
+        COMMIT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CALL habit_entries_backfill(5000);
@@ -0,0 +1,20 @@
+-- Full-text search over entry notes.  habit_entries gets notes_search, a
+-- tsvector of its notes that Postgres keeps up to date itself, and a GIN
+-- index on it, so a search reads the index instead of every note.
+--
+-- Words are stemmed with the english configuration, so "knee pain" also
+-- finds "painful knees".  Writes mirrored from habit_tracking_fields by
+-- 0004 land in habit_entries and are indexed the same way.
+--
+-- Adding the column rewrites habit_entries once, and writes to it wait
+-- while that runs.  Needs Postgres 12+ for the generated column, and
+-- autocommit (migrate.py and psql -f both use it) for CONCURRENTLY.
+
+ALTER TABLE habit_entries
+    ADD COLUMN IF NOT EXISTS notes_search tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('english'::regconfig, coalesce(notes, ''))
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habit_entries_notes_search_idx
+    ON habit_entries USING GIN (notes_search);
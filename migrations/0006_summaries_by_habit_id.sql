@@ -0,0 +1,154 @@
+-- Key the summary tables from 0002 on habit_id, as 0004 did for entries,
+-- so that renaming a habit (one UPDATE of habit_tracking_types.title)
+-- keeps its streaks and counts.  Rows for titles without a habit can't be
+-- reached any more and are dropped.
+--
+-- Clients from before this change read summaries by title, and show none
+-- until they are updated.  Writes to habit_entries wait while this runs:
+-- the table is locked so the re-keyed rows and the new triggers agree.
+BEGIN;
+
+LOCK TABLE habit_entries IN SHARE ROW EXCLUSIVE MODE;
+
+ALTER TABLE habit_tracking_outcome_counts
+    ADD COLUMN IF NOT EXISTS habit_id INTEGER REFERENCES habit_tracking_types (id);
+ALTER TABLE habit_tracking_period_counts
+    ADD COLUMN IF NOT EXISTS habit_id INTEGER REFERENCES habit_tracking_types (id);
+ALTER TABLE habit_tracking_streaks
+    ADD COLUMN IF NOT EXISTS habit_id INTEGER REFERENCES habit_tracking_types (id);
+
+-- Only does anything the first time, while entry_title is still there.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'habit_tracking_streaks' AND column_name = 'entry_title'
+    ) THEN
+        UPDATE habit_tracking_outcome_counts summary
+        SET habit_id = habit.id
+        FROM habit_tracking_types habit
+        WHERE habit.title = summary.entry_title;
+        UPDATE habit_tracking_period_counts summary
+        SET habit_id = habit.id
+        FROM habit_tracking_types habit
+        WHERE habit.title = summary.entry_title;
+        UPDATE habit_tracking_streaks summary
+        SET habit_id = habit.id
+        FROM habit_tracking_types habit
+        WHERE habit.title = summary.entry_title;
+
+        DELETE FROM habit_tracking_outcome_counts WHERE habit_id IS NULL;
+        DELETE FROM habit_tracking_period_counts WHERE habit_id IS NULL;
+        DELETE FROM habit_tracking_streaks WHERE habit_id IS NULL;
+
+        ALTER TABLE habit_tracking_outcome_counts
+            DROP CONSTRAINT habit_tracking_outcome_counts_pkey,
+            DROP COLUMN entry_title,
+            ALTER COLUMN habit_id SET NOT NULL,
+            ADD PRIMARY KEY (habit_id, outcome_option);
+        ALTER TABLE habit_tracking_period_counts
+            DROP CONSTRAINT habit_tracking_period_counts_pkey,
+            DROP COLUMN entry_title,
+            ALTER COLUMN habit_id SET NOT NULL,
+            ADD PRIMARY KEY (habit_id, period, period_start);
+        -- Takes habit_tracking_streaks_title_end_idx with it.
+        ALTER TABLE habit_tracking_streaks
+            DROP CONSTRAINT habit_tracking_streaks_pkey,
+            DROP COLUMN entry_title,
+            ALTER COLUMN habit_id SET NOT NULL,
+            ADD PRIMARY KEY (habit_id, run_start);
+    END IF;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS habit_tracking_streaks_habit_end_idx
+    ON habit_tracking_streaks (habit_id, run_end DESC);
+
+-- As in 0004, by habit_id instead of title.
+DROP FUNCTION IF EXISTS habit_tracking_summarise_day(TEXT, DATE, TEXT, TEXT);
+CREATE OR REPLACE FUNCTION habit_tracking_summarise_day(
+    p_habit_id INTEGER, p_date DATE, p_old TEXT, p_new TEXT
+) RETURNS void AS $$
+DECLARE
+    was_done BOOLEAN := coalesce(p_old, '') <> '';
+    is_done BOOLEAN := coalesce(p_new, '') <> '';
+    delta INTEGER;
+BEGIN
+    IF was_done THEN
+        UPDATE habit_tracking_outcome_counts
+        SET entries = entries - 1
+        WHERE habit_id = p_habit_id AND outcome_option = p_old;
+    END IF;
+    IF is_done THEN
+        INSERT INTO habit_tracking_outcome_counts (habit_id, outcome_option, entries)
+        VALUES (p_habit_id, p_new, 1)
+        ON CONFLICT (habit_id, outcome_option)
+        DO UPDATE SET entries = habit_tracking_outcome_counts.entries + 1;
+    END IF;
+    IF was_done = is_done THEN
+        RETURN;
+    END IF;
+
+    delta := CASE WHEN is_done THEN 1 ELSE -1 END;
+    INSERT INTO habit_tracking_period_counts (habit_id, period, period_start, done)
+    VALUES
+        (p_habit_id, 'week', date_trunc('week', p_date)::date, delta),
+        (p_habit_id, 'month', date_trunc('month', p_date)::date, delta)
+    ON CONFLICT (habit_id, period, period_start)
+    DO UPDATE SET done = habit_tracking_period_counts.done + EXCLUDED.done;
+
+    -- One writer at a time rewrites a habit's runs.
+    PERFORM pg_advisory_xact_lock(hashtext('habit_tracking_streaks'), p_habit_id);
+    IF is_done THEN
+        -- Join the run ending yesterday and the run starting tomorrow.
+        UPDATE habit_tracking_streaks
+        SET run_end = coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE habit_id = p_habit_id AND run_start = p_date + 1),
+            p_date
+        )
+        WHERE habit_id = p_habit_id AND run_end = p_date - 1;
+        INSERT INTO habit_tracking_streaks (habit_id, run_start, run_end)
+        SELECT p_habit_id, p_date, coalesce(
+            (SELECT run_end FROM habit_tracking_streaks
+             WHERE habit_id = p_habit_id AND run_start = p_date + 1),
+            p_date
+        )
+        WHERE NOT EXISTS (
+            SELECT 1 FROM habit_tracking_streaks
+            WHERE habit_id = p_habit_id AND run_start <= p_date AND run_end >= p_date
+        );
+        DELETE FROM habit_tracking_streaks
+        WHERE habit_id = p_habit_id AND run_start = p_date + 1;
+    ELSE
+        -- Split the run around the day.
+        INSERT INTO habit_tracking_streaks (habit_id, run_start, run_end)
+        SELECT habit_id, p_date + 1, run_end
+        FROM habit_tracking_streaks
+        WHERE habit_id = p_habit_id AND run_start <= p_date AND run_end > p_date;
+        DELETE FROM habit_tracking_streaks
+        WHERE habit_id = p_habit_id AND run_start = p_date;
+        UPDATE habit_tracking_streaks
+        SET run_end = p_date - 1
+        WHERE habit_id = p_habit_id AND run_start < p_date AND run_end >= p_date;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION habit_entries_summarise() RETURNS trigger AS $$
+DECLARE
+    options JSONB;
+BEGIN
+    SELECT drop_down_fields INTO options
+    FROM habit_tracking_types WHERE id = NEW.habit_id;
+    PERFORM habit_tracking_summarise_day(
+        NEW.habit_id,
+        NEW.entry_date,
+        CASE WHEN TG_OP = 'UPDATE' THEN options->>(OLD.outcome::int) END,
+        options->>(NEW.outcome::int)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,49 @@
+-- Lookups for the app's own writes to habit_entries that refuse what they
+-- don't know, instead of adding it the way 0004's habit_tracking_habit_id
+-- and habit_tracking_outcome_index do.  A misspelt title or a stale
+-- journal entry then fails with an integrity or data error, which the app
+-- moves aside, rather than quietly creating a habit or changing a habit's
+-- options.
+--
+-- 0004's functions stay for what they were written for: the backfill and
+-- the mirror of writes from clients still on habit_tracking_fields.
+
+-- id of the habit with this title; foreign_key_violation if there isn't one.
+CREATE OR REPLACE FUNCTION habit_tracking_known_habit_id(p_title TEXT) RETURNS INTEGER AS $$
+DECLARE
+    found_id INTEGER;
+BEGIN
+    SELECT id INTO found_id FROM habit_tracking_types WHERE title = p_title;
+    IF found_id IS NULL THEN
+        RAISE EXCEPTION 'unknown habit %', quote_literal(p_title)
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN found_id;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Index of an outcome in the habit's options, NULL for no outcome;
+-- invalid_parameter_value if it isn't one of them.
+CREATE OR REPLACE FUNCTION habit_tracking_known_outcome_index(
+    p_habit_id INTEGER, p_outcome TEXT
+) RETURNS SMALLINT AS $$
+DECLARE
+    found_at BIGINT;
+BEGIN
+    IF coalesce(p_outcome, '') = '' THEN
+        RETURN NULL;
+    END IF;
+    SELECT option.ordinality - 1 INTO found_at
+    FROM habit_tracking_types habit
+    CROSS JOIN LATERAL jsonb_array_elements_text(coalesce(habit.drop_down_fields, '[]'))
+        WITH ORDINALITY option (value, ordinality)
+    WHERE habit.id = p_habit_id AND option.value = p_outcome
+    LIMIT 1;
+    IF found_at IS NULL THEN
+        RAISE EXCEPTION '% is not an option for habit %',
+            quote_literal(p_outcome), p_habit_id
+            USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+    RETURN found_at;
+END;
+$$ LANGUAGE plpgsql STABLE;
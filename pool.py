@@ -0,0 +1,125 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import cursor as pg_cursor
+
+from instrumentation import timer
+
+
+class ConnectionPool:
+    """
+    Long-lived, thread safe pool of Postgres connections.
+
+    Connections that sat in the pool for idle_check_seconds or more are
+    health checked when they are checked out, so one dropped by the server
+    while unused (restart, idle timeout) is thrown away and replaced
+    without the caller noticing.  Recently used ones are handed out
+    unchecked, saving a round trip per checkout; TCP keepalives and the
+    caller's retries cover a connection that breaks in between.
+
+    When all maxconn connections are out, a checkout waits up to
+    wait_seconds for one to come back, instead of failing at once the way
+    psycopg2's pool does.
+    """
+    def __init__(self, minconn: int, maxconn: int, idle_check_seconds: float = 30,
+                 wait_seconds: float = 5, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_check_seconds = idle_check_seconds
+        self.wait_seconds = wait_seconds
+        # One per connection that may be checked out.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.connect_kwargs = connect_kwargs
+        self._pool = None
+        self._lock = threading.Lock()
+        # When each pooled connection was last handed back.
+        self._returned = dict()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool.closed:
+                self._pool = pg_pool.ThreadedConnectionPool(
+                    self.minconn,
+                    self.maxconn,
+                    **self.connect_kwargs
+                )
+            return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        with self._lock:
+            returned = self._returned.get(conn)
+        # New connections, and ones used a moment ago, are taken on trust.
+        if returned is None or time.monotonic() - returned < self.idle_check_seconds:
+            return True
+        try:
+            # A plain cursor keeps health checks out of the query timings.
+            with conn.cursor(cursor_factory=pg_cursor) as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """
+        Check out a healthy connection, reconnecting if needed.  Every
+        connection checked out must be handed back with putconn.
+
+        :return: connection
+        :rtype: psycopg2.extensions.connection
+        :raises psycopg2.pool.PoolError: if none came free in wait_seconds
+        """
+        with timer("db.checkout"):
+            if not self._slots.acquire(timeout=self.wait_seconds):
+                raise pg_pool.PoolError(
+                    f"No connection free after {self.wait_seconds} seconds"
+                )
+            try:
+                return self._getconn()
+            except BaseException:
+                self._slots.release()
+                raise
+
+    def _getconn(self):
+        pool = self._get_pool()
+        # One dead connection per pool slot at most, then a fresh connect.
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._forget(conn)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("No healthy connection available")
+
+    def putconn(self, conn, close=False):
+        """Hand a connection back; it is closed if broken or close is set."""
+        close = close or bool(conn.closed)
+        with self._lock:
+            pool = self._pool
+            if close or pool is None or pool.closed:
+                self._returned.pop(conn, None)
+            else:
+                self._returned[conn] = time.monotonic()
+        try:
+            if pool is None or pool.closed:
+                conn.close()
+                return
+            pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def _forget(self, conn):
+        with self._lock:
+            self._returned.pop(conn, None)
+
+    def closeall(self):
+        """Close every connection; the pool reopens lazily if used again."""
+        with self._lock:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.closeall()
+            self._pool = None
+            self._returned.clear()
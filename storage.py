@@ -0,0 +1,906 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter, namedtuple
+
+from instrumentation import stats, timer
+
+Record = namedtuple(
+    'Record',
+    ['entry_date', 'entry_title', 'outcome_option', 'notes']
+)
+# drop_down_fields is a tuple, shared between habits with the same options.
+TrackingType = namedtuple(
+    'TrackingType',
+    ['title', 'drop_down_fields', 'include_notes']
+)
+
+FETCH_SIZE = 2000
+CHANGES_LIMIT = 5000
+
+SQLITE_PATH = os.path.join(
+    os.path.expanduser("~"), ".tracking_entry", "tracking.sqlite3"
+)
+
+# SQLite versions of migrations/0002_habit_summaries.sql.  Each trigger
+# body is a list of statements guarded by the trigger's WHEN.
+_SQLITE_DONE = "coalesce({row}.outcome_option, '') <> ''"
+_SQLITE_PERIODS = """
+    INSERT INTO habit_tracking_period_counts (entry_title, period, period_start, done)
+    VALUES
+        (NEW.entry_title, 'week', date(NEW.entry_date, 'weekday 0', '-6 days'), {delta}),
+        (NEW.entry_title, 'month', date(NEW.entry_date, 'start of month'), {delta})
+    ON CONFLICT (entry_title, period, period_start)
+    DO UPDATE SET done = done + excluded.done;
+"""
+_SQLITE_STREAK_ADD = """
+    UPDATE habit_tracking_streaks
+    SET run_end = coalesce(
+        (SELECT run_end FROM habit_tracking_streaks
+         WHERE entry_title = NEW.entry_title
+            AND run_start = date(NEW.entry_date, '+1 day')),
+        NEW.entry_date
+    )
+    WHERE entry_title = NEW.entry_title
+        AND run_end = date(NEW.entry_date, '-1 day');
+    INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+    SELECT NEW.entry_title, NEW.entry_date, coalesce(
+        (SELECT run_end FROM habit_tracking_streaks
+         WHERE entry_title = NEW.entry_title
+            AND run_start = date(NEW.entry_date, '+1 day')),
+        NEW.entry_date
+    )
+    WHERE NOT EXISTS (
+        SELECT 1 FROM habit_tracking_streaks
+        WHERE entry_title = NEW.entry_title
+            AND run_start <= NEW.entry_date AND run_end >= NEW.entry_date
+    );
+    DELETE FROM habit_tracking_streaks
+    WHERE entry_title = NEW.entry_title
+        AND run_start = date(NEW.entry_date, '+1 day');
+"""
+_SQLITE_STREAK_REMOVE = """
+    INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+    SELECT entry_title, date(NEW.entry_date, '+1 day'), run_end
+    FROM habit_tracking_streaks
+    WHERE entry_title = NEW.entry_title
+        AND run_start <= NEW.entry_date AND run_end > NEW.entry_date;
+    DELETE FROM habit_tracking_streaks
+    WHERE entry_title = NEW.entry_title AND run_start = NEW.entry_date;
+    UPDATE habit_tracking_streaks
+    SET run_end = date(NEW.entry_date, '-1 day')
+    WHERE entry_title = NEW.entry_title
+        AND run_start < NEW.entry_date AND run_end >= NEW.entry_date;
+"""
+_SQLITE_OUTCOME_ADD = """
+    INSERT INTO habit_tracking_outcome_counts (entry_title, outcome_option, entries)
+    SELECT NEW.entry_title, NEW.outcome_option, 1
+    WHERE coalesce(NEW.outcome_option, '') <> ''
+    ON CONFLICT (entry_title, outcome_option)
+    DO UPDATE SET entries = entries + 1;
+"""
+_SQLITE_OUTCOME_REMOVE = """
+    UPDATE habit_tracking_outcome_counts
+    SET entries = entries - 1
+    WHERE entry_title = OLD.entry_title AND outcome_option = OLD.outcome_option;
+"""
+SQLITE_SUMMARY_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS habit_tracking_outcome_counts (
+        entry_title TEXT NOT NULL,
+        outcome_option TEXT NOT NULL,
+        entries INTEGER NOT NULL,
+        PRIMARY KEY (entry_title, outcome_option)
+    );
+    CREATE TABLE IF NOT EXISTS habit_tracking_period_counts (
+        entry_title TEXT NOT NULL,
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        done INTEGER NOT NULL,
+        PRIMARY KEY (entry_title, period, period_start)
+    );
+    CREATE TABLE IF NOT EXISTS habit_tracking_streaks (
+        entry_title TEXT NOT NULL,
+        run_start TEXT NOT NULL,
+        run_end TEXT NOT NULL,
+        PRIMARY KEY (entry_title, run_start)
+    );
+    CREATE INDEX IF NOT EXISTS habit_tracking_streaks_title_end_idx
+        ON habit_tracking_streaks (entry_title, run_end DESC);
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_summarise_insert
+        AFTER INSERT ON habit_tracking_fields
+        WHEN {_SQLITE_DONE.format(row="NEW")}
+    BEGIN
+        {_SQLITE_OUTCOME_ADD}
+        {_SQLITE_PERIODS.format(delta=1)}
+        {_SQLITE_STREAK_ADD}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_summarise_outcome
+        AFTER UPDATE OF outcome_option ON habit_tracking_fields
+        WHEN OLD.outcome_option IS NOT NEW.outcome_option
+    BEGIN
+        {_SQLITE_OUTCOME_REMOVE}
+        {_SQLITE_OUTCOME_ADD}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_summarise_done
+        AFTER UPDATE OF outcome_option ON habit_tracking_fields
+        WHEN NOT {_SQLITE_DONE.format(row="OLD")} AND {_SQLITE_DONE.format(row="NEW")}
+    BEGIN
+        {_SQLITE_PERIODS.format(delta=1)}
+        {_SQLITE_STREAK_ADD}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_summarise_undone
+        AFTER UPDATE OF outcome_option ON habit_tracking_fields
+        WHEN {_SQLITE_DONE.format(row="OLD")} AND NOT {_SQLITE_DONE.format(row="NEW")}
+    BEGIN
+        {_SQLITE_PERIODS.format(delta=-1)}
+        {_SQLITE_STREAK_REMOVE}
+    END;
+"""
+SQLITE_SUMMARY_BACKFILL = """
+    INSERT INTO habit_tracking_outcome_counts (entry_title, outcome_option, entries)
+    SELECT entry_title, outcome_option, count(*)
+    FROM habit_tracking_fields
+    WHERE coalesce(outcome_option, '') <> ''
+    GROUP BY entry_title, outcome_option;
+    INSERT INTO habit_tracking_period_counts (entry_title, period, period_start, done)
+    SELECT entry_title, 'week', date(entry_date, 'weekday 0', '-6 days'), count(*)
+    FROM habit_tracking_fields
+    WHERE coalesce(outcome_option, '') <> ''
+    GROUP BY 1, 2, 3
+    UNION ALL
+    SELECT entry_title, 'month', date(entry_date, 'start of month'), count(*)
+    FROM habit_tracking_fields
+    WHERE coalesce(outcome_option, '') <> ''
+    GROUP BY 1, 2, 3;
+    INSERT INTO habit_tracking_streaks (entry_title, run_start, run_end)
+    SELECT entry_title, min(entry_date), max(entry_date)
+    FROM (
+        SELECT
+            entry_title,
+            entry_date,
+            julianday(entry_date) - row_number() OVER (
+                PARTITION BY entry_title ORDER BY entry_date
+            ) AS island
+        FROM habit_tracking_fields
+        WHERE coalesce(outcome_option, '') <> ''
+    )
+    GROUP BY entry_title, island;
+"""
+
+SQLITE_CHANGE_FEED = """
+    CREATE TABLE IF NOT EXISTS habit_tracking_change_seq (value INTEGER NOT NULL);
+    INSERT INTO habit_tracking_change_seq (value)
+    SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM habit_tracking_change_seq);
+    CREATE INDEX IF NOT EXISTS habit_tracking_types_change_seq_idx
+        ON habit_tracking_types (change_seq);
+    CREATE INDEX IF NOT EXISTS habit_tracking_fields_change_seq_idx
+        ON habit_tracking_fields (change_seq);
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_types_stamp_change
+        AFTER INSERT ON habit_tracking_types
+    BEGIN
+        UPDATE habit_tracking_change_seq SET value = value + 1;
+        UPDATE habit_tracking_types
+        SET change_seq = (SELECT value FROM habit_tracking_change_seq)
+        WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_stamp_insert
+        AFTER INSERT ON habit_tracking_fields
+    BEGIN
+        UPDATE habit_tracking_change_seq SET value = value + 1;
+        UPDATE habit_tracking_fields
+        SET change_seq = (SELECT value FROM habit_tracking_change_seq)
+        WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_fields_stamp_update
+        AFTER UPDATE OF outcome_option, notes ON habit_tracking_fields
+    BEGIN
+        UPDATE habit_tracking_change_seq SET value = value + 1;
+        UPDATE habit_tracking_fields
+        SET change_seq = (SELECT value FROM habit_tracking_change_seq)
+        WHERE id = NEW.id;
+    END;
+"""
+
+
+def week_start(date):
+    """The Monday of date's week."""
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def search_terms(query):
+    """
+    The lower-cased words of a search, for backends without full-text
+    search, which match notes containing every one of them.
+    """
+    return [
+        term for term in (word.strip('"').lower() for word in query.split())
+        if term
+    ]
+
+
+class Storage:
+    """
+    What db.py needs from a storage backend.
+
+    Methods take and return plain rows; validation, caching and error
+    reporting stay in db.py.  Failures are raised, not returned.
+    """
+    def add_tracking_type(self, title, drop_down_values, include_notes):
+        """Insert a habit unless one with that title already exists."""
+        raise NotImplementedError
+
+    def tracking_types_version(self):
+        """Cheap watermark that changes whenever a habit is added."""
+        raise NotImplementedError
+
+    def tracking_types(self):
+        """All habits as (title, drop_down_values, include_notes) rows."""
+        raise NotImplementedError
+
+    def upsert_records(self, rows):
+        """
+        Upsert (entry_date, entry_title, outcome_option, notes) rows in one
+        transaction; an existing (entry_date, entry_title) gets the new
+        outcome and notes.
+        """
+        raise NotImplementedError
+
+    def bulk_upsert(self, rows):
+        """
+        upsert_records for large loads; backends with a faster bulk path
+        (COPY on Postgres) override it.
+        """
+        self.upsert_records(rows)
+
+    def records_for_titles(self, entry_titles, start_date, end_date):
+        """Records for the titles in the date range, by title, newest first."""
+        raise NotImplementedError
+
+    def records_page(self, entry_title, cursor_date, limit):
+        """Up to limit records on or before cursor_date, newest first."""
+        raise NotImplementedError
+
+    def history_start(self, entry_title):
+        """Date of a habit's oldest record, or None."""
+        raise NotImplementedError
+
+    def iter_records(self, entry_titles=None, start_date=None, end_date=None,
+                     fetch_size=FETCH_SIZE):
+        """
+        Stream records by title then date, fetch_size rows at a time,
+        without loading the table into memory.  Filters left as None
+        don't apply.
+        """
+        raise NotImplementedError
+
+    def habit_summary(self, entry_title, weeks_since, months_since):
+        """
+        One habit's summary in a fixed number of queries, read from the
+        summary tables kept by migrations/0002_habit_summaries.sql.  A day
+        is done when it has an outcome.
+
+        :return: (outcome_counts, latest_run, longest_run, periods) where
+            outcome_counts are (outcome_option, entries) rows, most used
+            first; latest_run is (run_start, run_end) of the newest run of
+            done days, or None; longest_run is the longest run in days; and
+            periods are (period, period_start, done) rows for weeks from
+            weeks_since and months from months_since.
+        """
+        raise NotImplementedError
+
+    def outcome_matrix(self, start_date, end_date):
+        """
+        Every habit's outcomes between two dates, pivoted in one query: a
+        row per habit, in the order they were added, including habits with
+        nothing in the range.  Days without an outcome are left out.
+
+        :return: (title, drop_down_values, offsets, outcomes) rows where
+            offsets are days after start_date and outcomes are the outcome
+            on each of those days
+        """
+        raise NotImplementedError
+
+    def search_notes(self, query, limit, offset):
+        """
+        Records whose notes match query, best match first, then newest
+        first; a page of limit of them, skipping the first offset.
+        """
+        raise NotImplementedError
+
+    def changes_since(self, watermark, limit=CHANGES_LIMIT):
+        """
+        Rows written, by anyone, since watermark (see
+        migrations/0003_change_feed.sql).  Rows may be handed out more
+        than once.  A watermark of None only fetches the current one.
+
+        :return: (tracking_type_rows, records, watermark) where
+            tracking_type_rows are as from tracking_types, records is None
+            if more than limit records changed, and watermark is what to
+            pass next time
+        """
+        raise NotImplementedError
+
+    # Whether wait_for_changes can be told about other clients' commits.
+    notifies = False
+
+    def wait_for_changes(self, timeout):
+        """
+        Block until another client commits, or timeout seconds pass.
+
+        :return: True if notified
+        """
+        raise NotImplementedError
+
+    def online(self):
+        """False while the backend is known to be unreachable."""
+        return True
+
+    def rejects(self, e):
+        """
+        True if e is this backend refusing a write's data, e.g. a broken
+        constraint, so sending the same write again fails the same way.
+        """
+        return False
+
+    def close(self):
+        """Release any connections."""
+
+
+class MemoryStorage(Storage):
+    """Everything in dicts; for tests, benchmarks and trying the app out."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = dict()
+        self._next_id = 1
+        self._records = dict()
+        # change_seq per habit title and per (entry_date, entry_title).
+        self._change_seq = 0
+        self._type_changes = dict()
+        self._record_changes = dict()
+
+    def add_tracking_type(self, title, drop_down_values, include_notes):
+        with self._lock:
+            if title in self._types:
+                return
+            self._types[title] = (
+                self._next_id, list(drop_down_values), include_notes
+            )
+            self._next_id += 1
+            self._change_seq += 1
+            self._type_changes[title] = self._change_seq
+
+    def tracking_types_version(self):
+        with self._lock:
+            return len(self._types), self._next_id - 1
+
+    def tracking_types(self):
+        with self._lock:
+            return [
+                (title, list(drop_down_values), include_notes)
+                for title, (_, drop_down_values, include_notes)
+                in self._types.items()
+            ]
+
+    def upsert_records(self, rows):
+        with self._lock:
+            for entry_date, entry_title, outcome_option, notes in rows:
+                self._records[(entry_date, entry_title)] = Record(
+                    entry_date, entry_title, outcome_option, notes
+                )
+                self._change_seq += 1
+                self._record_changes[(entry_date, entry_title)] = self._change_seq
+
+    def _title_records(self, entry_title):
+        return sorted(
+            (record for (_, title), record in self._records.items()
+             if title == entry_title),
+            key=lambda record: record.entry_date,
+            reverse=True
+        )
+
+    def records_for_titles(self, entry_titles, start_date, end_date):
+        with self._lock:
+            return [
+                record
+                for entry_title in sorted(set(entry_titles))
+                for record in self._title_records(entry_title)
+                if start_date <= record.entry_date <= end_date
+            ]
+
+    def records_page(self, entry_title, cursor_date, limit):
+        with self._lock:
+            records = [
+                record for record in self._title_records(entry_title)
+                if record.entry_date <= cursor_date
+            ]
+        return records[:limit]
+
+    def history_start(self, entry_title):
+        with self._lock:
+            records = self._title_records(entry_title)
+        return records[-1].entry_date if records else None
+
+    def iter_records(self, entry_titles=None, start_date=None, end_date=None,
+                     fetch_size=FETCH_SIZE):
+        with self._lock:
+            records = sorted(
+                self._records.values(),
+                key=lambda record: (record.entry_title, record.entry_date)
+            )
+        for record in records:
+            if entry_titles is not None and record.entry_title not in entry_titles:
+                continue
+            if start_date is not None and record.entry_date < start_date:
+                continue
+            if end_date is not None and record.entry_date > end_date:
+                continue
+            yield record
+
+    def habit_summary(self, entry_title, weeks_since, months_since):
+        # No summary tables here; worked out from the records each time.
+        with self._lock:
+            done = sorted(
+                record for record in self._title_records(entry_title)
+                if record.outcome_option
+            )
+        outcome_counts = Counter(record.outcome_option for record in done)
+        runs = list()
+        for record in done:
+            if runs and runs[-1][1] == record.entry_date - datetime.timedelta(days=1):
+                runs[-1][1] = record.entry_date
+            else:
+                runs.append([record.entry_date, record.entry_date])
+        periods = Counter()
+        for record in done:
+            if week_start(record.entry_date) >= weeks_since:
+                periods['week', week_start(record.entry_date)] += 1
+            if month_start(record.entry_date) >= months_since:
+                periods['month', month_start(record.entry_date)] += 1
+        return (
+            outcome_counts.most_common(),
+            tuple(runs[-1]) if runs else None,
+            max(((end - start).days + 1 for start, end in runs), default=0),
+            [(period, start, count) for (period, start), count in periods.items()]
+        )
+
+    def outcome_matrix(self, start_date, end_date):
+        with self._lock:
+            days = dict()
+            for (entry_date, entry_title), record in self._records.items():
+                if start_date <= entry_date <= end_date and record.outcome_option:
+                    days.setdefault(entry_title, list()).append(
+                        ((entry_date - start_date).days, record.outcome_option)
+                    )
+            rows = list()
+            for title, (_, drop_down_values, _) in self._types.items():
+                outcomes = sorted(days.get(title, ()))
+                rows.append((
+                    title,
+                    list(drop_down_values),
+                    [offset for offset, _ in outcomes],
+                    [outcome for _, outcome in outcomes]
+                ))
+        return rows
+
+    def search_notes(self, query, limit, offset):
+        terms = search_terms(query)
+        if not terms:
+            return list()
+        with self._lock:
+            matches = list()
+            for record in self._records.values():
+                notes = (record.notes or '').lower()
+                if all(term in notes for term in terms):
+                    hits = sum(notes.count(term) for term in terms)
+                    matches.append((-hits, -record.entry_date.toordinal(),
+                                    record.entry_title, record))
+        matches.sort(key=lambda match: match[:3])
+        return [record for *_, record in matches[offset:offset + limit]]
+
+    def changes_since(self, watermark, limit=CHANGES_LIMIT):
+        with self._lock:
+            next_watermark = self._change_seq + 1
+            if watermark is None:
+                return list(), list(), next_watermark
+            tracking_types = [
+                (title, list(self._types[title][1]), self._types[title][2])
+                for title, change_seq in self._type_changes.items()
+                if change_seq >= watermark
+            ]
+            keys = [
+                key for key, change_seq in self._record_changes.items()
+                if change_seq >= watermark
+            ]
+            records = [self._records[key] for key in keys]
+        if len(records) > limit:
+            records = None
+        return tracking_types, records, next_watermark
+
+
+class SqliteStorage(Storage):
+    """
+    A local single file database with the same tables as Postgres.
+
+    One connection, shared between threads behind a lock.
+    """
+    def __init__(self, path: str = SQLITE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        with timer("db.connect"):
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+        stats.count("db.connections_opened")
+        with self._lock, self._conn:
+            new_summaries = not self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'habit_tracking_streaks';"
+            ).fetchone()
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS habit_tracking_types (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT,
+                    drop_down_fields TEXT,
+                    include_notes INTEGER,
+                    change_seq INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS habit_tracking_fields (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entry_date TEXT NOT NULL,
+                    entry_title TEXT NOT NULL,
+                    outcome_option TEXT,
+                    notes TEXT,
+                    change_seq INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (entry_date, entry_title)
+                );
+                CREATE INDEX IF NOT EXISTS habit_tracking_fields_title_date_idx
+                    ON habit_tracking_fields (entry_title, entry_date DESC);
+                """
+            )
+            for table in ('habit_tracking_types', 'habit_tracking_fields'):
+                columns = [
+                    row[1] for row in
+                    self._conn.execute(f"PRAGMA table_info({table});")
+                ]
+                if 'change_seq' not in columns:
+                    # Files from before the change feed.
+                    self._conn.execute(
+                        f"ALTER TABLE {table} "
+                        "ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0;"
+                    )
+            self._conn.executescript(SQLITE_CHANGE_FEED)
+            self._conn.executescript(SQLITE_SUMMARY_SCHEMA)
+            if new_summaries:
+                self._conn.executescript(SQLITE_SUMMARY_BACKFILL)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            with timer("db.execute"):
+                cursor = self._conn.execute(sql, params)
+            with timer("db.fetch"):
+                return cursor.fetchall()
+
+    def _write(self, sql, rows):
+        """executemany then commit, rolling back on failure."""
+        with self._lock:
+            try:
+                with timer("db.execute"):
+                    self._conn.executemany(sql, rows)
+                with timer("db.commit"):
+                    self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    @staticmethod
+    def _record(row):
+        entry_date, entry_title, outcome_option, notes = row
+        return Record(
+            datetime.date.fromisoformat(entry_date),
+            entry_title,
+            outcome_option,
+            notes
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def rejects(self, e):
+        return isinstance(e, (sqlite3.IntegrityError, sqlite3.DataError))
+
+    def add_tracking_type(self, title, drop_down_values, include_notes):
+        self._write(
+            """
+            INSERT INTO habit_tracking_types (
+                title,
+                drop_down_fields,
+                include_notes
+                )
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM habit_tracking_types WHERE title = ?
+            );
+            """,
+            [(title, json.dumps(drop_down_values), include_notes, title)]
+        )
+
+    def tracking_types_version(self):
+        return tuple(
+            self._query("SELECT count(*), max(id) FROM habit_tracking_types;")[0]
+        )
+
+    def tracking_types(self):
+        return [
+            (title, json.loads(drop_down_fields), bool(include_notes))
+            for title, drop_down_fields, include_notes in self._query(
+                """
+                SELECT
+                    title, drop_down_fields, include_notes
+                FROM habit_tracking_types;
+                """
+            )
+        ]
+
+    def upsert_records(self, rows):
+        self._write(
+            """
+            INSERT INTO habit_tracking_fields (
+                entry_date,
+                entry_title,
+                outcome_option,
+                notes
+                )
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (entry_date, entry_title)
+            DO UPDATE SET
+                outcome_option = excluded.outcome_option,
+                notes = excluded.notes;
+            """,
+            [
+                (entry_date.isoformat(), entry_title, outcome_option, notes)
+                for entry_date, entry_title, outcome_option, notes in rows
+            ]
+        )
+
+    def records_for_titles(self, entry_titles, start_date, end_date):
+        entry_titles = list(entry_titles)
+        placeholders = ", ".join("?" * len(entry_titles))
+        rows = self._query(
+            f"""
+            SELECT
+                entry_date, entry_title, outcome_option, notes
+            FROM habit_tracking_fields
+            WHERE entry_title IN ({placeholders})
+                AND entry_date BETWEEN ? AND ?
+            ORDER BY entry_title, entry_date DESC;
+            """,
+            (*entry_titles, start_date.isoformat(), end_date.isoformat())
+        )
+        return [self._record(row) for row in rows]
+
+    def records_page(self, entry_title, cursor_date, limit):
+        rows = self._query(
+            """
+            SELECT
+                entry_date, entry_title, outcome_option, notes
+            FROM habit_tracking_fields
+            WHERE entry_title = ?
+                AND entry_date <= ?
+            ORDER BY entry_date DESC
+            LIMIT ?;
+            """,
+            (entry_title, cursor_date.isoformat(), limit)
+        )
+        return [self._record(row) for row in rows]
+
+    def history_start(self, entry_title):
+        start = self._query(
+            "SELECT min(entry_date) FROM habit_tracking_fields WHERE entry_title = ?;",
+            (entry_title,)
+        )[0][0]
+        return datetime.date.fromisoformat(start) if start else None
+
+    def iter_records(self, entry_titles=None, start_date=None, end_date=None,
+                     fetch_size=FETCH_SIZE):
+        clauses = list()
+        params = list()
+        if entry_titles is not None:
+            entry_titles = list(entry_titles)
+            if not entry_titles:
+                return
+            clauses.append(f"entry_title IN ({', '.join('?' * len(entry_titles))})")
+            params += entry_titles
+        if start_date is not None:
+            clauses.append("entry_date >= ?")
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            clauses.append("entry_date <= ?")
+            params.append(end_date.isoformat())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"""
+            SELECT
+                entry_date, entry_title, outcome_option, notes
+            FROM habit_tracking_fields
+            {where}
+            ORDER BY entry_title, entry_date;
+            """
+        if self.path == ":memory:":
+            # Nothing else can see this database, so read it under the lock.
+            for row in self._query(sql, params):
+                yield self._record(row)
+            return
+        # Its own connection, so a long export doesn't hold up the app.
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                with timer("db.fetch"):
+                    rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._record(row)
+        finally:
+            conn.close()
+
+    def habit_summary(self, entry_title, weeks_since, months_since):
+        outcome_counts = self._query(
+            """
+            SELECT outcome_option, entries
+            FROM habit_tracking_outcome_counts
+            WHERE entry_title = ? AND entries > 0
+            ORDER BY entries DESC, outcome_option;
+            """,
+            (entry_title,)
+        )
+        latest_start, latest_end, longest_run = self._query(
+            """
+            SELECT
+                (SELECT run_start FROM habit_tracking_streaks
+                 WHERE entry_title = ? ORDER BY run_end DESC LIMIT 1),
+                (SELECT max(run_end) FROM habit_tracking_streaks
+                 WHERE entry_title = ?),
+                (SELECT max(julianday(run_end) - julianday(run_start)) + 1
+                 FROM habit_tracking_streaks WHERE entry_title = ?);
+            """,
+            (entry_title, entry_title, entry_title)
+        )[0]
+        periods = self._query(
+            """
+            SELECT period, period_start, done
+            FROM habit_tracking_period_counts
+            WHERE entry_title = ?
+                AND done > 0
+                AND ((period = 'week' AND period_start >= ?)
+                    OR (period = 'month' AND period_start >= ?));
+            """,
+            (entry_title, weeks_since.isoformat(), months_since.isoformat())
+        )
+        return (
+            [tuple(row) for row in outcome_counts],
+            (
+                datetime.date.fromisoformat(latest_start),
+                datetime.date.fromisoformat(latest_end)
+            ) if latest_start else None,
+            int(longest_run or 0),
+            [
+                (period, datetime.date.fromisoformat(period_start), done)
+                for period, period_start, done in periods
+            ]
+        )
+
+    def outcome_matrix(self, start_date, end_date):
+        rows = self._query(
+            """
+            SELECT
+                habit.title,
+                habit.drop_down_fields,
+                json_group_array(
+                    CAST(julianday(entry.entry_date) - julianday(?1) AS INTEGER)
+                ) FILTER (WHERE entry.id IS NOT NULL),
+                json_group_array(entry.outcome_option)
+                    FILTER (WHERE entry.id IS NOT NULL)
+            FROM habit_tracking_types habit
+            LEFT JOIN habit_tracking_fields entry
+                ON entry.entry_title = habit.title
+                AND entry.entry_date BETWEEN ?1 AND ?2
+                AND coalesce(entry.outcome_option, '') <> ''
+            GROUP BY habit.id
+            ORDER BY habit.id;
+            """,
+            (start_date.isoformat(), end_date.isoformat())
+        )
+        return [
+            (title, json.loads(drop_down_fields or '[]'),
+             json.loads(offsets), json.loads(outcomes))
+            for title, drop_down_fields, offsets, outcomes in rows
+        ]
+
+    def search_notes(self, query, limit, offset):
+        # No full-text index here: every word has to appear, and entries
+        # with more occurrences rank higher.
+        terms = search_terms(query)
+        if not terms:
+            return list()
+        patterns = [
+            "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            for term in terms
+        ]
+        matches = " AND ".join(["notes LIKE ? ESCAPE '\\'"] * len(terms))
+        hits = " + ".join(
+            ["(length(notes) - length(replace(lower(notes), ?, ''))) / length(?)"] * len(terms)
+        )
+        rows = self._query(
+            f"""
+            SELECT
+                entry_date, entry_title, outcome_option, notes
+            FROM habit_tracking_fields
+            WHERE {matches}
+            ORDER BY {hits} DESC, entry_date DESC, entry_title
+            LIMIT ? OFFSET ?;
+            """,
+            (
+                *patterns,
+                *(value for term in terms for value in (term, term)),
+                limit,
+                offset
+            )
+        )
+        return [self._record(row) for row in rows]
+
+    def changes_since(self, watermark, limit=CHANGES_LIMIT):
+        # Writers are serialised, so the counter is committed in order and
+        # anything written after it's read gets a higher change_seq.
+        next_watermark = self._query(
+            "SELECT value + 1 FROM habit_tracking_change_seq;"
+        )[0][0]
+        if watermark is None:
+            return list(), list(), next_watermark
+        tracking_types = [
+            (title, json.loads(drop_down_fields), bool(include_notes))
+            for title, drop_down_fields, include_notes in self._query(
+                """
+                SELECT
+                    title, drop_down_fields, include_notes
+                FROM habit_tracking_types
+                WHERE change_seq >= ?;
+                """,
+                (watermark,)
+            )
+        ]
+        rows = self._query(
+            """
+            SELECT
+                entry_date, entry_title, outcome_option, notes
+            FROM habit_tracking_fields
+            WHERE change_seq >= ?
+            ORDER BY change_seq
+            LIMIT ?;
+            """,
+            (watermark, limit + 1)
+        )
+        records = [self._record(row) for row in rows] if len(rows) <= limit else None
+        return tracking_types, records, next_watermark
+
+
+def make_storage(kind: str):
+    """
+    Build the backend named by kind: postgres, sqlite or memory.
+
+    psycopg2 is only imported when the Postgres backend is asked for.
+    """
+    if kind == "postgres":
+        from pg_storage import PostgresStorage
+        return PostgresStorage()
+    if kind == "sqlite":
+        return SqliteStorage(os.getenv("TRACKING_SQLITE_PATH", SQLITE_PATH))
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {kind}")
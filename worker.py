@@ -0,0 +1,170 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+POLL_MS = 50
+
+
+class DbWorker:
+    """
+    Runs database calls off the Tk thread.
+
+    Jobs run on a single background thread, so writes keep their order.
+    Results go onto a queue that the Tk thread drains with after(), and
+    callbacks always run on the Tk thread.
+
+    Jobs submitted with a key are coalesced: a newer job with the same key
+    cancels an older one that has not started, and the older one's
+    callback is dropped if it already ran.
+
+    The thread is a daemon, so a job stuck on a slow query doesn't keep
+    the app from closing; shutdown waits for it only so long.
+    """
+    def __init__(self, root, poll_ms: int = POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._work,
+            name="db-worker",
+            daemon=True
+        )
+        self._thread.start()
+        self._results = queue.Queue()
+        self._tickets = itertools.count()
+        self._latest = dict()
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._after_id = None
+        self._closed = False
+
+    def start(self):
+        """Start draining results on the Tk thread."""
+        if self._after_id is None and not self._closed:
+            self._after_id = self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, func, *args, callback=None, key=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) to run in the background.
+
+        :param callback: called on the Tk thread with the result
+        :param key: coalescing key, only the newest job per key reports
+        :return: ticket for the job
+        :rtype: int
+        """
+        ticket = next(self._tickets)
+        with self._lock:
+            if key is not None:
+                self._latest[key] = ticket
+                stale = self._pending.pop(key, None)
+                if stale is not None:
+                    stale.cancel()
+            future = Future()
+            self._jobs.put((future, (ticket, key, func, args, kwargs, callback)))
+            if key is not None:
+                self._pending[key] = future
+        return ticket
+
+    def spawn(self, func, *args, callback=None, name="db-job", **kwargs):
+        """
+        Run func(*args, **kwargs) on a thread of its own, for long jobs
+        that open their own connection and shouldn't hold up the queue.
+        The callback runs on the Tk thread as with submit; spawned jobs
+        aren't coalesced, and stopping one is up to func.
+
+        :return: the thread
+        :rtype: threading.Thread
+        """
+        thread = threading.Thread(
+            target=self._run,
+            args=(next(self._tickets), None, func, args, kwargs, callback),
+            name=name,
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    def cancel(self, key):
+        """Drop any outstanding job for key."""
+        with self._lock:
+            self._latest.pop(key, None)
+            stale = self._pending.pop(key, None)
+        if stale is not None:
+            stale.cancel()
+
+    def is_pending(self, key):
+        """True while a job for key has not reported back."""
+        with self._lock:
+            return key in self._latest
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, args = job
+            # False if it was cancelled while queued.
+            if future.set_running_or_notify_cancel():
+                self._run(*args)
+                future.set_result(None)
+
+    def _run(self, ticket, key, func, args, kwargs, callback):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            print(str(e))
+            result = None
+        self._results.put((ticket, key, callback, result))
+
+    def _is_current(self, ticket, key):
+        if key is None:
+            return True
+        with self._lock:
+            if self._latest.get(key) != ticket:
+                return False
+            del self._latest[key]
+            self._pending.pop(key, None)
+            return True
+
+    def _poll(self):
+        self._after_id = None
+        while True:
+            try:
+                ticket, key, callback, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if not self._is_current(ticket, key) or callback is None:
+                continue
+            try:
+                callback(result)
+            except Exception as e:
+                print(str(e))
+        self.start()
+
+    def shutdown(self, timeout: float = None):
+        """
+        Stop polling and drop queued jobs, waiting at most timeout seconds
+        for the running one.  One still running after that is left to the
+        daemon thread, which dies with the app.
+
+        :return: True if the worker thread has finished
+        :rtype: bool
+        """
+        self._closed = True
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].cancel()
+        self._jobs.put(None)
+        self._thread.join(timeout=timeout)
+        return not self._thread.is_alive()